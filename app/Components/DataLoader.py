@@ -1,43 +1,407 @@
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+import hashlib
+import logging
+import os
+import shutil
+import time
+import urllib.request
 
+from .schema import DATETIME_FORMATS, DERIVED, SCHEMA, SCHEMA_VERSION, apply_schema, memory_footprint, parse_datetimes, used_columns
+from .shared_store import attach_columns, export_columns, has_columns
 
-import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+log = logging.getLogger(__name__)
+
+
+# Deployment CSV (hosted online), can be overridden with a local path for offline runs
+DATA_URL = "https://storage.googleapis.com/crashes_datadet/reduced_file.csv"
+DATA_SOURCE = os.environ.get("CRASHES_DATA_SOURCE", DATA_URL)
+
+# Columnar cache so warm starts skip both the download and the CSV parse
+CACHE_DIR = os.environ.get("CRASHES_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".cache"))
+CACHE_ENABLED = os.environ.get("CRASHES_CACHE", "1") != "0"
+
+# Serve the dataset from memory-mapped column files shared by all workers
+SHARED_COLUMNS = os.environ.get("CRASHES_SHARED_COLUMNS", "1") != "0"
+
+
+
+# Columns the dataset rows are sorted on, so the rows of a year (or year and borough)
+# are one contiguous range (see indexes.ZoneMap). Empty keeps the source order.
+CLUSTER_KEY = [col for col in os.environ.get("CRASHES_CLUSTER_KEY", "CRASH_YEAR,BOROUGH,CRASH_DATETIME").split(",") if col]
+
+# Parse local CSVs with pyarrow's multithreaded reader ("0" uses pandas)
+ARROW_CSV = os.environ.get("CRASHES_ARROW_CSV", "1") != "0"
+
+# Bytes of CSV parsed at a time by each reader thread
+CSV_BLOCK_BYTES = 16 << 20
+
+
+# --- CSV ingestion ---
+def _arrow_type(kind):
+    """Arrow type a schema kind is read as; datetimes are read as text and parsed afterwards."""
+    return {
+        'category': pa.dictionary(pa.int32(), pa.string()),
+        'count': pa.float64(),
+        'float32': pa.float32(),
+        'year': pa.float64(),
+        'datetime': pa.string(),
+    }[kind]
+
+def _pandas_dtype(kind):
+    return {'category': 'category', 'count': 'float64', 'float32': 'float32', 'year': 'float64', 'datetime': 'object'}[kind]
+
+def _arrow_datetimes(column):
+    """A text column parsed with each of DATETIME_FORMATS in turn in Arrow, as a datetime Series."""
+    parsed = None
+    for date_format in DATETIME_FORMATS:
+        dates = pc.strptime(column, format=date_format, unit='ns', error_is_null=True)
+        parsed = dates if parsed is None else pc.coalesce(parsed, dates)
+    dates = parsed.to_pandas()
+    # Values in none of the formats go through pandas' inference
+    left = pc.and_(pc.is_valid(column), pc.is_null(parsed)).to_numpy(zero_copy_only=False)
+    if left.any():
+        dates[left] = parse_datetimes(pd.Series(column.to_numpy(zero_copy_only=False)[left]), ()).to_numpy()
+    return dates
+
+def _arrow_frame(table):
+    """An Arrow table of schema columns as a DataFrame, datetime columns parsed."""
+    dates = [col for col in table.column_names if SCHEMA[col] == 'datetime']
+    df = table.drop_columns(dates).to_pandas() if dates else table.to_pandas()
+    for col in dates:
+        df[col] = _arrow_datetimes(table[col]).to_numpy()
+    for col in df.columns:
+        # Categories in sorted order like pandas gives them, not in order of appearance
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories))
+    return df[table.column_names]
+
+def _arrow_options(source):
+    columns = used_columns(pa_csv.open_csv(source).schema.names)
+    # pandas' missing-value markers, so both readers agree on what is missing
+    null_values = pa_csv.ConvertOptions().null_values + ['None', '<NA>']
+    convert = pa_csv.ConvertOptions(include_columns=columns, strings_can_be_null=True, null_values=null_values,
+                                    column_types={col: _arrow_type(SCHEMA[col]) for col in columns})
+    return pa_csv.ReadOptions(use_threads=True, block_size=CSV_BLOCK_BYTES), convert
+
+def _use_arrow(source, engine):
+    engine = engine or ('arrow' if ARROW_CSV else 'pandas')
+    return engine == 'arrow' and pa is not None and not _is_url(source)
+
+def read_csv(source, engine=None):
+    """
+    The schema columns of a crash CSV, typed as declared in the schema rather than
+    inferred. Local files are parsed by pyarrow's multithreaded reader and their
+    datetimes with fixed formats (engine='arrow', the default unless CRASHES_ARROW_CSV=0);
+    URLs, or engine='pandas', use pandas with the same dtypes. Logs the rows/sec.
+    """
+    start = time.perf_counter()
+    if _use_arrow(source, engine):
+        read_options, convert_options = _arrow_options(source)
+        df = _arrow_frame(pa_csv.read_csv(source, read_options=read_options, convert_options=convert_options))
+    else:
+        df = pd.read_csv(source, usecols=lambda col: col in SCHEMA, low_memory=False,
+                         dtype={col: _pandas_dtype(kind) for col, kind in SCHEMA.items()})
+    seconds = time.perf_counter() - start
+    log.info("Parsed %d rows in %.1fs (%.0f rows/s)", len(df), seconds, len(df) / seconds if seconds else 0)
+    return df
+
+def iter_csv_chunks(source, chunk_rows, engine=None):
+    """read_csv() of a CSV in chunks of about chunk_rows rows (Arrow's are cut by CSV_BLOCK_BYTES)."""
+    if _use_arrow(source, engine):
+        read_options, convert_options = _arrow_options(source)
+        for batch in pa_csv.open_csv(source, read_options=read_options, convert_options=convert_options):
+            yield _arrow_frame(pa.Table.from_batches([batch]))
+    else:
+        yield from pd.read_csv(source, usecols=lambda col: col in SCHEMA, chunksize=chunk_rows, low_memory=False,
+                               dtype={col: _pandas_dtype(kind) for col, kind in SCHEMA.items()})
+
+
+# --- Cache helpers ---
+def _is_url(source):
+    return source.startswith(("http://", "https://"))
+
+def _source_version(source):
+    """
+    Returns a string identifying the current content of the source:
+    the ETag (or Last-Modified + length) for a URL, a content hash for a local file.
+    Returns None if the source cannot be reached.
+    """
+    try:
+        if _is_url(source):
+            request = urllib.request.Request(source, method="HEAD")
+            with urllib.request.urlopen(request, timeout=10) as response:
+                headers = response.headers
+                version = headers.get("ETag") or "{}-{}".format(
+                    headers.get("Last-Modified", ""), headers.get("Content-Length", ""))
+                return version.strip('"') or None
+
+        digest = hashlib.sha256()
+        if os.path.isdir(source):
+            # A partition directory (e.g. written by etl.py): its file names, sizes and times
+            for root, _, files in sorted(os.walk(source)):
+                for name in sorted(files):
+                    info = os.stat(os.path.join(root, name))
+                    digest.update(f"{os.path.relpath(os.path.join(root, name), source)}|{info.st_size}|{info.st_mtime_ns}".encode("utf-8"))
+            return digest.hexdigest()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
 
-def load_data():
+    except Exception as e:
+        log.warning("Could not check source version: %s", e)
+        return None
+
+def _cache_prefix(source):
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+
+def _cache_stem(source, version, cache_dir):
+    """Path (without extension) shared by the Parquet snapshot and the memory-mapped columns."""
+    # The schema version and the clustering key are part of the key, so changing either rebuilds the snapshot
+    key = hashlib.sha1(f"{version}|schema-{SCHEMA_VERSION}|cluster-{','.join(CLUSTER_KEY)}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{_cache_prefix(source)}-{key}")
+
+def _latest_cache(source, cache_dir, suffix=".parquet"):
+    """Most recent cache stem for a source, used when the source is unreachable."""
+    if not os.path.isdir(cache_dir):
+        return None
+    prefix = _cache_prefix(source) + "-"
+    files = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)
+             if f.startswith(prefix) and f.endswith(suffix)]
+    return os.path.splitext(max(files, key=os.path.getmtime))[0] if files else None
+
+def _read_cache(path):
     try:
-        # Deployment CSV (hosted online)
-        file_url = "https://storage.googleapis.com/crashes_datadet/reduced_file.csv"
-        print("Loading full dataset from bucket...")
-
-        # Load entire CSV
-        df = pd.read_csv(
-            file_url,
-            low_memory=False
-        )
-
-        # Convert datetime if column exists
-        if 'CRASH_DATETIME' in df.columns:
-            df['CRASH_DATETIME'] = pd.to_datetime(df['CRASH_DATETIME'], errors='coerce')
-            df['CRASH_MONTH'] = df['CRASH_DATETIME'].dt.month
-            df['CRASH_HOUR'] = df['CRASH_DATETIME'].dt.hour
-
-        # Convert categorical columns if they exist (optional)
-        categorical_cols = ['BOROUGH', 'CONTRIBUTING FACTOR VEHICLE 1', 'CONTRIBUTING FACTOR VEHICLE 2',
-                            'VEHICLE TYPE CODE 1', 'VEHICLE TYPE CODE 2', 'MOST_COMMON_SEX']
-        for col in categorical_cols:
-            if col in df.columns:
-                df[col] = df[col].astype('category')
-
-        print(f"✅ Loaded {len(df)} rows from the bucket")
+        return pd.read_parquet(path)
+    except Exception as e:
+        log.warning("Ignoring unreadable cache %s: %s", path, e)
+        return None
+
+def _write_cache(df, source, version, cache_dir):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Remove older snapshots of the same source
+        prefix = _cache_prefix(source) + "-"
+        for f in os.listdir(cache_dir):
+            if f.startswith(prefix):
+                path = os.path.join(cache_dir, f)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+        path = _cache_stem(source, version, cache_dir) + ".parquet"
+        tmp_path = path + ".tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        log.info("Cached dataset to %s", path)
+    except ImportError:
+        log.warning("pyarrow is not installed, skipping dataset cache")
+    except Exception as e:
+        log.warning("Could not write dataset cache: %s", e)
+
+def _attach_shared(df, stem):
+    """
+    Swaps df for read-only memory maps of its columns so that every gunicorn
+    worker shares the same pages. Returns df unchanged if that fails.
+    """
+    columns_dir = stem + ".columns"
+    try:
+        if not has_columns(columns_dir):
+            export_columns(df, columns_dir)
+        return attach_columns(columns_dir)
+    except Exception as e:
+        log.warning("Could not memory-map dataset columns: %s", e)
+        return df
+
+
+# --- Load data function ---
+def prepare_data(df):
+    """
+    Applies the column schema (schema.py): unused columns are dropped, counts, coordinates
+    and years get the narrowest dtypes, text dimensions become categories and the
+    month/hour date parts are derived. Logs the memory footprint before and after.
+    """
+    before = memory_footprint(df)
+    df = apply_schema(df)
+    after = memory_footprint(df)
+    log.info("Memory footprint: %.1f MB as parsed -> %.1f MB", before / 2**20, after / 2**20)
+    return df
+
+def cluster_rows(df, key=None):
+    """
+    df sorted on the clustering key columns it has (CLUSTER_KEY by default), missing
+    values last, on a fresh index. Categories sort in their (sorted) category order.
+    """
+    columns = [col for col in (CLUSTER_KEY if key is None else key) if col in df.columns]
+    if not columns or df.empty:
+        return df
+    return df.sort_values(columns, kind='stable', na_position='last', ignore_index=True)
+
+def load_data(source=None, cache_dir=None, use_cache=None):
+    """
+    Loads the crash dataset from a URL, a local CSV path or a directory of year partitions (etl.py).
+    The rows are sorted on CLUSTER_KEY. A Parquet snapshot keyed on the source's ETag/content
+    hash is reused on warm starts, and the columns are served from memory maps shared
+    across worker processes.
+    """
+    source = source or DATA_SOURCE
+    cache_dir = cache_dir or CACHE_DIR
+    use_cache = CACHE_ENABLED if use_cache is None else use_cache
+
+    try:
+        version = _source_version(source)
+        stem = None
+
+        if use_cache:
+            # Source unreachable: fall back to the last snapshot we have
+            stem = _cache_stem(source, version, cache_dir) if version is not None else _latest_cache(source, cache_dir)
+
+            if stem is not None and SHARED_COLUMNS and has_columns(stem + ".columns"):
+                df = attach_columns(stem + ".columns")
+                log.info("Attached %d rows from %s.columns", len(df), stem)
+                return df
+
+            cached = _read_cache(stem + ".parquet") if stem and os.path.exists(stem + ".parquet") else None
+            if cached is not None:
+                log.info("Loaded %d rows from cache %s.parquet", len(cached), stem)
+                return _attach_shared(cached, stem) if SHARED_COLUMNS else cached
+
+        log.info("Loading full dataset from %s...", source)
+
+        if os.path.isdir(source):
+            df = read_partitions(source)
+        else:
+            # Load entire CSV, skipping the columns the schema drops
+            df = prepare_data(read_csv(source))
+
+        # Stored sorted so filters on the leading key columns resolve to row ranges
+        df = cluster_rows(df)
+
+        if use_cache and version is not None:
+            _write_cache(df, source, version, cache_dir)
+            if SHARED_COLUMNS:
+                df = _attach_shared(df, stem)
+
+        log.info("Loaded %d rows from %s", len(df), source)
 
         return df
 
     except Exception as e:
-        print(f"ERROR: {e}")
+        log.exception("Could not load dataset: %s", e)
         return pd.DataFrame()
 
 
-    
+# --- Year partitions ---
+# Rows read from the CSV at a time while splitting it by year
+PARTITION_CHUNK_ROWS = int(os.environ.get("CRASHES_PARTITION_CHUNK_ROWS", 500000))
+
+def partition_name(year):
+    return "year=none" if pd.isna(year) else f"year={int(year)}"
+
+def write_partitions(chunks, directory):
+    """
+    Splits an iterable of raw DataFrame chunks by CRASH_YEAR into one sub-directory of
+    Parquet parts per year (year=2019/part-00000.parquet, ...). The write is atomic.
+    """
+    tmp_dir = directory + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    for i, chunk in enumerate(chunks):
+        # Each part is sorted, so a partition is a few sorted runs
+        chunk = cluster_rows(apply_schema(chunk))
+        years = chunk['CRASH_YEAR'] if 'CRASH_YEAR' in chunk.columns else pd.Series(float('nan'), index=chunk.index)
+        for year, part in chunk.groupby(years, dropna=False, sort=False):
+            part_dir = os.path.join(tmp_dir, partition_name(year))
+            os.makedirs(part_dir, exist_ok=True)
+            part.to_parquet(os.path.join(part_dir, f"part-{i:05d}.parquet"), index=False)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+
+def read_partition(directory):
+    """The prepared rows of one year partition written by write_partitions()."""
+    parts = [pd.read_parquet(os.path.join(directory, f)) for f in sorted(os.listdir(directory)) if f.endswith(".parquet")]
+    df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+    # Parts can disagree on categories and integer widths, so the schema is applied again
+    return apply_schema(df)
+
+def read_partitions(directory):
+    """All the year partitions of a directory written by write_partitions(), as one frame."""
+    years = sorted(name for name in os.listdir(directory) if name.startswith("year="))
+    frames = [read_partition(os.path.join(directory, name)) for name in years]
+    if not frames:
+        return pd.DataFrame()
+    return apply_schema(pd.concat(frames, ignore_index=True)) if len(frames) > 1 else frames[0]
+
+def load_partitions(source=None, cache_dir=None):
+    """
+    Directory of the dataset partitioned by year, next to the other cache files and
+    keyed the same way. On first use the CSV is split in chunks, so the whole
+    dataset is never resident. A source that already is a partition directory (as
+    written by etl.py) is used as it is. Returns None if there is neither a source
+    nor a cache.
+    """
+    source = source or DATA_SOURCE
+    cache_dir = cache_dir or CACHE_DIR
+    if os.path.isdir(source):
+        return source
+
+    version = _source_version(source)
+    if version is None:
+        stem = _latest_cache(source, cache_dir, suffix=".years")
+        return stem + ".years" if stem else None
+
+    directory = _cache_stem(source, version, cache_dir) + ".years"
+    if os.path.isdir(directory):
+        return directory
+
+    log.info("Partitioning dataset from %s by year...", source)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Remove partitions of older versions of the same source
+    prefix = _cache_prefix(source) + "-"
+    for f in os.listdir(cache_dir):
+        if f.startswith(prefix) and f.endswith(".years"):
+            shutil.rmtree(os.path.join(cache_dir, f), ignore_errors=True)
+
+    write_partitions(iter_csv_chunks(source, PARTITION_CHUNK_ROWS), directory)
+    log.info("Partitioned dataset into %s", directory)
+    return directory
+
+
+# --- Incremental refresh ---
+def load_delta(path):
+    """Reads a file (CSV or Parquet) of new crash records and prepares it like the main dataset."""
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+    else:
+        df = read_csv(path)
+    log.info("Loaded %d new rows from %s", len(df), path)
+    return prepare_data(df)
+
+def append_rows(df, delta):
+    """
+    df with the rows of delta appended, on a fresh 0..n-1 index. Categorical columns keep
+    their categories in place and add new values after them, so existing codes stay valid.
+    """
+    delta = delta.reindex(columns=df.columns)
+    columns = {}
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            added = delta[col].astype('category')
+            columns[col] = pd.Series(union_categoricals([df[col], added], sort_categories=False))
+        else:
+            columns[col] = pd.concat([df[col], delta[col]], ignore_index=True)
+    return pd.DataFrame(columns)
+
+
 # --- Filtering Functions ---
 def get_options(df, column_name):
     
@@ -45,44 +409,205 @@ def get_options(df, column_name):
     if df.empty or column_name not in df.columns:
         return []
     
-    # Get unique values and convert to string
-    items = df[column_name].astype(str).unique()
+    # Get unique values and convert to string (categories are read from the dictionary)
+    series = df[column_name]
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        items = series.cat.remove_unused_categories().cat.categories.astype(str)
+    else:
+        items = series.astype(str).unique()
     
+    return options_from_values(items)
+
+def _clean_values(items):
     # Filter out nan/null strings
-    clean_items = [i for i in items if i.lower() not in ['nan', 'none', '', 'null']]
+    return [i for i in set(items) if i.lower() not in ['nan', 'none', '', 'null']]
+
+def options_from_values(items):
+    """Dropdown options of a set of string values."""
     
-    # Return sorted top 50
-    return [{'label': i, 'value': i} for i in sorted(clean_items)][:50]
+    # Return sorted
+    return [{'label': i, 'value': i} for i in sorted(_clean_values(items))]
+
+def facet_options(counts, selected=None):
+    """
+    Dropdown options of a facet: every value with matching rows, labelled with its row
+    count (counts is a Series of counts per value). The selected values stay listed
+    even without rows, so the dropdown keeps showing them.
+    """
+    counts = counts.rename(index=str)
+    selected = selected if isinstance(selected, (list, tuple)) else [selected]
+    keep = [i for i in _clean_values(counts.index) if counts[i] > 0 or i in selected]
+    return [{'label': f"{i} ({int(counts[i]):,})", 'value': i} for i in sorted(keep)]
+
+def merge_options(options, added):
+    """get_options() of the union of two datasets, from the options of each."""
+    return options_from_values({o['value'] for o in options} | {o['value'] for o in added})
+
+# Map of 'Filter ID' -> 'Column Name'
+FILTER_MAP = {
+    'borough': 'BOROUGH',
+    'year': 'CRASH_YEAR',
+    'factor1': 'CONTRIBUTING FACTOR VEHICLE 1',
+    'factor2': 'CONTRIBUTING FACTOR VEHICLE 2',
+    'vehicle1': 'VEHICLE TYPE CODE 1',
+    'vehicle2': 'VEHICLE TYPE CODE 2',
+    'demographic': 'MOST_COMMON_SEX'
+}
+
+# Multi-valued filters: 'Filter ID' -> its slot columns. A row matches when any of its
+# slots holds a selected value, e.g. any vehicle of the crash is a taxi
+MULTI_FILTER_MAP = {
+    'factor': [f'CONTRIBUTING FACTOR VEHICLE {i}' for i in range(1, 6)],
+    'vehicle': [f'VEHICLE TYPE CODE {i}' for i in range(1, 6)]
+}
+
+def filter_options(options, key):
+    """
+    Dropdown options of the filter key, given options(col) of a column. A multi-valued
+    filter lists the values of all its slot columns.
+    """
+    if key in FILTER_MAP:
+        return options(FILTER_MAP[key])
+    merged = []
+    for col in MULTI_FILTER_MAP[key]:
+        merged = merge_options(merged, options(col))
+    return merged
+
+def filter_values(key, value):
+    """
+    The values a filter input selects, as a tuple, or None when it doesn't filter.
+    A dropdown gives one value or a list of values (multi-select); the year is one
+    year, or an inclusive [first, last] range from the year RangeSlider.
+    """
+    values = [v for v in (value if isinstance(value, (list, tuple)) else [value]) if v and v != 'ALL']
+    if not values:
+        return None
+    if key == 'year':
+        try:
+            years = [int(v) for v in values]
+        except (TypeError, ValueError):
+            return None # Ignore if year conversion fails
+        if isinstance(value, (list, tuple)) and len(years) == 2:
+            return tuple(range(min(years), max(years) + 1))
+        return tuple(years)
+    return tuple(values)
 
 # --- Apply all filters function ---
-def filter_dataframe(df, inputs):
+def filter_dataframe(df, inputs, index=None):
+    """
+    Applies the dropdown/slider filters in inputs (see filter_values()).
+    With a FilterIndex built on df, rows are resolved from the index and only the
+    selected rows are gathered instead of copying and scanning the whole frame.
+    """
     
     # Check if dataframe is empty
     if df.empty: return df
-    dff = df.copy()
-    
-    # Map of 'Filter ID' -> 'Column Name'
-    filter_map = {
-        'borough': 'BOROUGH',
-        'year': 'CRASH_YEAR',
-        'factor1': 'CONTRIBUTING FACTOR VEHICLE 1',
-        'factor2': 'CONTRIBUTING FACTOR VEHICLE 2',
-        'vehicle1': 'VEHICLE TYPE CODE 1',
-        'vehicle2': 'VEHICLE TYPE CODE 2',
-        'demographic': 'MOST_COMMON_SEX'
-    }
-    
-    #Looping over the dataFrame to apply filters
-    for key, col in filter_map.items():
-        value = inputs.get(key)
-        if value and value != 'ALL' and col in dff.columns:
-            # Handle numeric year vs string columns
-            if key == 'year':
-                try:
-                    dff = dff[dff[col] == int(value)]
-                except ValueError:
-                    pass # Ignore if year conversion fails
-            else:
-                dff = dff[dff[col] == value]
-                
-    return dff
\ No newline at end of file
+
+    if index is not None:
+        rows = index.select(inputs)
+        # Shallow copy so callers can't rename or replace the shared frame's columns
+        return df.copy(deep=False) if rows is None else df.take(rows)
+
+    #Combining the filters into one mask so the frame is sliced once at the end
+    mask = None
+    for key, col in FILTER_MAP.items():
+        values = filter_values(key, inputs.get(key))
+        if values is not None and col in df.columns:
+            matches = df[col].isin(values).to_numpy()
+            mask = matches if mask is None else mask & matches
+    for key, cols in MULTI_FILTER_MAP.items():
+        values = filter_values(key, inputs.get(key))
+        if values is not None:
+            matches = np.zeros(len(df), dtype=bool)
+            for col in cols:
+                if col in df.columns:
+                    matches |= df[col].isin(values).to_numpy()
+            mask = matches if mask is None else mask & matches
+
+    return df.copy(deep=False) if mask is None else df.take(np.flatnonzero(mask))
+
+
+# ---Search Function ---
+def apply_search_filter(dataframe, search_text, logic="AND", index=None):
+    """
+    Filters the dataframe based on search_text across multiple columns.
+    With a SearchIndex, matches are answered from the index; dataframe must then keep
+    the row labels of the frame the index was built on (as filter_dataframe does).
+    The passed-in frame is never modified.
+    """
+    if not search_text or not isinstance(search_text, str) or search_text.strip() == "":
+        return dataframe
+
+    if index is not None:
+        return dataframe[index.match(search_text, logic, rows=dataframe.index.to_numpy())]
+
+    # Normalize column names without renaming the caller's frame
+    columns = {col.strip().upper(): col for col in dataframe.columns}
+
+    search_text_lower = search_text.lower().strip()
+    search_terms = search_text_lower.split()
+
+    # Define searchable columns
+    search_columns = [
+        'BOROUGH', 
+        'VEHICLE TYPE CODE 1', 
+        'CONTRIBUTING FACTOR VEHICLE 1',
+        'MOST_COMMON_SEX',
+        'VEHICLE TYPE CODE 2',
+        'CONTRIBUTING FACTOR VEHICLE 2',
+        'VEHICLE TYPE CODE 3', 
+        'CONTRIBUTING FACTOR VEHICLE 3',
+        'VEHICLE TYPE CODE 4',
+        'CONTRIBUTING FACTOR VEHICLE 4',
+        'VEHICLE TYPE CODE 5',
+        'CONTRIBUTING FACTOR VEHICLE 5'
+    ]
+
+    # Include year/date/time columns if they exist (not the internal DERIVED date parts)
+    year_cols = [col for col in columns if columns[col] not in DERIVED and any(term in col for term in ['YEAR','DATE','TIME'])]
+    search_columns.extend(year_cols)
+
+    # Filter columns that actually exist
+    available_columns = [col for col in search_columns if col in columns]
+
+    if not available_columns:
+        log.warning("No searchable columns found")
+        return dataframe
+
+    # Lowercase text per column, outside the frame; categorical columns only convert their
+    # dictionary and are matched through the codes, so no per-row strings are built
+    text_columns = {col: _lower_text(dataframe[columns[col]]) for col in available_columns}
+
+    # Initialize final mask
+    if logic.upper() == "AND":
+        final_mask = np.ones(len(dataframe), dtype=bool)
+    else:
+        final_mask = np.zeros(len(dataframe), dtype=bool)
+
+    # Apply search terms
+    for term in search_terms:
+        term_mask = np.zeros(len(dataframe), dtype=bool)
+        for col in available_columns:
+            term_mask |= _contains(text_columns[col], term)
+        if logic.upper() == "AND":
+            final_mask &= term_mask
+        else:
+            final_mask |= term_mask
+
+    return dataframe.take(np.flatnonzero(final_mask))
+
+def _lower_text(series):
+    """(codes, lowercase dictionary) of a categorical column, or its lowercase strings."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), series.cat.categories.astype(str).str.lower()
+    return None, series.astype(str).str.lower()
+
+def _contains(text, term):
+    """Boolean array of the rows whose lowercase text contains term."""
+    codes, values = text
+    matches = values.str.contains(term, regex=False, na=False)
+    if codes is None:
+        return matches.to_numpy()
+    # Missing values (code -1) are the string 'nan', like astype(str) would give
+    matched = np.append(np.asarray(matches, dtype=bool), term in 'nan')
+    return matched[codes]
@@ -0,0 +1,405 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .DataLoader import MULTI_FILTER_MAP
+from .cube import FATALITY_COLS, INJURY_COL, PERSONS_COL, empty_summary, weekday_hour_frame
+from .geo import map_summary
+from .indexes import encode_slots, label_key
+from .jobs import checkpoint
+from .selection import RowSelection
+
+# Selections larger than this are split into row shards aggregated in parallel
+SHARD_ROWS = int(os.environ.get("CRASHES_SHARD_ROWS", 250000))
+
+# Threads aggregating shards; 1 keeps aggregation on the calling thread
+SHARD_WORKERS = int(os.environ.get("CRASHES_SHARD_WORKERS", min(os.cpu_count() or 1, 8)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# --- Helpers ---
+def _numeric(df, col):
+    """Column as float array with missing values as 0, or zeros if the column is absent."""
+    if col not in df.columns:
+        return np.zeros(len(df))
+    return pd.to_numeric(df[col], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+def _codes(series):
+    """(codes, labels) of a column, using the categorical dictionary when there is one."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), list(series.cat.categories)
+    codes, uniques = pd.factorize(series, sort=True)
+    return codes, list(uniques)
+
+def _grouped(codes, labels, weights=None):
+    """Sum of weights (or row count) per label, every label listed like a categorical groupby."""
+    valid = codes >= 0
+    totals = np.bincount(codes[valid], weights=None if weights is None else weights[valid], minlength=len(labels))
+    return pd.Series(totals, index=labels, dtype=float)
+
+def _hours(df):
+    if 'CRASH_HOUR' in df.columns:
+        return pd.to_numeric(df['CRASH_HOUR'], errors='coerce').to_numpy(dtype=float)
+    if 'CRASH TIME' in df.columns:
+        return pd.to_datetime(df['CRASH TIME'], errors='coerce').dt.hour.to_numpy(dtype=float)
+    return None
+
+def _precomputed(df, col):
+    """A precomputed date part column as float array (NaN where missing), or None."""
+    if col in df.columns:
+        return pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+    return None
+
+def _days(df):
+    """Day number (days since 1970-01-01) of each row, NaN where the date is missing."""
+    days = _precomputed(df, 'CRASH_DAY')
+    if days is not None:
+        return days
+    for col in ['CRASH DATE', 'CRASH_DATE', 'CRASH_DATETIME', 'Date', 'date']:
+        if col in df.columns:
+            dates = df[col]
+            if not pd.api.types.is_datetime64_any_dtype(dates.dtype):
+                dates = pd.to_datetime(dates, errors='coerce')
+            days = dates.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+            return np.where(np.isnat(days), np.nan, days.astype(np.int64))
+    return None
+
+def _year_months(df, days):
+    """Month number (year * 12 + month - 1) of each row, from CRASH_YEAR_MONTH or the day numbers."""
+    months = _precomputed(df, 'CRASH_YEAR_MONTH')
+    if months is not None:
+        return months
+    located = ~np.isnan(days)
+    months = np.full(len(days), np.nan)
+    months[located] = days[located].astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) + 1970 * 12
+    return months
+
+def _weekdays(df, days):
+    """Weekday (0 = Monday) of each row, from CRASH_WEEKDAY or the day numbers (1970-01-01 was a Thursday)."""
+    weekdays = _precomputed(df, 'CRASH_WEEKDAY')
+    return weekdays if weekdays is not None else (days + 3) % 7
+
+def _bucket(values):
+    """(values, counts) of the distinct non-negative integers in values, by one bincount over their range."""
+    first = values.min()
+    counts = np.bincount(values - first)
+    present = np.flatnonzero(counts)
+    return present + first, counts[present].astype(float)
+
+
+# --- Fused aggregation ---
+def summarize(df, include_map=True):
+    """
+    Computes everything the dashboard draws from the rows of df (a DataFrame or a
+    RowSelection) in one vectorized pass:
+    the stat totals, injuries per borough, crashes per factor of any vehicle, crashes per day/month/year,
+    the borough x hour injury matrix and the map cells/sample.
+    Returns the same summary dict as AggregateCube.query(), plus 'crashes_by_day',
+    'map_cells' and 'map_points' (left out when include_map is False, e.g. because
+    a GeoIndex provides them).
+    """
+    summary = empty_summary()
+    if include_map:
+        summary.update(map_summary(df))
+    if df.empty:
+        return summary
+
+    injuries = _numeric(df, INJURY_COL)
+    persons = pd.to_numeric(df[PERSONS_COL], errors='coerce').to_numpy(dtype=float) if PERSONS_COL in df.columns else np.full(len(df), np.nan)
+    has_persons = ~np.isnan(persons)
+
+    summary['crashes'] = len(df)
+    summary['injuries'] = float(injuries.sum())
+    summary['fatalities'] = float(sum(_numeric(df, c).sum() for c in FATALITY_COLS if c in df.columns))
+    summary['persons_sum'] = float(persons[has_persons].sum())
+    summary['persons_count'] = float(has_persons.sum())
+
+    if 'BOROUGH' in df.columns:
+        borough, boroughs = _codes(df['BOROUGH'])
+        summary['injuries_by_borough'] = _grouped(borough, boroughs, injuries)
+
+        hours = _hours(df)
+        if hours is not None:
+            located = (borough >= 0) & ~np.isnan(hours)
+            hour = hours[located].astype(np.int64)
+            if len(hour):
+                matrix = np.bincount(borough[located] * 24 + hour, weights=injuries[located], minlength=len(boroughs) * 24)
+                matrix = pd.DataFrame(matrix.reshape(len(boroughs), 24), index=boroughs, columns=range(24))
+                # Only the hours present in the data, like a pivot table
+                matrix = matrix.loc[:, np.unique(hour)]
+                summary['injuries_borough_hour'] = matrix.rename_axis(index='BOROUGH', columns='HOUR')
+
+    factor_cols = [col for col in MULTI_FILTER_MAP['factor'] if col in df.columns]
+    if factor_cols:
+        # A crash counts once under each distinct factor of its vehicles
+        factor, factors = encode_slots([df[col] for col in factor_cols])
+        summary['factor_counts'] = _grouped(factor.ravel(), list(factors))
+
+    # Time buckets are bincounts over the integer date parts
+    days = _days(df)
+    if days is not None:
+        dated = ~np.isnan(days)
+        if dated.any():
+            day, counts = _bucket(days[dated].astype(np.int64))
+            summary['crashes_by_day'] = pd.Series(counts, index=pd.to_datetime(day, unit='D'))
+
+            month, counts = _bucket(_year_months(df, days)[dated].astype(np.int64))
+            summary['crashes_by_month'] = pd.Series(counts, index=pd.MultiIndex.from_arrays([month // 12, month % 12 + 1]))
+
+            # Years from the month buckets, weighted by their counts
+            first = month.min() // 12
+            by_year = np.bincount(month // 12 - first, weights=counts)
+            present = np.flatnonzero(by_year)
+            summary['crashes_by_year'] = pd.Series(by_year[present], index=present + first)
+
+        hours = _hours(df)
+        if hours is not None:
+            weekdays = _weekdays(df, days)
+            timed = ~np.isnan(weekdays) & ~np.isnan(hours)
+            week_hour = weekdays[timed].astype(np.int64) * 24 + hours[timed].astype(np.int64)
+            summary['crashes_weekday_hour'] = weekday_hour_frame(np.bincount(week_hour, minlength=7 * 24))
+    elif 'CRASH_YEAR' in df.columns:
+        years = pd.to_numeric(df['CRASH_YEAR'], errors='coerce').dropna().astype(int)
+        summary['crashes_by_year'] = years.value_counts().sort_index().astype(float)
+
+    return summary
+
+
+# --- Shard kernels ---
+# Precomputed date parts the shard kernel counts into, see schema.DERIVED
+KERNEL_DATE_PARTS = ['CRASH_HOUR', 'CRASH_DAY', 'CRASH_YEAR_MONTH', 'CRASH_WEEKDAY']
+
+def _span(series):
+    """(first, size) of the integer range holding the non-missing values of series, (0, 0) when there are none."""
+    first = series.min()
+    if pd.isna(first):
+        return 0, 0
+    return int(first), int(series.max()) - int(first) + 1
+
+def _present(values):
+    """Mask of the non-missing entries of a numeric array (an integer array has none missing)."""
+    return ~np.isnan(values) if values.dtype.kind == 'f' else np.ones(len(values), dtype=bool)
+
+def _filled(values):
+    """values with missing entries as 0."""
+    return np.nan_to_num(values, nan=0.0) if values.dtype.kind == 'f' else values
+
+def kernel_columns(df):
+    """
+    The arrays of df that summarize() reads, for count_shard(): numeric columns and
+    categorical codes over every row, taken without copying, plus the dictionaries and
+    the day/month ranges the counts are laid out on. None when df lacks the
+    precomputed date parts or the categorical dtypes (summarize() then runs per shard).
+    """
+    factor_cols = [col for col in MULTI_FILTER_MAP['factor'] if col in df.columns]
+    coded = ['BOROUGH'] + factor_cols
+    numeric = [INJURY_COL, PERSONS_COL] + FATALITY_COLS + KERNEL_DATE_PARTS
+    if any(col not in df.columns for col in ['BOROUGH'] + KERNEL_DATE_PARTS):
+        return None
+    if not all(isinstance(df[col].dtype, pd.CategoricalDtype) for col in coded):
+        return None
+    if not all(df[col].dtype.kind in 'uif' for col in numeric if col in df.columns):
+        return None
+
+    # One dictionary over the factor slots, ordered like encode_slots()
+    factors = sorted({label_key(u) for col in factor_cols for u in df[col].cat.categories})
+    position = {key: i for i, key in enumerate(factors)}
+    columns = {col: df[col].to_numpy() for col in numeric if col in df.columns}
+    columns.update({col: df[col].cat.codes.to_numpy() for col in coded})
+    return {
+        'columns': columns,
+        'boroughs': list(df['BOROUGH'].cat.categories),
+        'factor_cols': factor_cols,
+        'factors': factors,
+        # Slot code -> shared code, with an extra trailing slot so missing values (-1) stay -1
+        'factor_codes': [np.array([position[label_key(u)] for u in df[col].cat.categories] + [-1], dtype=np.int16)
+                         for col in factor_cols],
+        'days': _span(df['CRASH_DAY']),
+        'months': _span(df['CRASH_YEAR_MONTH']),
+    }
+
+def count_shard(kernel, rows):
+    """
+    The counts behind summarize() for some rows (a slice or row ids) of kernel_columns():
+    fixed-size numpy arrays, so the counts of disjoint shards add up element-wise.
+    Only numpy runs here (gathers, sorts and bincounts release the GIL), so shards on
+    the shard pool don't serialize on pandas or the interpreter.
+    """
+    columns = kernel['columns']
+    borough = columns['BOROUGH'][rows]
+    n = len(borough)
+    injuries = _filled(columns[INJURY_COL][rows]) if INJURY_COL in columns else np.zeros(n, dtype=np.uint8)
+    counts = {
+        'crashes': n,
+        'injuries': injuries.sum(dtype=float),
+        'fatalities': sum(np.nansum(columns[col][rows], dtype=float) for col in FATALITY_COLS if col in columns),
+        'persons_sum': 0.0,
+        'persons_count': 0,
+    }
+    if PERSONS_COL in columns:
+        persons = columns[PERSONS_COL][rows]
+        has_persons = _present(persons)
+        counts['persons_sum'] = persons[has_persons].sum(dtype=float)
+        counts['persons_count'] = has_persons.sum()
+
+    n_boroughs = len(kernel['boroughs'])
+    valid = borough >= 0
+    counts['injuries_by_borough'] = np.bincount(borough[valid], weights=injuries[valid], minlength=n_boroughs)
+    hours = columns['CRASH_HOUR'][rows]
+    timed = _present(hours)
+    located = valid & timed
+    hour = hours[located].astype(np.intp)
+    counts['injuries_borough_hour'] = np.bincount(borough[located].astype(np.intp) * 24 + hour, weights=injuries[located], minlength=n_boroughs * 24)
+    counts['located_hours'] = np.bincount(hour, minlength=24)
+
+    if kernel['factor_cols']:
+        # A crash counts once under each distinct factor of its vehicles
+        counts['factor_counts'] = np.zeros(len(kernel['factors']), dtype=np.int64)
+        seen = []
+        for col, codes in zip(kernel['factor_cols'], kernel['factor_codes']):
+            factor = codes[columns[col][rows]]
+            fresh = factor >= 0
+            for earlier in seen:
+                fresh &= factor != earlier
+            counts['factor_counts'] += np.bincount(factor[fresh], minlength=len(kernel['factors']))
+            seen.append(factor)
+
+    days = columns['CRASH_DAY'][rows]
+    dated = _present(days)
+    months = columns['CRASH_YEAR_MONTH'][rows][dated]
+    counts['crashes_by_day'] = np.bincount(days[dated].astype(np.intp) - kernel['days'][0], minlength=kernel['days'][1])
+    counts['crashes_by_month'] = np.bincount(months.astype(np.intp) - kernel['months'][0], minlength=kernel['months'][1])
+    weekdays = columns['CRASH_WEEKDAY'][rows]
+    timed &= _present(weekdays)
+    week_hour = weekdays[timed].astype(np.intp) * 24 + hours[timed].astype(np.intp)
+    counts['crashes_weekday_hour'] = np.bincount(week_hour, minlength=7 * 24)
+    return counts
+
+def summary_from_counts(kernel, counts):
+    """The summarize() dict of the count_shard() counts of a selection (summed over its shards)."""
+    summary = empty_summary()
+    if not counts['crashes']:
+        return summary
+
+    summary['crashes'] = int(counts['crashes'])
+    for key in ('injuries', 'fatalities', 'persons_sum', 'persons_count'):
+        summary[key] = float(counts[key])
+
+    boroughs = kernel['boroughs']
+    summary['injuries_by_borough'] = pd.Series(counts['injuries_by_borough'], index=boroughs, dtype=float)
+    hours = np.flatnonzero(counts['located_hours'])
+    if len(hours):
+        matrix = pd.DataFrame(counts['injuries_borough_hour'].reshape(len(boroughs), 24), index=boroughs, columns=range(24))
+        # Only the hours present in the data, like a pivot table
+        summary['injuries_borough_hour'] = matrix.loc[:, hours].rename_axis(index='BOROUGH', columns='HOUR')
+    if kernel['factor_cols']:
+        summary['factor_counts'] = pd.Series(counts['factor_counts'], index=kernel['factors'], dtype=float)
+
+    by_day = counts['crashes_by_day']
+    present = np.flatnonzero(by_day)
+    if len(present):
+        summary['crashes_by_day'] = pd.Series(by_day[present].astype(float), index=pd.to_datetime(present + kernel['days'][0], unit='D'))
+
+        by_month = counts['crashes_by_month']
+        present = np.flatnonzero(by_month)
+        month, month_counts = present + kernel['months'][0], by_month[present].astype(float)
+        summary['crashes_by_month'] = pd.Series(month_counts, index=pd.MultiIndex.from_arrays([month // 12, month % 12 + 1]))
+
+        # Years from the month buckets, weighted by their counts
+        first = month.min() // 12
+        by_year = np.bincount(month // 12 - first, weights=month_counts)
+        present = np.flatnonzero(by_year)
+        summary['crashes_by_year'] = pd.Series(by_year[present], index=present + first)
+
+    summary['crashes_weekday_hour'] = weekday_hour_frame(counts['crashes_weekday_hour'])
+    return summary
+
+
+# --- Merging ---
+def _add(left, right):
+    """Sum of two summary series/frames, aligned on their labels (missing counts as 0)."""
+    if right.empty:
+        return left
+    if left.empty:
+        return right
+    merged = left.add(right, fill_value=0)
+    return merged.rename_axis(index=left.index.name, columns=left.columns.name) if isinstance(merged, pd.DataFrame) else merged
+
+def merge_summaries(summaries):
+    """
+    Combines the summaries of disjoint row sets (partitions, shards) into the summary
+    of their union: totals are added and every series is added label by label.
+    Map entries aren't merged here, see geo.merge_map().
+    """
+    merged = empty_summary()
+    for summary in summaries:
+        for key, value in summary.items():
+            if key in ('map_cells', 'map_points'):
+                continue
+            if isinstance(value, (pd.Series, pd.DataFrame)):
+                merged[key] = _add(merged.get(key, value.iloc[:0]), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+# --- Parallel aggregation ---
+def _shard_pool():
+    """The shard thread pool, created on first use (after gunicorn forks its workers)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix="shard")
+        return _pool
+
+def summarize_rows(df, rows=None, shard_rows=SHARD_ROWS, workers=SHARD_WORKERS, progress=True):
+    """
+    summarize(include_map=False) of the rows of df at the given row ids (all rows when
+    None). Large selections are split into up to `workers` shards of at least
+    shard_rows rows, aggregated on the shard pool. Each shard runs count_shard() on
+    the columns of df taken once by kernel_columns(), so a shard gathers only the
+    rows it counts and never calls into pandas; the counts are summed and turned into
+    the summary once. Frames the kernel can't read go through summarize() per shard
+    (a RowSelection, so only the columns it uses are gathered) and merge_summaries().
+
+    Inside a background job every finished shard is a checkpoint (recorded as the job's
+    progress unless progress is False), and a cancelled job drops its pending shards.
+    """
+    selection = RowSelection(df, rows)
+    shards = max(1, min(workers, -(-len(selection) // shard_rows)))
+    parts = selection.split(shards) if shards > 1 else [selection]
+
+    kernel = kernel_columns(df)
+    if kernel is None:
+        def aggregate(part):
+            return summarize(part, include_map=False)
+
+        def finish(summaries):
+            return summaries[0] if len(summaries) == 1 else merge_summaries(summaries)
+    else:
+        def aggregate(part):
+            return count_shard(kernel, slice(None) if part.rows is None else part.rows)
+
+        def finish(counts):
+            return summary_from_counts(kernel, {key: sum(c[key] for c in counts) for key in counts[0]})
+
+    if shards == 1:
+        result = finish([aggregate(selection)])
+        checkpoint(1, 1 if progress else None)
+        return result
+
+    futures = [_shard_pool().submit(aggregate, part) for part in parts]
+    results = []
+    try:
+        for i, future in enumerate(futures):
+            results.append(future.result())
+            checkpoint(i + 1, shards if progress else None)
+    finally:
+        # Shards not started yet are dropped when the job is cancelled (or a shard failed)
+        for future in futures:
+            future.cancel()
+    return finish(results)
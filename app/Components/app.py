@@ -1,203 +1,189 @@
 import dash
 import dash_bootstrap_components as dbc
 from dash import html, dcc, Input, Output, State
-from .DataLoader import load_data, get_options, filter_dataframe 
-from .charts import create_bar, create_pie, create_heatmap, create_map, create_line, get_stats
-import pandas as pd
+from .DataLoader import load_data, load_partitions
+from .charts import create_bar, create_pie, create_heatmap, create_map, create_line, get_stats, HEATMAP_MODES
+from .dataset import Dataset, get_dataset, set_dataset, on_dataset_change
+from .result_cache import ResultCache, filter_key
+from .export import register_export, export_url
+from .refresh import register_refresh, refresh
+from .partitions import PartitionedDataset, RESIDENT_YEARS
+from .jobs import JobQueue, JOB_POLL_MS, checkpoint
+from .metrics import instrument, register_metrics, registry, stage
+import logging
 import os
+import uuid
+
+logging.basicConfig(level=os.environ.get("CRASHES_LOG_LEVEL", "INFO"),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 # Initialize
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.DARKLY , "/assets/styles.css"])
 
 #Initialize server for deployment
 server = app.server
 
-#Loading the data
-df = load_data()
+#Streaming export endpoint behind the download link
+register_export(server)
+
+#Per-stage timings in the Prometheus text format
+register_metrics(server)
+
+#Results of repeated filter combinations, dropped whenever the dataset changes
+result_cache = ResultCache()
+on_dataset_change(lambda dataset: result_cache.clear())
+registry.watch_cache(result_cache)
+
+#Loading the data and building its indexes, then appending any delta files.
+#With CRASHES_RESIDENT_YEARS set, only that many year partitions are kept in memory
+if RESIDENT_YEARS:
+    set_dataset(PartitionedDataset(load_partitions()))
+else:
+    set_dataset(Dataset(load_data()))
+refresh()
+
+#New delta files are picked up while serving
+register_refresh(server)
+
+#Dashboard updates run in the background so a slow one doesn't hold a web worker
+jobs = JobQueue()
 
 # --- Dropdown function ---
-def make_dropdown(label, id, col):
+def make_dropdown(label, id, key):
     return dbc.Col(
         children=[
             dbc.Label(label, className="fw-bold"),
-            dcc.Dropdown(id=id, options=get_options(df, col), placeholder="All")
+            dcc.Dropdown(id=id, options=get_dataset().facet_options(key, {}), placeholder="All", multi=True)
         ],
-        md=4,
+        md=3,
         className="mb-3"
     )
 
-# --- Layout ---
-app.layout = dbc.Container([
-    
-    #introduce download component
-    dcc.Download(id="download-report"),
+# --- Year slider ---
+def year_range():
+    """(first, last) year of the current dataset, for the year slider's bounds."""
+    years = [int(float(y)) for y in get_dataset().cube.values('CRASH_YEAR') or []]
+    return (min(years), max(years)) if years else (2009, 2023)
 
-    # --- Navbar ---
-    dbc.NavbarSimple(brand="NYC Traffic Crashes Dashboard", color="dark", dark=True, className="mb-4" ),
-
-
-
-    # --- Dropdown Cards ---
-   dbc.Card([
-    dbc.CardHeader("Filters"),
-    dbc.CardBody([
-        dbc.Row([
-            make_dropdown("Borough", "Borough-dropdown", "BOROUGH"),
-            make_dropdown("Factor", "Factor-dropdown", "CONTRIBUTING FACTOR VEHICLE 1"), 
-            make_dropdown("Demographic", "Demographic-dropdown", "MOST_COMMON_SEX"),
+# --- Layout ---
+# Built per page load so the dropdowns list the options of the current dataset
+def serve_layout():
+    first, last = year_range()
+    return dbc.Container([
+
+        # --- Navbar ---
+        dbc.NavbarSimple(brand="NYC Traffic Crashes Dashboard", color="dark", dark=True, className="mb-4" ),
+
+
+
+        # --- Dropdown Cards ---
+       dbc.Card([
+        dbc.CardHeader("Filters"),
+        dbc.CardBody([
+            dbc.Row([
+                make_dropdown("Borough", "Borough-dropdown", "borough"),
+                make_dropdown("Factor (any vehicle)", "Factor-dropdown", "factor"), 
+                make_dropdown("Demographic", "Demographic-dropdown", "demographic"),
+                make_dropdown("Vehicle Type (any vehicle)", "Vehicle-dropdown", "vehicle"),
+            ])
         ])
-    ])
-], className="mb-4"),
-
-    # --- Year Slider Card ---
-    dbc.Row([
-        dbc.Col(
-            dbc.Card([
-                dbc.CardHeader("Year Selection"),
-                dbc.CardBody([
-                    dcc.Slider(
-                        id="year-slider",
-                        min=2009,
-                        max=2023,
-                        step=1,
-                        marks={y: str(y) for y in range(2009, 2024)},
-                        value=2023
-                    )
-                ])
-            ], className="mb-3"), md=12
-        )
-    ]),
-
-    # --- Search Card ---
-    dbc.Row([
-        dbc.Col(
-            dbc.Card([
-                dbc.CardHeader("Search"),
-                dbc.CardBody([
-                    dcc.Input(
-                        id="search-input",
-                        type="text",
-                        placeholder="Type to search...",
-                        debounce=True,
-                        style={"width": "100%"}
-                    )
-                ])
-            ], className="mb-3"), md=7
-        ),
-
-        # --- Generate Button Card ---
-        dbc.Col(
-            dbc.Card([
-                dbc.CardHeader("Generate Report/Reset/Download"),
-                dbc.CardBody([
-                    dbc.Button("Generate Report", id="btn-gen", color="success", className="me-2"),
-                      dbc.Button("Reset", id="btn-reset", color="secondary", className="me-2"),
-                      dbc.Button("Download Data", id="Download-button", color="info")
-                ])
-            ], className="me-2"), md=5
-        ),        
-    ]),
-
-    # Stats Cards
-    dbc.Row([
-        dbc.Col(dbc.Card([dbc.CardBody([html.H3(id="C-Crash"), html.P("Total Crashes")])], color="primary", inverse=True , className="hover-pop")),
-        dbc.Col(dbc.Card([dbc.CardBody([html.H3(id="C-Injuries"), html.P("Total Injuries")])], color="warning", inverse=True, className="hover-pop")),
-        dbc.Col(dbc.Card([dbc.CardBody([html.H3(id="C-Fatalities"), html.P("Total Fatalities")])], color="danger", inverse=True, className="hover-pop")),
-        dbc.Col(dbc.Card([dbc.CardBody([html.H3(id="C-average"), html.P("Avg Persons Involved")])], color="info", inverse=True,className="hover-pop")),
     ], className="mb-4"),
 
-    # Grid Charts
-    dbc.Row([
-        dbc.Col(dcc.Graph(id="Bar_chart" , className="hover-pop"), md=6),
-        dbc.Col(dcc.Graph(id="Pie_chart", className="hover-pop"), md=6),
-    ], className="mb-4"),
+        # --- Year Slider Card ---
+        dbc.Row([
+            dbc.Col(
+                dbc.Card([
+                    dbc.CardHeader("Year Selection"),
+                    dbc.CardBody([
+                        dcc.RangeSlider(
+                            id="year-slider",
+                            min=first,
+                            max=last,
+                            step=1,
+                            marks={y: str(y) for y in range(first, last + 1)},
+                            value=[last, last]
+                        )
+                    ])
+                ], className="mb-3"), md=12
+            )
+        ]),
+
+        # --- Search Card ---
+        dbc.Row([
+            dbc.Col(
+                dbc.Card([
+                    dbc.CardHeader("Search"),
+                    dbc.CardBody([
+                        dcc.Input(
+                            id="search-input",
+                            type="text",
+                            placeholder="Type to search...",
+                            debounce=True,
+                            style={"width": "100%"}
+                        )
+                    ])
+                ], className="mb-3"), md=7
+            ),
+
+            # --- Generate Button Card ---
+            dbc.Col(
+                dbc.Card([
+                    dbc.CardHeader("Generate Report/Reset/Download"),
+                    dbc.CardBody([
+                        dbc.Button("Generate Report", id="btn-gen", color="success", className="me-2"),
+                          dbc.Button("Reset", id="btn-reset", color="secondary", className="me-2"),
+                          dbc.Button("Download Data", id="Download-button", color="info", href=export_url({}), external_link=True),
+                          dbc.Progress(id="job-progress", value=0, striped=True, animated=True, className="mt-2", style={"display": "none"})
+                    ])
+                ], className="me-2"), md=5
+            ),        
+        ]),
+
+        # Stats Cards
+        dbc.Row([
+            dbc.Col(dbc.Card([dbc.CardBody([html.H3(id="C-Crash"), html.P("Total Crashes")])], color="primary", inverse=True , className="hover-pop")),
+            dbc.Col(dbc.Card([dbc.CardBody([html.H3(id="C-Injuries"), html.P("Total Injuries")])], color="warning", inverse=True, className="hover-pop")),
+            dbc.Col(dbc.Card([dbc.CardBody([html.H3(id="C-Fatalities"), html.P("Total Fatalities")])], color="danger", inverse=True, className="hover-pop")),
+            dbc.Col(dbc.Card([dbc.CardBody([html.H3(id="C-average"), html.P("Avg Persons Involved")])], color="info", inverse=True,className="hover-pop")),
+        ], className="mb-4"),
+
+        # Grid Charts
+        dbc.Row([
+            dbc.Col(dcc.Graph(id="Bar_chart" , className="hover-pop"), md=6),
+            dbc.Col(dcc.Graph(id="Pie_chart", className="hover-pop"), md=6),
+        ], className="mb-4"),
     
-    dbc.Row([
-        dbc.Col(dcc.Graph(id="line_graph" , className="hover-pop"), md=12),
-    ], className="mb-4"),
+        dbc.Row([
+            dbc.Col(dcc.Graph(id="line_graph" , className="hover-pop"), md=12),
+        ], className="mb-4"),
     
-    dbc.Row([
-    dbc.Col(dcc.Graph(id="Map" , className="hover-pop"), md=6),
-    dbc.Col(dcc.Graph(id="heat_map" , className="hover-pop"), md=6)
-])
+        dbc.Row([
+        dbc.Col(dcc.Graph(id="Map" , className="hover-pop"), md=6),
+        dbc.Col([
+            dbc.RadioItems(id="heatmap-mode", value="borough", inline=True, className="mb-2",
+                           options=[{"label": "Borough × hour", "value": "borough"},
+                                    {"label": "Weekday × hour", "value": "weekday"}]),
+            dcc.Graph(id="heat_map" , className="hover-pop")
+        ], md=6)
+    ]),
     
-], fluid=True)
- 
-# ---Search Function ---
-def apply_search_filter(dataframe, search_text, logic="AND"):
-    """
-    Filters the dataframe based on search_text across multiple columns.
-    Handles categoricals, numeric, and string columns safely.
-    """
-    if not search_text or not isinstance(search_text, str) or search_text.strip() == "":
-        return dataframe
-
-    # Normalize column names
-    dataframe.columns = dataframe.columns.str.strip().str.upper()
-
-    search_text_lower = search_text.lower().strip()
-    search_terms = search_text_lower.split()
-
-    # Define searchable columns
-    search_columns = [
-        'BOROUGH', 
-        'VEHICLE TYPE CODE 1', 
-        'CONTRIBUTING FACTOR VEHICLE 1',
-        'MOST_COMMON_SEX',
-        'VEHICLE TYPE CODE 2',
-        'CONTRIBUTING FACTOR VEHICLE 2',
-        'VEHICLE TYPE CODE 3', 
-        'CONTRIBUTING FACTOR VEHICLE 3',
-        'VEHICLE TYPE CODE 4',
-        'CONTRIBUTING FACTOR VEHICLE 4',
-        'VEHICLE TYPE CODE 5',
-        'CONTRIBUTING FACTOR VEHICLE 5'
-    ]
-
-    # Include year/date columns if they exist
-    year_cols = [col for col in dataframe.columns if any(term in col for term in ['YEAR','DATE','TIME'])]
-    search_columns.extend(year_cols)
-
-    # Filter columns that actually exist
-    available_columns = [col for col in search_columns if col in dataframe.columns]
-
-    if not available_columns:
-        print("❌ No searchable columns found!")
-        return dataframe
-
-    # Convert all searchable columns to string safely
-    for col in available_columns:
-        dataframe[col] = dataframe[col].astype(str).fillna('')
-
-    # Initialize final mask
-    if logic.upper() == "AND":
-        final_mask = pd.Series(True, index=dataframe.index)
-    else:
-        final_mask = pd.Series(False, index=dataframe.index)
-
-    # Apply search terms
-    for term in search_terms:
-        term_mask = pd.Series(False, index=dataframe.index)
-        for col in available_columns:
-            # Safe string contains
-            term_mask |= dataframe[col].str.lower().str.contains(term, na=False)
-        if logic.upper() == "AND":
-            final_mask &= term_mask
-        else:
-            final_mask |= term_mask
-
-    filtered_df = dataframe[final_mask]
-    return filtered_df
-
-
-
+        # Background job state: the browser session, the request being computed and its poll timer
+        dcc.Store(id="session-id", data=uuid.uuid4().hex),
+        dcc.Store(id="dashboard-request"),
+        dcc.Store(id="heatmap-figures"),
+        dcc.Interval(id="job-poll", interval=JOB_POLL_MS, disabled=True)
 
+    ], fluid=True)
 
+app.layout = serve_layout
+ 
 # --- Callbacks for filtering ---
 @app.callback([
     Output('Borough-dropdown', 'value'),
     Output('Demographic-dropdown', 'value'),
     Output('Factor-dropdown', 'value'),
     Output('year-slider', 'value'),
+    Output('Vehicle-dropdown', 'value'),
     Output('search-input', 'value')
 
     ],
@@ -207,9 +193,32 @@ def apply_search_filter(dataframe, search_text, logic="AND"):
     ]
 )
 
-#Reseting values to filtering the whole datSet
+#Reseting values to filtering the whole datSet (and the latest year)
 def reset_filters(n):
-     return None, None  , None, 2023 , ""
+     last = year_range()[1]
+     return None, None  , None, [last, last] , None, ""
+
+#Cascading dropdowns: each lists the values left by the other filters, with row counts
+@app.callback(
+    [
+        Output('Borough-dropdown', 'options'),
+        Output('Factor-dropdown', 'options'),
+        Output('Demographic-dropdown', 'options'),
+        Output('Vehicle-dropdown', 'options'),
+    ],
+    [
+        Input('Borough-dropdown', 'value'),
+        Input('Factor-dropdown', 'value'),
+        Input('Demographic-dropdown', 'value'),
+        Input('year-slider', 'value'),
+        Input('Vehicle-dropdown', 'value'),
+    ]
+)
+@instrument
+def update_options(bor, fac, demo, year, vehicle):
+    inputs = {'borough': bor, 'factor': fac, 'year': year, 'demographic': demo, 'vehicle': vehicle}
+    ds = get_dataset()
+    return [ds.facet_options(key, inputs) for key in ('borough', 'factor', 'demographic', 'vehicle')]
 
 #Callback to update dashboard
 @app.callback(
@@ -221,69 +230,122 @@ def reset_filters(n):
         Output('Bar_chart', 'figure'), 
         Output('Pie_chart', 'figure'), 
         Output('line_graph', 'figure'), 
-        Output('heat_map', 'figure'), 
+        Output('heatmap-figures', 'data'), 
         Output('Map', 'figure'),
+        Output('dashboard-request', 'data'),
+        Output('job-poll', 'disabled'),
+        Output('job-progress', 'value'),
+        Output('job-progress', 'style'),
     ],
     [
         Input('btn-gen', 'n_clicks'),
+        Input('job-poll', 'n_intervals'),
     ],
     [
         State('Borough-dropdown', 'value'), 
         State('Demographic-dropdown', 'value'),
         State('Factor-dropdown', 'value'),
         State('year-slider', 'value'),
-        State('search-input', 'value')
+        State('Vehicle-dropdown', 'value'),
+        State('search-input', 'value'),
+        State('session-id', 'data'),
+        State('dashboard-request', 'data'),
     ]
 )
-def update_dashboard(n, bor, demo, fac, year_slider, search_text):
-
-    # Mapping the dataframe based on the filters
-    inputs = {'borough': bor, 'factor1': fac  ,'year': year_slider, 'demographic': demo}
-    
-    #Apply all filters
-    dff = filter_dataframe(df, inputs)
+@instrument
+def update_dashboard(n, n_intervals, bor, demo, fac, year_slider, vehicle, search_text, session, request):
 
-    #Apllying the searhc function filter     
-    dff = apply_search_filter(dff, search_text)
+    # A click starts a new request; a poll keeps waiting for the one being computed
+    polling = dash.callback_context.triggered_id == 'job-poll' and request
+    if polling:
+        inputs, search_text = request['inputs'], request['search']
+    else:
+        # Mapping the dataframe based on the filters
+        inputs = {'borough': bor, 'factor': fac, 'year': year_slider, 'demographic': demo, 'vehicle': vehicle}
+        request = {'inputs': inputs, 'search': search_text}
+
+    # One dataset for the whole request, even if a reload swaps it meanwhile
+    ds = get_dataset()
+    cache_key = ('dashboard', ds.version) + filter_key(inputs, search_text)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached + [request, True, 100, {"display": "none"}]
+
+    # Only a click replaces (and cancels) the session's previous request, unless it is
+    # the same one. A poll only starts the job if this worker process has no job for
+    # the session, and a stale poll (for a request a newer click replaced) changes nothing
+    job = jobs.submit(session, cache_key, dashboard_outputs, ds, inputs, search_text, cache_key,
+                      replace=not polling)
+    if job.key != cache_key:
+        return [dash.no_update] * 13
+    job.wait()
+    if job.state == 'done':
+        return job.result + [request, True, 100, {"display": "none"}]
+    if job.finished:
+        # Failed or cancelled: keep what is shown
+        return [dash.no_update] * 9 + [request, True, 0, {"display": "none"}]
+    return [dash.no_update] * 9 + [request, False, int(job.progress() * 100), {"display": "flex"}]
+
+@instrument
+def dashboard_outputs(ds, inputs, search_text, cache_key):
+    """Stats and figures of one dashboard request, run as a background job."""
+
+    # Cube when there is no search term, otherwise one pass over the selected rows
+    # (the selection is kept for the export); the map comes from the load-time grid
+    summary = ds.summary(inputs, search_text)
      
     # Getting stats
-    s1, s2, s3, s4 = get_stats(dff)
-
-    # Charts with template
-    return s1, s2, s3, s4, \
-           create_bar(dff), create_pie(dff), \
-           create_line(dff), create_heatmap(dff), create_map(dff)
+    with stage('chart.stats'):
+        outputs = list(get_stats(summary))
+
+    # Charts with template; a cancelled job stops between them (the progress stays
+    # what the row pass reported)
+    for name, chart in [('bar', create_bar), ('pie', create_pie), ('line', create_line),
+                        ('heatmap', heatmap_figures), ('map', create_map)]:
+        checkpoint()
+        with stage('chart.' + name):
+            outputs.append(chart(summary))
+    checkpoint()
+
+    # Serialized once, with the Plotly JSON encoder, for the cache
+    with stage('serialize'):
+        result_cache.put(cache_key, outputs)
+    return outputs
+
+def heatmap_figures(summary):
+    """The heatmap of every mode; the browser shows the selected one."""
+    return {mode: create_heatmap(summary, mode) for mode in HEATMAP_MODES}
+
+#Switching the heatmap mode needs no server round trip
+app.clientside_callback(
+    """
+    function(figures, mode) {
+        return figures ? figures[mode] : window.dash_clientside.no_update;
+    }
+    """,
+    Output('heat_map', 'figure'),
+    [Input('heatmap-figures', 'data'), Input('heatmap-mode', 'value')]
+)
 
 # --- Download Callback ---
 @app.callback(
-    Output("download-report", "data"),
-    Input("Download-button", "n_clicks"),
+    Output("Download-button", "href"),
     [
-        State('Borough-dropdown', 'value'),
-        State('Factor-dropdown', 'value'),
-        State('Demographic-dropdown', 'value'),
-        State('year-slider', 'value'),
-        State('search-input', 'value')
-    ],
-    prevent_initial_call=True
+        Input('Borough-dropdown', 'value'),
+        Input('Factor-dropdown', 'value'),
+        Input('Demographic-dropdown', 'value'),
+        Input('year-slider', 'value'),
+        Input('Vehicle-dropdown', 'value'),
+        Input('search-input', 'value')
+    ]
 )
 
-def download_csv(n_clicks, bor, fac,  demo, year, search_text):
-
-    # Filter dataframe
-    inputs = {'borough': bor, 'factor1': fac,  'demographic': demo, 'year': year}
-
-    dff = filter_dataframe(df, inputs)
-    dff = apply_search_filter(dff, search_text)
-
-    # Apply search filter
-    if search_text:
-        search_text_lower = search_text.lower()
-        search_cols = ['BOROUGH', 'VEHICLE TYPE CODE 1', 'CONTRIBUTING FACTOR VEHICLE 1' , "MOST_COMMON_SEX", "CRASH_YEAR"]
-        dff = dff[dff[search_cols].apply(lambda row: row.astype(str).str.lower().str.contains(search_text_lower).any(), axis=1)]
+@instrument
+def download_csv(bor, fac,  demo, year, vehicle, search_text):
 
-    # Return CSV
-    return dcc.send_data_frame(dff.to_csv, "nyc_traffic_crashes.csv", index=False)
+    # Point the download at the streaming export of the current filters
+    inputs = {'borough': bor, 'factor': fac, 'demographic': demo, 'year': year, 'vehicle': vehicle}
+    return export_url(inputs, search_text)
 
 
 if __name__ == "__main__":
@@ -1,355 +1,291 @@
-import plotly.express as px
-import plotly.graph_objects as go
+import base64
+import logging
+
+import numpy as np
 import pandas as pd
 
-# Common template to fix the bug you had earlier
-TEMPLATE = "plotly_white"
+from .aggregate import summarize
+from .geo import GRID_CELL, GRID_EXTENT, GRID_ORIGIN
+
+log = logging.getLogger(__name__)
+
+# Initial map zoom and the degrees of longitude one pixel spans at that zoom
+MAP_ZOOM = 9
+MAP_DEGREES_PER_PIXEL = 360 / (256 * 2 ** MAP_ZOOM)
+
+# Layout every chart starts from; charts only add what differs. Figures are built
+# as plain dicts in Plotly's figure schema, so no template is serialized with them.
+BASE_LAYOUT = {
+    "paper_bgcolor": "rgba(0,0,0,0)",
+    "plot_bgcolor": "rgba(0,0,0,0)",
+    "font": {"color": "#E6EEF6"},
+}
+
+# Typed-array codes of the dtypes Plotly decodes, narrowest first
+_INT_CODES = [('u1', np.uint8), ('i1', np.int8), ('u2', np.uint16), ('i2', np.int16), ('u4', np.uint32), ('i4', np.int32)]
+
+
+# --- Figure helpers ---
+def layout(**overrides):
+    """BASE_LAYOUT with the chart's own settings on top."""
+    return {**BASE_LAYOUT, **overrides}
+
+def typed_array(values):
+    """
+    Numeric values as a Plotly typed array (base64 bytes plus a dtype code, and the
+    shape for 2-D arrays), in the narrowest integer type that holds them exactly, or
+    float32/float64 otherwise. Much smaller and faster to encode than a JSON list.
+    Needs the plotly.js of the plotly package, which dcc.Graph loads from Dash 2.17 on.
+    """
+    values = np.asarray(values, dtype=float)
+    code, dtype = 'f8', np.float64
+    finite = np.isfinite(values)
+    if values.size and finite.all() and (values == np.round(values)).all():
+        low, high = values.min(), values.max()
+        for code, dtype in _INT_CODES:
+            if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+                break
+        else:
+            code, dtype = 'f8', np.float64
+    elif values.size:
+        code, dtype = 'f4', np.float32
+
+    array = {"dtype": code, "bdata": base64.b64encode(values.astype(np.dtype(dtype).newbyteorder('<')).tobytes()).decode('ascii')}
+    if values.ndim == 2:
+        array["shape"] = f"{values.shape[0]}, {values.shape[1]}"
+    return array
+
+def _message_fig(title, message, **overrides):
+    """Figure with a centered message instead of data."""
+    return {"data": [], "layout": layout(
+        title=title,
+        xaxis={"visible": False},
+        yaxis={"visible": False},
+        annotations=[{"text": message, "xref": "paper", "yref": "paper", "x": 0.5, "y": 0.5,
+                      "showarrow": False, "font": {"size": 16}}],
+        **overrides
+    )}
 
 # --- Empty Figure function ---
 def empty_fig(text="No Data"):
 
     # Returns an empty figure with a message
     return {
-        "layout": {
-            "xaxis": {"visible": False},
-            "yaxis": {"visible": False},
-            "annotations": [{"text": text, "showarrow": False}]
-        }
+        "layout": layout(
+            xaxis={"visible": False},
+            yaxis={"visible": False},
+            annotations=[{"text": text, "showarrow": False}]
+        )
     }
 
+def _summary(data):
+    """Chart builders take a summary dict; a DataFrame is summarized in one pass first."""
+    return data if isinstance(data, dict) else summarize(data)
+
 # --- Stats Calculation function ---
 def get_stats(df):
     """
     Returns dashboard stats: total crashes, injuries, fatalities, avg persons involved.
-    Safe for empty DataFrames.
+    Accepts a DataFrame or a summary. Safe for empty DataFrames.
     """
-    if df.empty:
+    summary = _summary(df)
+    if summary['crashes'] == 0:
         return "0", "0", "0", "0.0"
 
-    crashes = len(df)
-
-    injuries = df['NUMBER OF PERSONS INJURED'].sum() if 'NUMBER OF PERSONS INJURED' in df.columns else 0
+    avg_people = summary['persons_sum'] / summary['persons_count'] if summary['persons_count'] else 0
 
-    fatality_cols = ['NUMBER OF PEDESTRIANS KILLED', 'NUMBER OF CYCLIST KILLED', 'NUMBER OF MOTORIST KILLED']
-    existing_fatality_cols = [c for c in fatality_cols if c in df.columns]
-    fatalities = df[existing_fatality_cols].sum().sum() if existing_fatality_cols else 0
-
-    avg_people = df['PERSONS_INVOLVED_COUNT'].mean() if 'PERSONS_INVOLVED_COUNT' in df.columns else 0
-
-    return f"{crashes:,}", f"{int(injuries):,}", f"{int(fatalities):,}", f"{avg_people:.1f}"
+    return f"{summary['crashes']:,}", f"{int(summary['injuries']):,}", f"{int(summary['fatalities']):,}", f"{avg_people:.1f}"
 
 
 # --- Bar chart Creation Functions ---
 def create_bar(df):
 
-    """Bar: Total Injuries by Borough."""
-    if df.empty: return empty_fig()
-    data = df.groupby('BOROUGH')['NUMBER OF PERSONS INJURED'].sum().reset_index()
-    fig = px.bar(data, x='BOROUGH', y='NUMBER OF PERSONS INJURED', title="Injuries by Borough")
-    fig.update_layout(
-    paper_bgcolor="rgba(0,0,0,0)",
-    plot_bgcolor="rgba(0,0,0,0)",
-    font_color="#E6EEF6"
-)
-
-    return fig
+    """Bar: Total Injuries by Borough. Accepts a DataFrame or a summary."""
+    summary = _summary(df)
+    if summary['crashes'] == 0: return empty_fig()
+    data = summary['injuries_by_borough']
+    return {
+        "data": [{
+            "type": "bar", "x": [str(b) for b in data.index], "y": typed_array(data.values),
+            "hovertemplate": "BOROUGH=%{x}<br>NUMBER OF PERSONS INJURED=%{y}<extra></extra>"
+        }],
+        "layout": layout(
+            title="Injuries by Borough",
+            xaxis={"title": "BOROUGH"},
+            yaxis={"title": "NUMBER OF PERSONS INJURED"}
+        )
+    }
 
 # --- Pie chart Creation Functions ---
 def create_pie(df):
-    """Pie: Top Contributing Factors."""
-    if df.empty: return empty_fig()
-    data = df['CONTRIBUTING FACTOR VEHICLE 1'].value_counts().head(10)
-    fig = px.pie(names=data.index, values=data.values, title="Top Contributing Factors")
-    fig.update_layout(
-    paper_bgcolor="rgba(0,0,0,0)",
-    plot_bgcolor="rgba(0,0,0,0)",
-    font_color="#E6EEF6"
-)
-
-    return fig
+    """Pie: Top Contributing Factors. Accepts a DataFrame or a summary."""
+    summary = _summary(df)
+    if summary['crashes'] == 0: return empty_fig()
+    data = summary['factor_counts'].sort_values(ascending=False, kind='stable').head(10)
+    return {
+        "data": [{"type": "pie", "labels": [str(f) for f in data.index], "values": typed_array(data.values)}],
+        "layout": layout(title="Top Contributing Factors")
+    }
 
 # --- Heatmap Creation Functions ---
 def create_empty_heatmap(message):
     """Create an empty heatmap with error message"""
-    fig = go.Figure()
-    fig.add_annotation(
-        text=message,
-        xref="paper", yref="paper",
-        x=0.5, y=0.5,
-        showarrow=False,
-        font=dict(size=16)
-    )
-    fig.update_layout(
-        title={
-            'text': 'Crash Frequency by Time and Day',
-            'x': 0.5,
-            'xanchor': 'center',
-        },
+    return _message_fig(
+        {'text': 'Crash Frequency by Time and Day', 'x': 0.5, 'xanchor': 'center'}, message,
         height=500,
-        margin=dict(l=50, r=50, t=80, b=50),
-         paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        font_color="#E6EEF6"
+        margin=dict(l=50, r=50, t=80, b=50)
     )
-    return fig
 
-def create_heatmap(df):
+# Heatmap modes: mode -> (summary entry, title, measure)
+HEATMAP_MODES = {
+    'borough': ('injuries_borough_hour', "Crash Data Heatmap", "Injuries"),
+    'weekday': ('crashes_weekday_hour', "Crash Frequency by Day and Hour", "Crashes"),
+}
+
+def create_heatmap(df, mode='borough'):
     """
-    Simple heatmap focusing on time patterns
+    Heatmap by crash hour: injuries per borough ('borough' mode) or crashes per day
+    of the week ('weekday' mode). Accepts a DataFrame or a summary.
     """
     try:
-        # Sample data creation if your dataframe doesn't have time/date columns
-        # Replace this with your actual data processing
-        dff = df.copy()
-        
-        # If you don't have time data, create a sample heatmap with available data
-        # This is a fallback - adjust based on your actual data structure
-        if all(col in dff.columns for col in ['BOROUGH', 'NUMBER OF PERSONS INJURED']):
-            # Example: Heatmap of injuries by borough and crash hour (if available)
-            if 'CRASH TIME' in dff.columns:
-                dff['HOUR'] = pd.to_datetime(dff['CRASH TIME'], errors='coerce').dt.hour
-                pivot_data = dff.pivot_table(
-                    index='BOROUGH',
-                    columns='HOUR',
-                    values='NUMBER OF PERSONS INJURED',
-                    aggfunc='sum',
-                    fill_value=0
-                )
-            else:
-                # Fallback: use whatever columns you have
-                numeric_cols = dff.select_dtypes(include=['number']).columns
-                if len(numeric_cols) >= 2:
-                    pivot_data = dff[numeric_cols[:5]].corr()
-                else:
-                    return create_empty_heatmap("Insufficient data for heatmap")
-        
-        fig = px.imshow(
-            pivot_data,
-            color_continuous_scale='Viridis',
-            aspect="auto",
-            title="Crash Data Heatmap"
-        )
-        
-        fig.update_layout(
-            height=500,
-            paper_bgcolor="rgba(0,0,0,0)",
-            plot_bgcolor="rgba(0,0,0,0)",
-            font_color="#E6EEF6"
-)
-        return fig
+        key, title, measure = HEATMAP_MODES[mode]
+        pivot_data = _summary(df).get(key, pd.DataFrame())
+        if pivot_data.empty:
+            return create_empty_heatmap("Insufficient data for heatmap")
+
+        return _heatmap_figure(pivot_data, title, measure)
         
     except Exception as e:
-        print(f"Error in create_heatmap: {e}")
+        log.exception("Error in create_heatmap: %s", e)
         return create_empty_heatmap("Error generating heatmap")
 
+def _heatmap_figure(pivot_data, title="Crash Data Heatmap", measure="color"):
+    row_name = pivot_data.index.name or "BOROUGH"
+    return {
+        "data": [{
+            "type": "heatmap", "z": typed_array(pivot_data.to_numpy(dtype=float)),
+            "x": [int(h) for h in pivot_data.columns], "y": [str(b) for b in pivot_data.index],
+            "coloraxis": "coloraxis",
+            "hovertemplate": f"HOUR: %{{x}}<br>{row_name}: %{{y}}<br>{measure}: %{{z}}<extra></extra>"
+        }],
+        "layout": layout(
+            title=title,
+            height=500,
+            coloraxis={"colorscale": "Viridis", "colorbar": {"title": {"text": measure}}},
+            xaxis={"title": "HOUR"},
+            yaxis={"title": row_name, "autorange": "reversed"}
+        )
+    }
+
 # --- Map Creation Functions ---
 def create_map(df):
-    """Map: Crash Locations (Sampled)."""
-    if df.empty or 'LATITUDE' not in df.columns: return empty_fig("No Location Data")
-    # Sample 2000 points
-    data = df.dropna(subset=['LATITUDE', 'LONGITUDE']).head(2000)
-    fig = px.scatter_mapbox(data, lat='LATITUDE', lon='LONGITUDE', color='NUMBER OF PERSONS INJURED',
-                            zoom=9, mapbox_style="open-street-map", title="Crash Locations")
-    fig.update_layout(paper_bgcolor="rgba(0,0,0,0)",
-    plot_bgcolor="rgba(0,0,0,0)",
-    font_color="#E6EEF6",
-     margin={"r":0,"t":40,"l":0,"b":0})
-    
-    return fig
+    """
+    Map: Injury density per grid cell, with a stratified sample of crash locations.
+    Accepts a DataFrame or a summary.
+    """
+    summary = _summary(df)
+    cells = summary['map_cells']
+    points = summary['map_points']
+    if cells.empty: return empty_fig("No Location Data")
+
+    # Blur radius in pixels at the initial zoom, so neighbouring cells blend
+    radius = max(3, int(cells.attrs.get('cell_size', GRID_CELL) / MAP_DEGREES_PER_PIXEL * 1.5))
+
+    data = [{
+        "type": "densitymapbox",
+        "lat": typed_array(cells['LATITUDE']), "lon": typed_array(cells['LONGITUDE']),
+        "z": typed_array(cells['injuries']), "radius": radius,
+        "customdata": typed_array(cells['crashes']), "colorbar": {"title": {"text": "Injuries"}},
+        "hovertemplate": "Injuries: %{z:,.0f}<br>Crashes: %{customdata:,}<extra></extra>", "name": "Injuries"
+    }]
+    if not points.empty:
+        data.append({
+            "type": "scattermapbox",
+            "lat": typed_array(points['LATITUDE']), "lon": typed_array(points['LONGITUDE']), "mode": "markers",
+            "marker": {"size": 4, "color": "#E6EEF6", "opacity": 0.6},
+            "customdata": typed_array(points['NUMBER OF PERSONS INJURED']),
+            "hovertemplate": "Persons injured: %{customdata:.0f}<extra></extra>", "name": "Sampled crashes"
+        })
+    return {"data": data, "layout": layout(
+        title="Crash Locations", showlegend=False,
+        mapbox={"style": "open-street-map", "zoom": MAP_ZOOM,
+                "center": {"lat": GRID_ORIGIN[0] + GRID_EXTENT[0] / 2, "lon": GRID_ORIGIN[1] + GRID_EXTENT[1] / 2}},
+        margin={"r":0,"t":40,"l":0,"b":0}
+    )}
 
 # --- Line chart Creation Functions ---
 def create_line(df):
     """
-    Create a line chart showing crash trends over time
+    Create a line chart showing crash trends over time.
+    Accepts a DataFrame or a summary.
     """
     try:
-        dff = df.copy()
-        
-        
-        # Option 1: Try to use date column for monthly/daily trends
-        date_columns = ['CRASH DATE', 'CRASH_DATE', 'Date', 'date']
-        date_col = None
-        
-        for col in date_columns:
-            if col in dff.columns:
-                date_col = col
-                break
-        
-        if date_col:
-            return create_date_based_line(dff, date_col)
-        
-        # Option 2: Use year column if that's all we have
-        year_col = 'CRASH_YEAR'
-        if year_col in dff.columns:
-            return create_year_based_line(dff, year_col)
-        
-        return create_empty_line("No date or year columns found")
+        summary = _summary(df)
+        by_day = summary.get('crashes_by_day')
+        by_month = summary['crashes_by_month']
+        by_year = summary['crashes_by_year']
+
+        if by_year.empty:
+            return create_empty_line("No valid date data available")
+
+        # Determine the best time grouping based on data span
+        if by_day is not None:
+            span = (by_day.index.max() - by_day.index.min()).days
+            granularity = 'daily' if span <= 31 else 'monthly' if span <= 365 else 'yearly'
+        else:
+            # Summaries from the cube have no day resolution
+            granularity = 'monthly' if len(by_year) == 1 and not by_month.empty else 'yearly'
+
+        if granularity == 'daily':  # Less than 1 month - use daily
+            time_data = pd.DataFrame({'DATE_ONLY': by_day.index.date, 'CRASH_COUNT': by_day.values.astype(int)})
+            x_col, x_title, title_suffix = 'DATE_ONLY', "Date", "Daily"
+
+        elif granularity == 'monthly':  # Less than 1 year - use monthly
+            by_month = by_month.sort_index()
+            time_data = pd.DataFrame({
+                'YEAR_MONTH_STR': [f"{y}-{m:02d}" for y, m in by_month.index],
+                'CRASH_COUNT': by_month.values.astype(int)
+            })
+            x_col, x_title, title_suffix = 'YEAR_MONTH_STR', "Month", "Monthly"
+
+        else:  # More than 1 year - use yearly
+            time_data = pd.DataFrame({'YEAR': by_year.index.astype(int), 'CRASH_COUNT': by_year.values.astype(int)})
+            time_data = time_data.sort_values('YEAR')
+            x_col, x_title, title_suffix = 'YEAR', "Year", "Yearly"
+
+        return _trend_figure(time_data, x_col, x_title, title_suffix)
         
     except Exception as e:
-        print(f"Error creating line chart: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error creating line chart: %s", e)
         return create_empty_line("Error generating line chart")
 
 # ---functions for line chart ---
-def create_date_based_line(df, date_col):
-    """Create line chart using date column for proper time series"""
-    dff = df.copy()
-    
-    # Convert to datetime
-    dff['DATE'] = pd.to_datetime(dff[date_col], errors='coerce')
-    dff = dff.dropna(subset=['DATE'])
-    
-    if dff.empty:
-        return create_empty_line("No valid date data available")
-    
-    # Extract different time periods
-    dff['YEAR'] = dff['DATE'].dt.year
-    dff['MONTH'] = dff['DATE'].dt.month
-    dff['YEAR_MONTH'] = dff['DATE'].dt.to_period('M')
-    dff['DATE_ONLY'] = dff['DATE'].dt.date
-    
-    print(f"Date range: {dff['DATE'].min()} to {dff['DATE'].max()}")
-    print(f"Years in data: {sorted(dff['YEAR'].unique())}")
-    
-    # Determine the best time grouping based on data span
-    date_range = dff['DATE'].max() - dff['DATE'].min()
-    
-    if date_range.days <= 31:  # Less than 1 month - use daily
-        time_data = dff.groupby('DATE_ONLY').size().reset_index(name='CRASH_COUNT')
-        time_data = time_data.sort_values('DATE_ONLY')
-        x_col = 'DATE_ONLY'
-        x_title = "Date"
-        title_suffix = "Daily"
-        
-    elif date_range.days <= 365:  # Less than 1 year - use monthly
-        time_data = dff.groupby('YEAR_MONTH').size().reset_index(name='CRASH_COUNT')
-        time_data = time_data.sort_values('YEAR_MONTH')
-        time_data['YEAR_MONTH_STR'] = time_data['YEAR_MONTH'].astype(str)
-        x_col = 'YEAR_MONTH_STR'
-        x_title = "Month"
-        title_suffix = "Monthly"
-        
-    else:  # More than 1 year - use yearly
-        time_data = dff.groupby('YEAR').size().reset_index(name='CRASH_COUNT')
-        time_data = time_data.sort_values('YEAR')
-        x_col = 'YEAR'
-        x_title = "Year"
-        title_suffix = "Yearly"
-    
-    print(f"Using {title_suffix} grouping")
-    print(f"Time data points: {len(time_data)}")
-    
-    # Create line chart
-    fig = px.line(
-        time_data,
-        x=x_col,
-        y='CRASH_COUNT',
-        title=f'Crash Trends ({title_suffix})',
-        labels={x_col: x_title, 'CRASH_COUNT': 'Number of Crashes'}
-    )
-    
-    # Add markers and customize
-    fig.update_traces(
-        mode='lines+markers',
-        marker=dict(size=8),
-        line=dict(width=3),
-        hovertemplate=f'<b>{x_title}: %{{x}}</b><br>Crash Count: %{{y:,}}<extra></extra>'
-    )
-    
-    fig.update_layout(
-        title={'text': f'Crash Trends ({title_suffix})', 'x': 0.5, 'font': {'size': 20}},
-        xaxis_title=x_title,
-        yaxis_title="Number of Crashes",
-        height=500,
-        showlegend=False,
-        margin=dict(l=60, r=50, t=80, b=80),
-        plot_bgcolor="rgba(0,0,0,0)",
-        font_color="#E6EEF6",
-        paper_bgcolor="rgba(0,0,0,0)",
-
-    )
-    
+def _trend_figure(time_data, x_col, x_title, title_suffix):
+    """Line chart of CRASH_COUNT over x_col"""
+    x = time_data[x_col]
+    x = typed_array(x) if pd.api.types.is_numeric_dtype(x) else [str(v) for v in x]
+    xaxis = {"title": x_title}
     # Rotate x-axis labels if there are many points
     if len(time_data) > 6:
-        fig.update_xaxes(tickangle=45)
+        xaxis["tickangle"] = 45
     
-    fig.update_yaxes(tickformat=',')
-    
-    return fig
-
-# ---functions for line chart ---
-def create_year_based_line(df, year_col):
-    """Create line chart using only year column"""
-    dff = df.copy()
-    
-    # Clean year data
-    dff['YEAR'] = pd.to_numeric(dff[year_col], errors='coerce')
-    dff = dff.dropna(subset=['YEAR'])
-    
-    if dff.empty:
-        return create_empty_line("No valid year data available")
-    
-    # Group by year
-    yearly_trend = dff.groupby('YEAR').size().reset_index(name='CRASH_COUNT')
-    yearly_trend = yearly_trend.sort_values('YEAR')
-    
-    print(f"Years: {yearly_trend['YEAR'].tolist()}")
-    print(f"Counts: {yearly_trend['CRASH_COUNT'].tolist()}")
-    
-    # If we only have one year, show a message
-    if len(yearly_trend) <= 1:
-        return create_empty_line(f"Only one year of data available ({yearly_trend['YEAR'].iloc[0]})")
-    
-    # Create line chart
-    fig = px.line(
-        yearly_trend,
-        x='YEAR',
-        y='CRASH_COUNT',
-        title='Yearly Crash Trends',
-        labels={'YEAR': 'Year', 'CRASH_COUNT': 'Number of Crashes'}
-    )
-    
-    fig.update_traces(
-        mode='lines+markers',
-        marker=dict(size=10),
-        line=dict(width=4),
-        hovertemplate='<b>Year: %{x}</b><br>Crash Count: %{y:,}<extra></extra>'
-    )
-    
-    fig.update_layout(
-        title={'text': 'Yearly Crash Trends', 'x': 0.5, 'font': {'size': 20}},
-        xaxis_title="Year",
-        yaxis_title="Number of Crashes",
-        height=500,
-        showlegend=False,
-        margin=dict(l=60, r=50, t=80, b=50),
-        paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        font_color="#E6EEF6"
-    )
-    
-    fig.update_xaxes(tickformat='d')
-    fig.update_yaxes(tickformat=',')
-    
-    return fig
+    return {
+        "data": [{
+            "type": "scatter", "x": x, "y": typed_array(time_data['CRASH_COUNT']),
+            "mode": "lines+markers", "marker": {"size": 8}, "line": {"width": 3},
+            "hovertemplate": f'<b>{x_title}: %{{x}}</b><br>Crash Count: %{{y:,}}<extra></extra>'
+        }],
+        "layout": layout(
+            title={'text': f'Crash Trends ({title_suffix})', 'x': 0.5, 'font': {'size': 20}},
+            xaxis=xaxis,
+            yaxis={"title": "Number of Crashes", "tickformat": ","},
+            height=500,
+            showlegend=False,
+            margin=dict(l=60, r=50, t=80, b=80)
+        )
+    }
 
 # --- Empty line chart function ---
 def create_empty_line(message):
     """Create empty line chart with message"""
-    fig = go.Figure()
-    fig.add_annotation(
-        text=message,
-        xref="paper", yref="paper",
-        x=0.5, y=0.5,
-        showarrow=False,
-        font=dict(size=16)
-    )
-    fig.update_layout(
-        title={'text': 'Crash Trends', 'x': 0.5},
-        height=500,
-        paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        font_color="#E6EEF6"
-    )
-    return fig
\ No newline at end of file
+    return _message_fig({'text': 'Crash Trends', 'x': 0.5}, message, height=500)
@@ -0,0 +1,399 @@
+import copy
+
+import numpy as np
+import pandas as pd
+
+from .DataLoader import FILTER_MAP, MULTI_FILTER_MAP, filter_values
+from .indexes import encode_slots, label_key
+
+# Filter dimensions of the cube: 'Filter ID' -> 'Column Name'
+CUBE_DIMENSIONS = {
+    'borough': 'BOROUGH',
+    'year': 'CRASH_YEAR',
+    'factor1': 'CONTRIBUTING FACTOR VEHICLE 1',
+    'demographic': 'MOST_COMMON_SEX'
+}
+
+# Extra group-by dimensions, each stored in its own cuboid with one measure.
+# A tuple of columns is one combined dimension (weekday * 24 + hour).
+TIME_DIMENSIONS = {
+    'month': ('CRASH_MONTH', 'crashes'),
+    'hour': ('CRASH_HOUR', 'injuries'),
+    'weekday_hour': (('CRASH_WEEKDAY', 'CRASH_HOUR'), 'crashes')
+}
+
+# Time cuboids kept per year (the line chart plots years and months); the others are
+# only read summed over the selected years and are stored as prefix sums over years
+PER_YEAR_TIME = ('month',)
+
+# Multi-valued dimensions (MULTI_FILTER_MAP slot columns) with the measure stored per value:
+# a row counts once under every distinct value of its slots. Vehicle types are too many.
+MULTI_DIMENSIONS = {
+    'factor': 'crashes'
+}
+
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+INJURY_COL = 'NUMBER OF PERSONS INJURED'
+FATALITY_COLS = ['NUMBER OF PEDESTRIANS KILLED', 'NUMBER OF CYCLIST KILLED', 'NUMBER OF MOTORIST KILLED']
+PERSONS_COL = 'PERSONS_INVOLVED_COUNT'
+
+
+# --- Helpers ---
+def _measure(df, col):
+    """Column as float array with missing values as 0, or zeros if the column is absent."""
+    if col not in df.columns:
+        return np.zeros(len(df))
+    return pd.to_numeric(df[col], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+def _weights(df):
+    """Per-row weight of every cube measure (None counts rows)."""
+    persons = pd.to_numeric(df[PERSONS_COL], errors='coerce') if PERSONS_COL in df.columns else pd.Series(np.nan, index=df.index)
+    return {
+        'crashes': None,
+        'injuries': _measure(df, INJURY_COL),
+        'fatalities': sum((_measure(df, c) for c in FATALITY_COLS if c in df.columns), np.zeros(len(df))),
+        'persons_sum': persons.fillna(0).to_numpy(dtype=float),
+        'persons_count': persons.notna().to_numpy(dtype=float),
+    }
+
+def _label_order(label):
+    """Sort key putting numeric labels in numeric order, like factorize(sort=True) does."""
+    try:
+        return (0, float(label), '')
+    except ValueError:
+        return (1, 0.0, label)
+
+def _column(df, col):
+    """The values of a dimension's column (None if absent); a (weekday, hour) pair is combined."""
+    if isinstance(col, tuple):
+        weekday, hour = col
+        if weekday not in df.columns or hour not in df.columns:
+            return None
+        return pd.to_numeric(df[weekday], errors='coerce') * 24 + pd.to_numeric(df[hour], errors='coerce')
+    return df[col] if col in df.columns else None
+
+def _axis(series, values, n_rows):
+    """
+    Dictionary-encodes one cube axis against its current labels.
+    Returns (codes, labels, positions): the merged sorted labels, each row's position in
+    them and where every current position (plus the missing-value slot) moved to.
+    Missing values (and absent columns) go to an extra last slot, so totals include
+    them while group-bys can leave them out.
+    """
+    if series is not None:
+        local, uniques = pd.factorize(series, sort=True)
+        keys = [label_key(u) for u in uniques]
+    else:
+        local, keys = np.full(n_rows, -1), []
+
+    labels = sorted(set(values) | set(keys), key=_label_order)
+    lookup = {v: i for i, v in enumerate(labels)}
+    positions = np.array([lookup[v] for v in values] + [len(labels)])
+    # Extra trailing slot so missing values (code -1) go to the missing-value slot
+    mapping = np.array([lookup[k] for k in keys] + [len(labels)])
+    return mapping[local], labels, positions
+
+def _multi_axis(df, cols, values):
+    """
+    Like _axis() for the slot columns of a multi-valued dimension: returns (codes,
+    labels, positions) where codes has one column per slot, -1 for missing and repeated
+    values. There is no missing-value slot, a row without values isn't counted.
+    """
+    slots, slot_labels = encode_slots([df[col] if col in df.columns else None for col in cols])
+    labels = sorted(set(values) | set(slot_labels), key=_label_order)
+    lookup = {v: i for i, v in enumerate(labels)}
+    positions = np.array([lookup[v] for v in values], dtype=np.int64)
+    # Extra trailing slot so missing values (code -1) stay -1
+    mapping = np.array([lookup[k] for k in slot_labels] + [-1])
+    return mapping[slots], labels, positions
+
+def _grow(values, shape, positions):
+    """values copied into a zero array of shape, each axis' entries moved to positions."""
+    grown = np.zeros(shape)
+    grown[np.ix_(*positions)] = values
+    return grown
+
+def _prefix(values, axis):
+    """
+    Running sums of values along axis after a slab of zeros, so the sum over the
+    positions a..b-1 is prefix[b] - prefix[a] along that axis.
+    """
+    zeros = np.zeros_like(np.take(values, [0], axis=axis))
+    return np.concatenate([zeros, np.cumsum(values, axis=axis)], axis=axis)
+
+def _take(values, axis, positions):
+    """values at the sorted positions along axis; consecutive positions are a slice, nothing is copied."""
+    if positions[-1] - positions[0] + 1 == len(positions):
+        index = [slice(None)] * values.ndim
+        index[axis] = slice(positions[0], positions[-1] + 1)
+        return values[tuple(index)]
+    return np.take(values, positions, axis=axis)
+
+
+# --- Aggregate Cube ---
+class AggregateCube:
+    """
+    Dense pre-aggregated counts and sums over the dashboard's low-cardinality dimensions.
+
+    The core cuboid is borough x year x factor x sex with crash counts, injuries,
+    fatalities and persons-involved sums. More cuboids add the month (crash counts),
+    the hour (injuries) and the weekday x hour (crash counts) so the line chart and
+    heatmaps can be answered too, and one counts crashes per contributing factor of any
+    vehicle for the factor chart. Any filter on the core dimensions, one value or several,
+    is an index into the arrays, so queries without a search term never touch the rows.
+
+    The core measures are also kept as prefix sums over the year axis, and the hour and
+    factor cuboids only as those, so totals over a range of years are the difference of two
+    year slabs: a 15-year range costs what a single year does.
+    """
+
+    def __init__(self, df):
+        self.n_rows = 0
+        self.keys = list(CUBE_DIMENSIONS)
+        self.labels = {key: [] for key in list(CUBE_DIMENSIONS) + list(TIME_DIMENSIONS) + list(MULTI_DIMENSIONS)}
+        self.lookup = {key: {} for key in self.labels}
+        self.core = {}
+        self.prefix = {}
+        self.time = {}
+        self.time_prefix = {}
+        self.multi = {}
+        self._add(df)
+
+    def _add(self, df):
+        """
+        Adds the rows of df to the cube. New labels are merged into each axis in sorted
+        order, growing the arrays. Arrays and label lists are replaced, never modified,
+        so copies made by extend() don't affect each other.
+        """
+        dimensions = {**CUBE_DIMENSIONS, **{key: col for key, (col, _) in TIME_DIMENSIONS.items()}}
+        codes, positions = {}, {}
+        for key, col in dimensions.items():
+            codes[key], labels, positions[key] = _axis(_column(df, col), self.labels[key], len(df))
+            self.labels[key] = labels
+            self.lookup[key] = {v: i for i, v in enumerate(labels)}
+
+        shape = tuple(len(self.labels[key]) + 1 for key in self.keys)
+        flat = np.ravel_multi_index([codes[key] for key in self.keys], shape)
+        weights = _weights(df)
+
+        size = int(np.prod(shape))
+        year_axis = self.keys.index('year')
+        core_positions = [positions[key] for key in self.keys]
+        for name, w in weights.items():
+            base = _grow(self.core[name], shape, core_positions) if name in self.core else 0
+            self.core[name] = base + np.bincount(flat, weights=w, minlength=size).reshape(shape)
+            self.prefix[name] = _prefix(self.core[name], year_axis)
+
+        for key, (col, measure) in TIME_DIMENSIONS.items():
+            time_size = len(self.labels[key]) + 1
+            time_shape = shape + (time_size,)
+            time_flat = flat * time_size + codes[key]
+            time_positions = core_positions + [positions[key]]
+            if key in self.time:
+                base = _grow(self.time[key], time_shape, time_positions)
+            elif key in self.time_prefix:
+                # Back from running sums to per-year values
+                base = _grow(np.diff(self.time_prefix[key], axis=year_axis), time_shape, time_positions)
+            else:
+                base = 0
+            values = base + np.bincount(time_flat, weights=weights[measure], minlength=size * time_size).reshape(time_shape)
+            # float32 halves the time cuboids and stays exact for (running) per-cell counts below 2**24
+            if key in PER_YEAR_TIME:
+                self.time[key] = values.astype(np.float32)
+            else:
+                self.time_prefix[key] = _prefix(values, year_axis).astype(np.float32)
+
+        for key, measure in MULTI_DIMENSIONS.items():
+            slots, labels, multi_positions = _multi_axis(df, MULTI_FILTER_MAP[key], self.labels[key])
+            self.labels[key] = labels
+            self.lookup[key] = {v: i for i, v in enumerate(labels)}
+            multi_shape = shape + (len(labels),)
+            # One entry per row and distinct value
+            rows, slot = np.nonzero(slots >= 0)
+            multi_flat = flat[rows] * len(labels) + slots[rows, slot]
+            w = weights[measure]
+            base = _grow(np.diff(self.multi[key], axis=year_axis), multi_shape, core_positions + [multi_positions]) if key in self.multi else 0
+            values = base + np.bincount(multi_flat, weights=None if w is None else w[rows], minlength=size * len(labels)).reshape(multi_shape)
+            self.multi[key] = _prefix(values, year_axis).astype(np.float32)
+
+        self.n_rows += len(df)
+
+    def extend(self, delta):
+        """A new cube with the rows of delta added; this cube is left unchanged."""
+        cube = copy.copy(self)
+        cube.labels = dict(self.labels)
+        cube.lookup = dict(self.lookup)
+        cube.core = dict(self.core)
+        cube.prefix = dict(self.prefix)
+        cube.time = dict(self.time)
+        cube.time_prefix = dict(self.time_prefix)
+        cube.multi = dict(self.multi)
+        cube._add(delta)
+        return cube
+
+    def _selection(self, inputs):
+        """
+        The sorted axis positions selected by each filter in inputs, as a dict.
+        Returns None if a filter can't be answered from the cube, and False if it
+        matches no rows.
+        """
+        selection = {}
+        for key in list(FILTER_MAP) + list(MULTI_FILTER_MAP):
+            values = filter_values(key, inputs.get(key))
+            if values is None:
+                continue
+            if key not in self.keys:
+                return None
+            positions = sorted({self.lookup[key][label_key(v)] for v in values if label_key(v) in self.lookup[key]})
+            if not positions:
+                return False
+            selection[key] = np.array(positions)
+        return selection
+
+    def _cells(self, values, selection, prefix=False):
+        """
+        The cells of a cuboid selected on every filter axis; each axis is kept so every
+        query reduces the same way. With prefix=True values holds running sums over the
+        years, and the selected years are summed into one slab from two slabs per run
+        of consecutive years.
+        """
+        for axis, key in enumerate(self.keys):
+            if prefix and key == 'year':
+                # Every year, and the missing-value slot, when the year isn't filtered
+                positions = selection.get(key, np.arange(values.shape[axis] - 1))
+                breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+                starts = positions[np.concatenate([[0], breaks])]
+                stops = positions[np.append(breaks - 1, len(positions) - 1)] + 1
+                values = (np.take(values, stops, axis=axis) - np.take(values, starts, axis=axis)).sum(axis=axis, keepdims=True)
+            elif key in selection:
+                values = _take(values, axis, selection[key])
+        return values
+
+    def _selected_labels(self, key, selection):
+        """Labels of the positions selected on one axis, None for the missing-value slot."""
+        labels = self.labels[key] + [None]
+        return [labels[p] for p in selection[key]] if key in selection else labels
+
+    def facet_counts(self, key, inputs):
+        """
+        Crash counts per label of the dimension key under the other filters in inputs
+        (its own filter is left out, so every alternative value keeps its count).
+        Returns None if the cube doesn't store the dimension or can't answer a filter.
+        """
+        if key not in self.keys and key not in self.multi:
+            return None
+        selection = self._selection({k: v for k, v in inputs.items() if k != key})
+        if selection is None:
+            return None
+        if selection is False:
+            return pd.Series(0.0, index=self.labels[key])
+
+        if key in self.multi:
+            # A crash counts under each of its values
+            values = self._cells(self.multi[key], selection, prefix=True)
+            return pd.Series(values.sum(axis=tuple(range(len(self.keys)))), index=self.labels[key])
+
+        axis = self.keys.index(key)
+        # Counts per year need the per-year cuboid, the others sum the years from the prefix sums
+        if key == 'year':
+            values = self._cells(self.core['crashes'], selection)
+        else:
+            values = self._cells(self.prefix['crashes'], selection, prefix=True)
+        counts = values.sum(axis=tuple(a for a in range(values.ndim) if a != axis))
+        # The last slot counts rows where the value is missing
+        return pd.Series(counts[:len(self.labels[key])], index=self.labels[key])
+
+    def values(self, col):
+        """The labels of the dimension stored from column col, or None if it isn't one."""
+        for key, dimension in CUBE_DIMENSIONS.items():
+            if dimension == col:
+                return self.labels[key]
+        return None
+
+    def query(self, inputs):
+        """
+        Returns the dashboard summary for the filters in inputs,
+        or None if they include a dimension the cube doesn't have.
+        """
+        selection = self._selection(inputs)
+        if selection is None:
+            return None
+        if selection is False:
+            return empty_summary()
+
+        borough_axis, year_axis, factor_axis, sex_axis = range(len(self.keys))
+        # Sums over the selected years come from the prefix sums, per-year series from the per-year cuboids
+        core = {name: self._cells(values, selection, prefix=True) for name, values in self.prefix.items()}
+
+        def by(values, *keep):
+            return values.sum(axis=tuple(a for a in range(values.ndim) if a not in keep))
+
+        def labelled(values, key, numeric=False):
+            series = pd.Series(values, index=self._selected_labels(key, selection))
+            series = series[series.index.notna()]
+            if numeric:
+                series.index = series.index.astype(float).astype(int)
+                return series
+            # Like a groupby on a categorical column, every category is listed
+            return series.reindex(self.labels[key], fill_value=0)
+
+        years = self._selected_labels('year', selection)
+        months = self.labels['month'] + [None]
+        by_month = by(self._cells(self.time['month'], selection), year_axis, 4)
+        crashes_by_month = pd.Series({
+            (int(float(y)), int(float(m))): by_month[i, j]
+            for i, y in enumerate(years) for j, m in enumerate(months)
+            if y is not None and m is not None and by_month[i, j] > 0
+        }, dtype=float)
+
+        hours = self.labels['hour'] + [None]
+        by_hour = by(self._cells(self.time_prefix['hour'], selection, prefix=True), borough_axis, 4)
+        injuries_borough_hour = pd.DataFrame(by_hour, index=self._selected_labels('borough', selection), columns=hours)
+        injuries_borough_hour = injuries_borough_hour.loc[injuries_borough_hour.index.notna(), injuries_borough_hour.columns.notna()]
+        injuries_borough_hour = injuries_borough_hour.reindex(self.labels['borough'], fill_value=0)
+        injuries_borough_hour = injuries_borough_hour.rename_axis(index='BOROUGH', columns='HOUR')
+        injuries_borough_hour.columns = injuries_borough_hour.columns.astype(float).astype(int)
+
+        crashes_by_year = labelled(by(self._cells(self.core['crashes'], selection), year_axis), 'year', numeric=True)
+
+        by_week_hour = by(self._cells(self.time_prefix['weekday_hour'], selection, prefix=True), 4)
+        week_hours = np.zeros(7 * 24)
+        for label, count in zip(self.labels['weekday_hour'], by_week_hour):
+            week_hours[int(float(label))] += count
+
+        return {
+            'crashes': int(core['crashes'].sum()),
+            'injuries': float(core['injuries'].sum()),
+            'fatalities': float(core['fatalities'].sum()),
+            'persons_sum': float(core['persons_sum'].sum()),
+            'persons_count': float(core['persons_count'].sum()),
+            'injuries_by_borough': labelled(by(core['injuries'], borough_axis), 'borough'),
+            'factor_counts': pd.Series(by(self._cells(self.multi['factor'], selection, prefix=True), 4), index=self.labels['factor']),
+            'crashes_by_year': crashes_by_year[crashes_by_year > 0],
+            'crashes_by_month': crashes_by_month,
+            'injuries_borough_hour': injuries_borough_hour,
+            'crashes_weekday_hour': weekday_hour_frame(week_hours),
+        }
+
+
+def empty_summary():
+    """Summary of an empty selection."""
+    return {
+        'crashes': 0,
+        'injuries': 0.0,
+        'fatalities': 0.0,
+        'persons_sum': 0.0,
+        'persons_count': 0.0,
+        'injuries_by_borough': pd.Series(dtype=float),
+        'factor_counts': pd.Series(dtype=float),
+        'crashes_by_year': pd.Series(dtype=float),
+        'crashes_by_month': pd.Series(dtype=float),
+        'injuries_borough_hour': pd.DataFrame(),
+        'crashes_weekday_hour': pd.DataFrame(),
+    }
+
+def weekday_hour_frame(counts):
+    """Weekday x hour DataFrame of 7 * 24 counts ordered by weekday * 24 + hour."""
+    counts = np.asarray(counts, dtype=float).reshape(7, 24)
+    return pd.DataFrame(counts, index=WEEKDAYS, columns=range(24)).rename_axis(index='WEEKDAY', columns='HOUR')
@@ -0,0 +1,295 @@
+import itertools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .DataLoader import append_rows, facet_options, filter_options, get_options, merge_options, options_from_values
+from .aggregate import merge_summaries, summarize_rows
+from .indexes import FilterIndex, SearchIndex
+from .cube import AggregateCube
+from .geo import GeoIndex, merge_map
+from .jobs import checkpoint
+from .metrics import stage
+from .result_cache import filter_key
+from .selection import RowSelection
+
+# Number of recent row selections each dataset keeps
+SELECTION_CACHE_SIZE = 16
+
+# Delta segments kept beside the base dataset before they are merged into one
+MAX_SEGMENTS = 8
+
+_versions = itertools.count(1)
+_lock = threading.Lock()
+_current = None
+_listeners = []
+
+
+# --- Dataset ---
+class Dataset:
+    """
+    The loaded crash DataFrame together with everything derived from it at load time.
+    Each instance gets a new version stamp, which keys cached results. Datasets are
+    never modified: a refresh builds a new one with extend() and swaps it in.
+    """
+
+    def __init__(self, df, filter_index=None, search_index=None, cube=None, geo=None, options=None, deltas=()):
+        self.df = df
+        self.version = next_version()
+
+        #Row-id index so filters don't copy and scan the whole dataset
+        self.filter_index = FilterIndex(df) if filter_index is None else filter_index
+
+        #Token index so searches don't convert and scan the string columns
+        self.search_index = SearchIndex(df) if search_index is None else search_index
+
+        #Pre-aggregated counts/sums answering the stats and charts when there is no search
+        self.cube = AggregateCube(df) if cube is None else cube
+
+        #Grid cell of every row so the map is drawn from per-cell aggregates
+        self.geo = GeoIndex(df) if geo is None else geo
+
+        #Dropdown options per column, computed on first use
+        self._options = dict(options or {})
+
+        #Names of the delta files appended to this dataset, in order
+        self.deltas = tuple(deltas)
+
+        self._selections = OrderedDict()
+        self._selections_lock = threading.Lock()
+
+    def select(self, inputs, search_text=None, logic="AND"):
+        """
+        Sorted row ids matching the filters and the search, or None for every row.
+        Recent selections are remembered, so the export reuses the rows the dashboard
+        callback already resolved for the same filter state.
+        """
+        key = filter_key(inputs, search_text, logic)
+        with self._selections_lock:
+            if key in self._selections:
+                self._selections.move_to_end(key)
+                return self._selections[key]
+
+        with stage('filter', rows_in=len(self.df)) as s:
+            rows = self.filter_index.select(inputs)
+            s.rows_out = len(self.df) if rows is None else len(rows)
+        if search_text and search_text.strip():
+            with stage('search', rows_in=s.rows_out) as s:
+                mask = self.search_index.match(search_text, logic, rows=rows)
+                rows = np.flatnonzero(mask) if rows is None else rows[mask]
+                s.rows_out = len(rows)
+
+        with self._selections_lock:
+            self._selections[key] = rows
+            while len(self._selections) > SELECTION_CACHE_SIZE:
+                self._selections.popitem(last=False)
+        return rows
+
+    def options(self, col):
+        """get_options() of a column, computed once per dataset (read from the cube for its dimensions)."""
+        if col not in self._options:
+            values = self.cube.values(col)
+            self._options[col] = get_options(self.df, col) if values is None else options_from_values(values)
+        return self._options[col]
+
+    def facet_options(self, key, inputs):
+        """Options of the filter key with their row counts under the other filters in inputs."""
+        counts = self.cube.facet_counts(key, inputs)
+        if counts is None and key in self.filter_index.columns:
+            # Filters the cube can't answer (e.g. any vehicle type) are counted over the selected rows' codes
+            counts = self.filter_index.facet_counts(key, inputs)
+        if counts is None:
+            return filter_options(self.options, key)
+        return facet_options(counts, inputs.get(key))
+
+    def extend(self, delta, name=None):
+        """
+        A new dataset version with the rows of delta appended as a segment beside this
+        one (see SegmentedDataset), so this dataset's frame and indexes are shared, not
+        copied; this dataset is left as it was for callbacks still using it.
+        """
+        return SegmentedDataset(self).extend(delta, name)
+
+    def _append(self, delta):
+        """
+        A new Dataset holding this dataset's rows followed by those of delta, in one
+        frame. The indexes, the cube, the map grid and the option lists are extended
+        from the delta rather than rebuilt, but the frame and the index arrays are
+        copied, so this is only used to merge delta segments.
+        """
+        delta = delta.reindex(columns=self.df.columns)
+        return Dataset(
+            append_rows(self.df, delta),
+            filter_index=self.filter_index.extend(delta),
+            search_index=self.search_index.extend(delta),
+            cube=self.cube.extend(delta),
+            geo=self.geo.extend(delta),
+            options={col: merge_options(options, get_options(delta, col)) for col, options in self._options.items()},
+        )
+
+    def view(self, rows):
+        """The rows of df at the given row ids (all of df when None) as a RowSelection, gathered per column on use."""
+        return RowSelection(self.df, rows)
+
+    @property
+    def columns(self):
+        return list(self.df.columns)
+
+    def __len__(self):
+        return len(self.df)
+
+    def parts(self, inputs, search_text=None):
+        """(dataset, row ids) pairs holding the matching rows: this dataset and its selection."""
+        yield self, self.select(inputs, search_text)
+
+    def summary(self, inputs, search_text=None):
+        """
+        The dashboard summary of the rows matching the filters and the search: from the
+        cube when there is no search, otherwise from one pass over the selected rows.
+        The map entries come from the grid index.
+        """
+        summary = None
+        if not (search_text and search_text.strip()):
+            with stage('cube'):
+                summary = self.cube.query(inputs)
+        rows = self.select(inputs, search_text)
+        checkpoint()
+
+        n_rows = len(self.df) if rows is None else len(rows)
+        if summary is None:
+            with stage('stats', rows_in=n_rows):
+                summary = summarize_rows(self.df, rows)
+
+        with stage('map', rows_in=n_rows):
+            summary.update(self.geo.summary(rows))
+        return summary
+
+
+# --- Segmented Dataset ---
+class SegmentedDataset:
+    """
+    A Dataset with the rows of delta files appended as segments beside it. Every
+    segment is a Dataset of its own rows with its own indexes, so a refresh costs the
+    delta's rows, and the base frame (memory-mapped from the shared column store)
+    is never copied into a worker's heap. Selections are made per segment and the
+    partial summaries and map aggregates merged, like the partitions of a
+    PartitionedDataset; the cube covers every segment. Past MAX_SEGMENTS the delta
+    segments are merged into one, which costs the delta rows only.
+    Offers the same summary()/parts()/options()/extend() interface as Dataset.
+    """
+
+    def __init__(self, base, segments=(), cube=None, options=None, deltas=None):
+        self.base = base
+        self.segments = tuple(segments)
+        self.version = next_version()
+        self.cube = base.cube if cube is None else cube
+        self.deltas = base.deltas if deltas is None else tuple(deltas)
+        self._options = dict(options or {})
+
+    @property
+    def columns(self):
+        return self.base.columns
+
+    def __len__(self):
+        return len(self.base) + sum(len(segment) for segment in self.segments)
+
+    def extend(self, delta, name=None):
+        """A new version with the rows of delta appended as one more segment; this one is left unchanged."""
+        delta = delta.reindex(columns=self.base.df.columns).reset_index(drop=True)
+        # Salted with the rows before it, so its map sample doesn't mirror the base's
+        segment = Dataset(delta, geo=GeoIndex(delta, salt=len(self)))
+        segments = self.segments + (segment,)
+        if len(segments) > MAX_SEGMENTS:
+            merged = segments[0]
+            for segment in segments[1:]:
+                merged = merged._append(segment.df)
+            segments = (merged,)
+
+        return SegmentedDataset(
+            self.base, segments,
+            cube=self.cube.extend(delta),
+            options={col: merge_options(options, get_options(delta, col)) for col, options in self._options.items()},
+            deltas=self.deltas + ((name,) if name else ()),
+        )
+
+    def parts(self, inputs, search_text=None):
+        """(segment Dataset, row ids) pairs holding the matching rows, the base first."""
+        for segment in (self.base,) + self.segments:
+            yield from segment.parts(inputs, search_text)
+
+    def summary(self, inputs, search_text=None):
+        """
+        The dashboard summary of the rows matching the filters and the search: from the
+        cube when there is no search, otherwise from the partial summaries of the
+        segments' selections. The map is merged from the segments' grid indexes.
+        """
+        summary = None
+        if not (search_text and search_text.strip()):
+            with stage('cube'):
+                summary = self.cube.query(inputs)
+
+        partials, maps = [], []
+        for segment, rows in self.parts(inputs, search_text):
+            checkpoint()
+            n_rows = len(segment) if rows is None else len(rows)
+            if summary is None:
+                with stage('stats', rows_in=n_rows):
+                    # The base dominates the work, so its shards report the job's progress
+                    partials.append(summarize_rows(segment.df, rows, progress=segment is self.base))
+            with stage('map', rows_in=n_rows):
+                maps.append(segment.geo.parts(rows))
+
+        if summary is None:
+            summary = merge_summaries(partials)
+        summary.update(merge_map(maps))
+        return summary
+
+    def options(self, col):
+        """get_options() of a column, merged from the segments once per version (read from the cube for its dimensions)."""
+        if col not in self._options:
+            values = self.cube.values(col)
+            if values is not None:
+                self._options[col] = options_from_values(values)
+            else:
+                options = self.base.options(col)
+                for segment in self.segments:
+                    options = merge_options(options, segment.options(col))
+                self._options[col] = options
+        return self._options[col]
+
+    def facet_options(self, key, inputs):
+        """Options of the filter key with their row counts under the other filters in inputs."""
+        counts = self.cube.facet_counts(key, inputs)
+        if counts is None and key in self.base.filter_index.columns:
+            # Counted over each segment's selected rows and added up by value
+            counts = self.base.filter_index.facet_counts(key, inputs)
+            for segment in self.segments:
+                counts = counts.add(segment.filter_index.facet_counts(key, inputs), fill_value=0)
+        if counts is None:
+            return filter_options(self.options, key)
+        return facet_options(counts, inputs.get(key))
+
+
+# --- Current dataset ---
+def next_version():
+    """A new dataset version stamp."""
+    return next(_versions)
+
+def get_dataset():
+    """The dataset callbacks should use. Take one reference per request and stick to it."""
+    return _current
+
+def set_dataset(dataset):
+    """Makes dataset current and notifies listeners (e.g. caches keyed on the old version)."""
+    global _current
+    with _lock:
+        _current = dataset
+    for listener in _listeners:
+        listener(dataset)
+    return dataset
+
+def on_dataset_change(listener):
+    """Registers listener(dataset) to be called whenever a new dataset becomes current."""
+    _listeners.append(listener)
+    return listener
@@ -0,0 +1,333 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from .DataLoader import write_partitions
+from .schema import SCHEMA, parse_datetimes
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+log = logging.getLogger(__name__)
+
+# Rows read from each CSV at a time; with the per-collision person aggregates this
+# bounds the memory of the pipeline
+ETL_CHUNK_ROWS = int(os.environ.get("CRASHES_ETL_CHUNK_ROWS", 500000))
+
+# Raw crash columns needed besides the ones the dashboard schema keeps
+CRASH_COLUMNS = ['COLLISION_ID', 'CRASH DATE', 'CRASH TIME', 'NUMBER OF PERSONS INJURED', 'NUMBER OF PERSONS KILLED']
+
+# Raw crash columns parsed as numbers; every other column is read as text
+CRASH_NUMERIC = ['COLLISION_ID', 'LATITUDE', 'LONGITUDE', 'NUMBER OF PERSONS INJURED', 'NUMBER OF PERSONS KILLED',
+                 'NUMBER OF PEDESTRIANS KILLED', 'NUMBER OF CYCLIST KILLED', 'NUMBER OF MOTORIST KILLED']
+
+# Numeric columns whose missing values are left missing instead of set to the median
+NOT_IMPUTED = ['COLLISION_ID', 'LATITUDE', 'LONGITUDE']
+
+PERSON_COLUMNS = ['COLLISION_ID', 'UNIQUE_ID', 'PERSON_INJURY', 'PERSON_SEX']
+
+# PERSON_INJURY values (lowercase) counted as killed / injured
+KILLED_VALUES = ["killed", "fatal", "fatally injured"]
+INJURED_VALUES = ["injured", "yes", "y", "1", "true"]
+
+# Columns missing in more than this share of the crashes are dropped
+SPARSE_SHARE = 0.5
+
+# Rows at or above these counts are treated as data entry errors
+INJURED_LIMIT = 100
+KILLED_LIMIT = 20
+
+# Person sexes that mean "not known"
+UNKNOWN_SEX = ['NAN', 'NULL', '', 'U']
+
+# Format of CRASH DATE + ' ' + CRASH TIME in the city's export; other values are inferred
+DATETIME_FORMAT = "%m/%d/%Y %H:%M"
+
+# Person aggregates buffered before they are combined
+COMPACT_ROWS = 2_000_000
+
+
+# --- Helpers ---
+def _peak_rss_mb():
+    """Highest resident set size the process has reached so far, in MB (None if unknown)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def _read_chunks(path, columns, chunk_rows):
+    """The CSV in chunks of chunk_rows rows, only the wanted columns, everything as text."""
+    return pd.read_csv(path, usecols=lambda col: col in columns, dtype=str, chunksize=chunk_rows)
+
+def _parse_numbers(chunk, columns):
+    """chunk with the given columns parsed as floats (unparseable values become NaN)."""
+    present = [col for col in columns if col in chunk.columns]
+    return chunk.assign(**{col: pd.to_numeric(chunk[col], errors='coerce') for col in present})
+
+def _median(counts):
+    """Median of the values counted in counts (a Series value -> count), like Series.median()."""
+    counts = counts.sort_index()
+    total = int(counts.sum())
+    if total == 0:
+        return np.nan
+    positions = np.cumsum(counts.to_numpy())
+    low = counts.index[np.searchsorted(positions, (total - 1) // 2, side='right')]
+    high = counts.index[np.searchsorted(positions, total // 2, side='right')]
+    return (low + high) / 2
+
+def _add_counts(counts, col, values):
+    counted = values.value_counts()
+    counts[col] = counted if col not in counts else counts[col].add(counted, fill_value=0)
+
+
+class _Stage:
+    """Rows, seconds and peak RSS of one pass of the pipeline, logged when it ends."""
+
+    def __init__(self, name, report):
+        self.name = name
+        self.report = report
+        self.rows_in = 0
+        self.rows_out = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        self.report[self.name] = {
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'seconds': seconds,
+            'rows_per_second': self.rows_in / seconds if seconds else None,
+            'peak_rss_mb': _peak_rss_mb(),
+        }
+        log.info("%s: %d -> %d rows in %.1fs (%.0f rows/s), peak RSS %.0f MB", self.name, self.rows_in,
+                 self.rows_out, seconds, self.rows_in / seconds if seconds else 0, self.report[self.name]['peak_rss_mb'] or 0)
+
+
+# --- Crashes ---
+def profile_crashes(path, chunk_rows=ETL_CHUNK_ROWS):
+    """
+    First pass over the crashes: the statistics the cleaning needs from the whole file,
+    i.e. the sparse columns to drop and the median (numeric) or mode (text) each
+    remaining column is filled with. Only value counts are kept, never rows.
+    """
+    columns = set(SCHEMA) | set(CRASH_COLUMNS)
+    rows, missing, counts = 0, None, {}
+    for chunk in _read_chunks(path, columns, chunk_rows):
+        chunk = _parse_numbers(chunk, CRASH_NUMERIC)
+        rows += len(chunk)
+        nulls = chunk.isna().sum()
+        missing = nulls if missing is None else missing.add(nulls, fill_value=0)
+        for col in chunk.columns:
+            if col not in NOT_IMPUTED:
+                _add_counts(counts, col, chunk[col])
+
+    missing = missing if missing is not None else pd.Series(dtype=float)
+    sparse = [col for col, n in missing.items() if n > rows * SPARSE_SHARE]
+    fills = {}
+    for col, counted in counts.items():
+        if col in sparse:
+            continue
+        if col in CRASH_NUMERIC:
+            fills[col] = _median(counted)
+        else:
+            # Most common value (the smallest on ties, like Series.mode()), 'unknown' for an empty column
+            fills[col] = counted[counted == counted.max()].sort_index().index[0] if len(counted) else "unknown"
+    return {'rows': rows, 'sparse': sparse, 'fills': fills}
+
+def clean_crashes(chunk, profile):
+    """
+    Cleans one chunk of raw crashes the way the notebook cleaned the whole file: sparse
+    columns dropped, missing values filled with the profile's medians and modes,
+    CRASH_DATETIME/CRASH_YEAR/CRASH_HOUR derived, text stripped and lowercased and
+    impossible injury/fatality counts removed.
+    """
+    chunk = _parse_numbers(chunk, CRASH_NUMERIC)
+    chunk = chunk.drop(columns=[col for col in profile['sparse'] if col in chunk.columns])
+    chunk = chunk.fillna({col: value for col, value in profile['fills'].items() if col in chunk.columns})
+
+    text_columns = [col for col in chunk.columns if col not in CRASH_NUMERIC]
+    if 'CRASH DATE' in chunk.columns and 'CRASH TIME' in chunk.columns:
+        chunk['CRASH_DATETIME'] = parse_datetimes(chunk['CRASH DATE'] + ' ' + chunk['CRASH TIME'], (DATETIME_FORMAT,))
+        chunk['CRASH_YEAR'] = chunk['CRASH_DATETIME'].dt.year.astype('Int64')
+        chunk['CRASH_HOUR'] = chunk['CRASH_DATETIME'].dt.hour
+
+    for col in text_columns:
+        chunk[col] = chunk[col].astype(str).str.strip().str.lower()
+
+    if 'NUMBER OF PERSONS INJURED' in chunk.columns:
+        injured = chunk['NUMBER OF PERSONS INJURED']
+        chunk = chunk[(injured >= 0) & (injured < INJURED_LIMIT)]
+    if 'NUMBER OF PERSONS KILLED' in chunk.columns:
+        killed = chunk['NUMBER OF PERSONS KILLED']
+        chunk = chunk[(killed >= 0) & (killed < KILLED_LIMIT)]
+    return chunk
+
+
+class Deduplicator:
+    """
+    Drops rows already seen in this or an earlier chunk, keeping the first, like
+    drop_duplicates() over the whole file. Only a sorted array of 64-bit row hashes
+    is kept between chunks.
+    """
+
+    def __init__(self):
+        self.seen = np.empty(0, dtype=np.uint64)
+
+    def __call__(self, chunk):
+        hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        first = ~pd.Series(hashes).duplicated().to_numpy()
+        positions = np.minimum(np.searchsorted(self.seen, hashes), max(len(self.seen) - 1, 0))
+        if len(self.seen):
+            first &= self.seen[positions] != hashes
+        self.seen = np.union1d(self.seen, hashes[first])
+        return chunk[first]
+
+
+# --- Persons ---
+def _combine(partials):
+    """Per-collision aggregates of several chunks combined (the first sex in file order wins)."""
+    combined = pd.concat(partials)
+    return combined.groupby(level=0, sort=False).agg(
+        {'persons': 'sum', 'killed': 'sum', 'injured': 'sum', 'sex': 'first'})
+
+def aggregate_persons(path, chunk_rows=ETL_CHUNK_ROWS, stage=None):
+    """
+    One row per collision from the person records: persons involved (records with a
+    UNIQUE_ID), persons killed and injured, and the sex of the first person listed.
+    Collision ids are int64 keys and sexes are codes into a small label list, so the
+    result takes a few bytes per collision however many person rows are read.
+    Returns a DataFrame indexed by COLLISION_ID with PERSONS_INVOLVED_COUNT,
+    KILLED_COUNT_PERSON, INJURED_COUNT_PERSON and MOST_COMMON_SEX.
+    """
+    labels = {}
+    partials, buffered = [], 0
+    for chunk in _read_chunks(path, PERSON_COLUMNS, chunk_rows):
+        if stage is not None:
+            stage.rows_in += len(chunk)
+        chunk = chunk.reindex(columns=PERSON_COLUMNS)
+        ids = pd.to_numeric(chunk['COLLISION_ID'], errors='coerce')
+        chunk, ids = chunk[ids.notna()], ids[ids.notna()].astype(np.int64)
+
+        injury = chunk['PERSON_INJURY'].astype(str).str.lower()
+        sex = chunk['PERSON_SEX'].astype(str).str.upper().str.strip()
+        for value in sex.unique():
+            labels.setdefault(value, len(labels))
+
+        partial = pd.DataFrame({
+            'persons': chunk['UNIQUE_ID'].notna().to_numpy(np.int32),
+            'killed': injury.isin(KILLED_VALUES).to_numpy(np.int32),
+            'injured': injury.isin(INJURED_VALUES).to_numpy(np.int32),
+            'sex': sex.map(labels).to_numpy(np.int32),
+        }, index=ids.to_numpy())
+        partials.append(_combine([partial]))
+        buffered += len(partials[-1])
+        if buffered > COMPACT_ROWS:
+            partials = [_combine(partials)]
+            buffered = len(partials[0])
+
+    persons = _combine(partials) if partials else pd.DataFrame(
+        {'persons': [], 'killed': [], 'injured': [], 'sex': []}, index=pd.Index([], dtype=np.int64), dtype=np.int32)
+    if stage is not None:
+        stage.rows_out = len(persons)
+    return pd.DataFrame({
+        'PERSONS_INVOLVED_COUNT': persons['persons'],
+        'KILLED_COUNT_PERSON': persons['killed'],
+        'INJURED_COUNT_PERSON': persons['injured'],
+        'MOST_COMMON_SEX': pd.Categorical.from_codes(persons['sex'], categories=list(labels)),
+    }, index=persons.index.rename('COLLISION_ID'))
+
+
+# --- Merge ---
+def merge_persons(chunk, persons):
+    """
+    A chunk of cleaned crashes left-joined with the person aggregates on COLLISION_ID,
+    then finished like the notebook: unknown sexes unified, the police report counts
+    raised to the person counts where those are higher and helper columns dropped.
+    """
+    ids = chunk['COLLISION_ID']
+    positions = persons.index.get_indexer(ids.fillna(-1).to_numpy(np.int64))
+    positions[ids.isna().to_numpy()] = -1
+    matched = positions >= 0
+    merged = chunk.reset_index(drop=True)
+
+    for col in ['PERSONS_INVOLVED_COUNT', 'KILLED_COUNT_PERSON', 'INJURED_COUNT_PERSON']:
+        values = np.zeros(len(merged), dtype=np.int64)
+        values[matched] = persons[col].to_numpy()[positions[matched]]
+        merged[col] = values
+
+    sex = persons['MOST_COMMON_SEX']
+    codes = np.where(matched, sex.cat.codes.to_numpy()[positions], -1) if len(sex) else np.full(len(merged), -1)
+    sex = pd.Series(pd.Categorical.from_codes(codes, dtype=sex.dtype)).astype(object)
+    merged['MOST_COMMON_SEX'] = sex.fillna("UNKNOWN").replace(UNKNOWN_SEX, 'UNKNOWN').to_numpy()
+
+    merged['NUMBER OF PERSONS INJURED'] = np.maximum(merged['NUMBER OF PERSONS INJURED'].fillna(0), merged['INJURED_COUNT_PERSON'])
+    merged['NUMBER OF PERSONS KILLED'] = np.maximum(merged['NUMBER OF PERSONS KILLED'].fillna(0), merged['KILLED_COUNT_PERSON'])
+
+    if 'BOROUGH' in merged.columns:
+        merged['BOROUGH'] = merged['BOROUGH'].str.upper().replace("UNKNOWN", np.nan)
+
+    return merged.drop(columns=['CRASH DATE', 'CRASH TIME', 'INJURED_COUNT_PERSON', 'KILLED_COUNT_PERSON'], errors='ignore')
+
+
+# --- Pipeline ---
+def run_etl(crashes_path, persons_path, output, chunk_rows=ETL_CHUNK_ROWS):
+    """
+    Builds the served dataset from the city's Crashes and Person CSVs without loading
+    either: the crashes are profiled in one pass, the persons aggregated per collision
+    in another, and a last pass cleans, de-duplicates and joins the crashes chunk by
+    chunk and writes them to the year partitions of output (see write_partitions()),
+    which the loader serves directly (CRASHES_DATA_SOURCE=output).
+    Returns the rows, seconds, throughput and peak RSS of each pass.
+    """
+    report = {}
+    with _Stage('profile', report) as stage:
+        profile = profile_crashes(crashes_path, chunk_rows)
+        stage.rows_in = stage.rows_out = profile['rows']
+    log.info("Dropping sparse columns %s", profile['sparse'])
+
+    with _Stage('persons', report) as stage:
+        persons = aggregate_persons(persons_path, chunk_rows, stage)
+
+    columns = set(SCHEMA) | set(CRASH_COLUMNS)
+    deduplicate = Deduplicator()
+
+    def merged_chunks(stage):
+        for chunk in _read_chunks(crashes_path, columns, chunk_rows):
+            stage.rows_in += len(chunk)
+            chunk = deduplicate(clean_crashes(chunk, profile))
+            chunk = chunk.dropna(subset=[col for col in ['LATITUDE', 'LONGITUDE'] if col in chunk.columns])
+            chunk = merge_persons(chunk, persons)
+            stage.rows_out += len(chunk)
+            yield chunk
+
+    with _Stage('merge', report) as stage:
+        write_partitions(merged_chunks(stage), output)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the dashboard dataset from the NYC Crashes and Person CSVs")
+    parser.add_argument("--crashes", required=True, help="Motor_Vehicle_Collisions_-_Crashes CSV")
+    parser.add_argument("--persons", required=True, help="Motor_Vehicle_Collisions_-_Person CSV")
+    parser.add_argument("--output", required=True, help="Directory of the year partitions to write")
+    parser.add_argument("--chunk-rows", type=int, default=ETL_CHUNK_ROWS)
+    parser.add_argument("--report", help="Also write the per-pass report to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    report = run_etl(args.crashes, args.persons, args.output, args.chunk_rows)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,173 @@
+import os
+import tempfile
+import zlib
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+from flask import Response, request
+
+from .dataset import get_dataset
+from .metrics import timed_iter
+from .schema import SCHEMA, DERIVED
+
+EXPORT_ROUTE = "/export"
+EXPORT_FILE = "nyc_traffic_crashes"
+
+# Rows rendered per chunk, which bounds the memory an export needs
+EXPORT_CHUNK_ROWS = int(os.environ.get("CRASHES_EXPORT_CHUNK_ROWS", 50000))
+
+# Columns the download's search phrase is matched against
+PHRASE_COLUMNS = ['BOROUGH', 'VEHICLE TYPE CODE 1', 'CONTRIBUTING FACTOR VEHICLE 1', 'MOST_COMMON_SEX', 'CRASH_YEAR']
+
+# Query parameter -> filter ID
+EXPORT_PARAMS = {
+    'borough': 'borough',
+    'factor': 'factor',
+    'demographic': 'demographic',
+    'year': 'year',
+    'vehicle': 'vehicle'
+}
+
+FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'csv.gz': ('application/gzip', '.csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', '.parquet')
+}
+
+
+# --- Selection ---
+def export_url(inputs, search_text=None, fmt='csv'):
+    """
+    Link to the export of the rows selected by inputs and search_text. A multi-valued
+    filter repeats its parameter (a year range is year=first&year=last).
+    """
+    params = {param: inputs.get(key) for param, key in EXPORT_PARAMS.items() if inputs.get(key)}
+    if search_text:
+        params['search'] = search_text
+    params['format'] = fmt
+    return EXPORT_ROUTE + "?" + urlencode(params, doseq=True)
+
+def _param(values):
+    """A filter input from the values of a repeated query parameter."""
+    return values if len(values) > 1 else (values[0] if values else None)
+
+def export_parts(ds, inputs, search_text=None):
+    """
+    (DataFrame, row ids) pairs of the download, one per partition of ds: the dashboard
+    selection (reused from the selection cache) narrowed to rows where the search text
+    appears as a phrase.
+    """
+    for part, rows in ds.parts(inputs, search_text):
+        if search_text and search_text.strip():
+            mask = part.search_index.phrase_match(search_text, PHRASE_COLUMNS, rows=rows)
+            rows = np.flatnonzero(mask) if rows is None else rows[mask]
+        yield part.df, (np.arange(len(part.df)) if rows is None else rows)
+
+def _exported(columns):
+    """The columns a download includes: all but the internal DERIVED date parts."""
+    return [col for col in columns if col not in DERIVED]
+
+def _rows(df, columns, rows):
+    """The exported columns of df at the row ids rows, gathering only those columns."""
+    return df.iloc[rows, [df.columns.get_loc(col) for col in columns]]
+
+def _chunks(rows, size=EXPORT_CHUNK_ROWS):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+# --- Writers ---
+def iter_csv(parts, columns=()):
+    """CSV text of the (DataFrame, row ids) parts, one chunk at a time. Empty exports get the header of columns."""
+    header = True
+    for df, rows in parts:
+        columns = _exported(df.columns)
+        for chunk in _chunks(rows):
+            yield _rows(df, columns, chunk).to_csv(index=False, header=header)
+            header = False
+    if header:
+        yield pd.DataFrame(columns=_exported(columns)).to_csv(index=False)
+
+def iter_gzip(parts):
+    """Gzip stream of the text parts."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for part in parts:
+        data = compressor.compress(part.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def _arrow_type(col):
+    """Arrow type of a schema column, the same whatever dtype one partition narrowed it to."""
+    import pyarrow as pa
+
+    kind = SCHEMA.get(col)
+    if kind in ('count', 'year'):
+        return pa.int64()
+    if kind == 'float32':
+        return pa.float32()
+    if kind == 'datetime':
+        return pa.timestamp('ns')
+    return pa.string()
+
+def iter_parquet(parts, columns=(), block_size=1 << 20):
+    """
+    Parquet file of the (DataFrame, row ids) parts, one row group per chunk. Parquet
+    needs its footer written last, so the file is spooled to disk and then streamed
+    from there. Empty exports get the schema of columns.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    with tempfile.TemporaryFile() as f:
+        writer = None
+        for df, rows in parts:
+            exported = _exported(df.columns)
+            if writer is None:
+                schema = pa.schema([(col, _arrow_type(col)) for col in exported])
+                writer = pq.ParquetWriter(f, schema)
+            for chunk in _chunks(rows):
+                writer.write_table(pa.Table.from_pandas(_rows(df, exported, chunk), schema=schema, preserve_index=False))
+        if writer is None:
+            writer = pq.ParquetWriter(f, pa.schema([(col, _arrow_type(col)) for col in _exported(columns)]))
+        writer.close()
+        f.seek(0)
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
+
+
+# --- Route ---
+def register_export(server):
+    """Adds the streaming export endpoint to the Flask server."""
+
+    @server.route(EXPORT_ROUTE)
+    def export():
+        fmt = request.args.get('format', 'csv')
+        if fmt not in FORMATS:
+            return Response("Unknown format: " + fmt, status=400)
+
+        inputs = {key: _param(request.args.getlist(param)) for param, key in EXPORT_PARAMS.items()}
+        search_text = request.args.get('search')
+
+        # One dataset for the whole export, even if a reload swaps it meanwhile
+        ds = get_dataset()
+        parts = export_parts(ds, inputs, search_text)
+
+        if fmt == 'parquet':
+            body = iter_parquet(parts, ds.columns)
+        elif fmt == 'csv.gz':
+            body = iter_gzip(iter_csv(parts, ds.columns))
+        else:
+            body = iter_csv(parts, ds.columns)
+
+        body = timed_iter('export.' + fmt, body)
+
+        mimetype, extension = FORMATS[fmt]
+        headers = {'Content-Disposition': 'attachment; filename="' + EXPORT_FILE + extension + '"'}
+        return Response(body, mimetype=mimetype, headers=headers)
+
+    return export
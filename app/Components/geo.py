@@ -0,0 +1,237 @@
+import numpy as np
+import pandas as pd
+
+from .cube import INJURY_COL
+
+# Fixed grid over the NYC bounding box, so cells mean the same thing for any dataset.
+# Locations outside the box (e.g. 0,0 placeholders) are left off the map.
+GRID_ORIGIN = (40.45, -74.30)   # south-west corner (lat, lon)
+GRID_EXTENT = (0.50, 0.60)      # degrees of latitude / longitude covered
+GRID_CELL = 0.005               # finest cell size in degrees
+
+# Zoom levels as multiples of the finest cell, finest first
+GRID_LEVELS = [1, 2, 4, 8]
+
+# The map uses the finest level with at most this many non-empty cells
+MAX_CELLS = 3000
+
+# Representative crash locations drawn on top of the density
+SAMPLE_POINTS = 500
+
+GRID_ROWS = int(np.ceil(GRID_EXTENT[0] / GRID_CELL))
+GRID_COLS = int(np.ceil(GRID_EXTENT[1] / GRID_CELL))
+
+MAP_CELL_COLS = ['LATITUDE', 'LONGITUDE', 'crashes', 'injuries']
+MAP_POINT_COLS = ['LATITUDE', 'LONGITUDE', INJURY_COL]
+
+
+# --- Grid helpers ---
+def grid_position(lat, lon):
+    """Finest-level (row, col) cell of each location as int16 arrays, -1 outside the grid."""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    with np.errstate(invalid='ignore'):
+        r = np.floor((lat - GRID_ORIGIN[0]) / GRID_CELL)
+        c = np.floor((lon - GRID_ORIGIN[1]) / GRID_CELL)
+        inside = (r >= 0) & (r < GRID_ROWS) & (c >= 0) & (c < GRID_COLS)
+    r = np.where(inside, r, -1).astype(np.int16)
+    c = np.where(inside, c, -1).astype(np.int16)
+    return r, c
+
+def _cell_ids(r, c, level):
+    """Cell id of each (row, col) at a zoom level."""
+    cols = -(-GRID_COLS // level)
+    return (r // level).astype(np.int64) * cols + c // level
+
+def _priority(row_ids, salt=0):
+    """
+    Deterministic pseudo-random priority of each row id (Knuth multiplicative hash).
+    Indexes over different row sets (e.g. year partitions) pass different salts.
+    """
+    keys = row_ids.astype(np.uint64) + np.uint64(salt) * np.uint64(0x9E3779B9)
+    return (keys * np.uint64(2654435761)) % np.uint64(1 << 32)
+
+def _geo_columns(df):
+    """(lat, lon, injuries) arrays of df, NaN locations and no injuries where columns are absent."""
+    if 'LATITUDE' in df.columns and 'LONGITUDE' in df.columns:
+        lat = df['LATITUDE'].to_numpy(dtype=float)
+        lon = df['LONGITUDE'].to_numpy(dtype=float)
+    else:
+        lat = lon = np.full(len(df), np.nan)
+    if INJURY_COL in df.columns:
+        injuries = pd.to_numeric(df[INJURY_COL], errors='coerce').fillna(0).to_numpy(dtype=np.float32)
+    else:
+        injuries = np.zeros(len(df), dtype=np.float32)
+    return lat, lon, injuries
+
+def empty_cells():
+    cells = pd.DataFrame(columns=MAP_CELL_COLS)
+    cells.attrs['cell_size'] = GRID_CELL
+    return cells
+
+
+# --- Aggregation ---
+def grid_counts(r, c, injuries):
+    """Crash counts and injury sums per finest-level cell, as two dense GRID_ROWS x GRID_COLS arrays."""
+    located = r >= 0
+    ids = r[located].astype(np.int64) * GRID_COLS + c[located]
+    size = GRID_ROWS * GRID_COLS
+    crashes = np.bincount(ids, minlength=size).reshape(GRID_ROWS, GRID_COLS).astype(float)
+    weights = np.bincount(ids, weights=injuries[located], minlength=size).reshape(GRID_ROWS, GRID_COLS)
+    return crashes, weights
+
+def _coarsen(counts, level):
+    """Dense finest-level counts summed into the cells of a zoom level."""
+    rows, cols = -(-GRID_ROWS // level), -(-GRID_COLS // level)
+    padded = np.zeros((rows * level, cols * level))
+    padded[:GRID_ROWS, :GRID_COLS] = counts
+    return padded.reshape(rows, level, cols, level).sum(axis=(1, 3))
+
+def cells_from_counts(crashes, injuries):
+    """
+    The map cells of dense finest-level counts, at the finest zoom level with no more
+    than MAX_CELLS non-empty cells. Returns one row per non-empty cell, located at the
+    cell centre; attrs['cell_size'] holds the cell size in degrees.
+    """
+    if not crashes.any():
+        return empty_cells()
+
+    for level in GRID_LEVELS:
+        level_crashes = _coarsen(crashes, level)
+        occupied = np.flatnonzero(level_crashes)
+        if len(occupied) <= MAX_CELLS or level == GRID_LEVELS[-1]:
+            break
+
+    size = GRID_CELL * level
+    cols = level_crashes.shape[1]
+    cells = pd.DataFrame({
+        'LATITUDE': GRID_ORIGIN[0] + (occupied // cols + 0.5) * size,
+        'LONGITUDE': GRID_ORIGIN[1] + (occupied % cols + 0.5) * size,
+        'crashes': level_crashes.ravel()[occupied],
+        'injuries': _coarsen(injuries, level).ravel()[occupied],
+    })
+    cells.attrs['cell_size'] = size
+    return cells
+
+def cell_density(r, c, injuries):
+    """Map cells of the located rows, see cells_from_counts()."""
+    return cells_from_counts(*grid_counts(r, c, injuries))
+
+def stratified_sample(r, c, priority, limit=SAMPLE_POINTS, level=GRID_LEVELS[-1]):
+    """
+    Positions (into r/c/priority) of up to `limit` located rows, spread across the cells
+    of a coarse zoom level: every occupied cell contributes its rows with the lowest
+    pseudo-random priority, so the sample doesn't depend on file order.
+    """
+    positions = np.flatnonzero(r >= 0)
+    if len(positions) <= limit:
+        return positions
+
+    priority = priority[positions]
+    # Large selections only need candidates with a low priority
+    oversample = limit * 50
+    if len(positions) > oversample:
+        keep = priority < np.uint64((1 << 32) * oversample // len(positions))
+        positions, priority = positions[keep], priority[keep]
+
+    ids = _cell_ids(r[positions], c[positions], level)
+    order = np.lexsort((priority, ids))
+    ids = ids[order]
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    rank = np.arange(len(ids)) - np.repeat(starts, np.diff(np.r_[starts, len(ids)]))
+
+    per_cell = max(1, limit // len(starts))
+    picked = order[rank < per_cell]
+    if len(picked) > limit:
+        picked = picked[np.argsort(priority[picked], kind='stable')[:limit]]
+    return np.sort(positions[picked])
+
+
+# --- Geo Index ---
+class GeoIndex:
+    """
+    Grid cell of every row, computed once at load time.
+
+    The map is drawn from injury sums per cell at the finest zoom level that keeps
+    the cell count bounded, plus a small stratified sample of crash locations, so
+    the figure has the same size whatever the filter selects.
+    """
+
+    def __init__(self, df, salt=0):
+        self.n_rows = len(df)
+        self.salt = salt
+        self.lat, self.lon, self.injuries = _geo_columns(df)
+        self.r, self.c = grid_position(self.lat, self.lon)
+
+        # The unfiltered map is the most common request
+        self._everything = self._parts(None)
+
+    def extend(self, delta):
+        """A new GeoIndex with the rows of delta appended; only the delta is placed on the grid."""
+        lat, lon, injuries = _geo_columns(delta)
+        r, c = grid_position(lat, lon)
+
+        index = GeoIndex.__new__(GeoIndex)
+        index.n_rows = self.n_rows + len(delta)
+        index.salt = self.salt
+        index.lat = np.concatenate([self.lat, lat])
+        index.lon = np.concatenate([self.lon, lon])
+        index.injuries = np.concatenate([self.injuries, injuries])
+        index.r = np.concatenate([self.r, r])
+        index.c = np.concatenate([self.c, c])
+        index._everything = index._parts(None)
+        return index
+
+    def parts(self, rows=None):
+        """
+        Mergeable map aggregates of rows (all rows when None): dense per-cell counts and
+        a stratified sample carrying each point's priority. See merge_map().
+        """
+        return self._everything if rows is None else self._parts(rows)
+
+    def _parts(self, rows):
+        row_ids = np.arange(self.n_rows) if rows is None else np.asarray(rows)
+        r, c = self.r[row_ids], self.c[row_ids]
+        priority = _priority(row_ids, self.salt)
+        crashes, injuries = grid_counts(r, c, self.injuries[row_ids])
+        sample = stratified_sample(r, c, priority)
+        points = row_ids[sample]
+        return {
+            'crashes': crashes,
+            'injuries': injuries,
+            'sample': pd.DataFrame({
+                'LATITUDE': self.lat[points],
+                'LONGITUDE': self.lon[points],
+                INJURY_COL: self.injuries[points].astype(float),
+                'priority': priority[sample],
+            }),
+        }
+
+    def summary(self, rows=None):
+        """The 'map_cells' and 'map_points' summary entries for rows (all rows when None)."""
+        return merge_map([self.parts(rows)])
+
+
+def merge_map(parts):
+    """
+    The 'map_cells' and 'map_points' summary entries of the union of disjoint row sets,
+    from their GeoIndex.parts(): counts are added and the samples re-stratified.
+    """
+    if not parts:
+        return {'map_cells': empty_cells(), 'map_points': pd.DataFrame(columns=MAP_POINT_COLS)}
+
+    crashes = sum(part['crashes'] for part in parts)
+    injuries = sum(part['injuries'] for part in parts)
+    sample = pd.concat([part['sample'] for part in parts], ignore_index=True) if len(parts) > 1 else parts[0]['sample']
+    if len(parts) > 1:
+        r, c = grid_position(sample['LATITUDE'], sample['LONGITUDE'])
+        sample = sample.iloc[stratified_sample(r, c, sample['priority'].to_numpy())]
+
+    return {
+        'map_cells': cells_from_counts(crashes, injuries),
+        'map_points': sample[MAP_POINT_COLS].reset_index(drop=True),
+    }
+
+def map_summary(df):
+    """Map summary entries of a DataFrame without a load-time index."""
+    return GeoIndex(df).summary()
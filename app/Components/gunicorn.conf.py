@@ -1,9 +1,15 @@
 # gunicorn.conf.py
 import multiprocessing
+import os
 
 # Critical memory settings
-workers = 1  # Only 1 worker for 512MB
-worker_class = "sync"
+# The dataset is served from memory-mapped column files (see shared_store.py),
+# so extra workers share its pages instead of each holding a private copy.
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count(), 4)))
+# Threaded workers: a slow request (an export, a job poll) holds one thread, not the worker.
+# Heavy dashboard updates run on a separate job pool, see jobs.py
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
 worker_connections = 1000
 
 # Memory management
@@ -0,0 +1,547 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from .DataLoader import CLUSTER_KEY, FILTER_MAP, MULTI_FILTER_MAP, filter_values
+from .schema import DERIVED
+
+
+# --- Helpers ---
+def label_key(value):
+    """Normalizes a column value or a filter input to the string used as index key."""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+def _code_dtype(n_values):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_values < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def encode_column(series):
+    """
+    Dictionary-encodes a column.
+    Returns (codes, labels) where codes is a narrow int array (-1 for missing values)
+    and labels maps label_key(value) -> code.
+    """
+    codes, uniques = pd.factorize(series, sort=True)
+    labels = {label_key(u): i for i, u in enumerate(uniques)}
+    return codes.astype(_code_dtype(len(uniques))), labels
+
+def extend_encoding(labels, series):
+    """
+    Codes of series against an existing labels dict, giving unseen values the next codes.
+    Returns (codes, labels) with a new labels dict; the one passed in is left unchanged.
+    """
+    local, uniques = pd.factorize(series, sort=True)
+    labels = dict(labels)
+    # Extra trailing slot so missing values (code -1) stay -1
+    mapping = np.full(len(uniques) + 1, -1, dtype=np.int64)
+    for i, value in enumerate(uniques):
+        mapping[i] = labels.setdefault(label_key(value), len(labels))
+    return mapping[local], labels
+
+def encode_slots(slots, labels=None):
+    """
+    Dictionary-encodes the slot columns of a multi-valued dimension (e.g. the five
+    contributing factor columns, None for an absent one) over one shared dictionary.
+    Returns (codes, labels) where codes has one column per slot, with -1 for missing
+    values and for values already found in an earlier slot of the same row, and labels
+    maps label_key(value) -> code. Values not in labels get the next codes in sorted
+    order; the dict passed in is left unchanged.
+    """
+    n_rows = next((len(series) for series in slots if series is not None), 0)
+    encoded = []
+    for series in slots:
+        if series is None:
+            encoded.append((np.full(n_rows, -1), []))
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            # The categorical dictionary, so no value is hashed per row
+            encoded.append((series.cat.codes.to_numpy(), [label_key(u) for u in series.cat.categories]))
+        else:
+            local, uniques = pd.factorize(series, sort=True)
+            encoded.append((local, [label_key(u) for u in uniques]))
+
+    labels = dict(labels or {})
+    for key in sorted({key for _, keys in encoded for key in keys} - set(labels)):
+        labels[key] = len(labels)
+
+    codes = np.full((n_rows, len(slots)), -1, dtype=_code_dtype(len(labels)))
+    for j, (local, keys) in enumerate(encoded):
+        # Extra trailing slot so missing values (code -1) stay -1
+        column = np.array([labels[key] for key in keys] + [-1])[local]
+        for k in range(j):
+            column[column == codes[:, k]] = -1
+        codes[:, j] = column
+    return codes, labels
+
+def _pack(codes):
+    """
+    CSR form of encode_slots() codes: (indptr, values) with the distinct codes of row i
+    in values[indptr[i]:indptr[i + 1]]. A row without any value holds a single -1.
+    """
+    keep = codes >= 0
+    keep[~keep.any(axis=1), 0] = True
+    indptr = np.concatenate([[0], np.cumsum(keep.sum(axis=1))])
+    return indptr.astype(_code_dtype(indptr[-1] + 1)), codes[keep]
+
+def _entries(indptr, rows):
+    """Positions in a CSR column's values of the entries of rows, and the index in rows each belongs to."""
+    starts = indptr[rows].astype(np.int64)
+    lengths = indptr[np.asarray(rows) + 1] - starts
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    return np.arange(len(owner)) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths), owner
+
+def _insert_postings(column, slots, rows, n_slots):
+    """
+    (order, offsets) of a column's postings with new entries added: the row ids rows,
+    in slot slots (code + 1) each, go to the end of their slot's slice, without re-sorting.
+    """
+    old_offsets = np.concatenate([column['offsets'], np.repeat(column['offsets'][-1], n_slots + 1 - len(column['offsets']))])
+    delta_order = np.argsort(slots, kind='stable')
+    order = np.insert(column['order'], old_offsets[slots[delta_order] + 1], rows[delta_order].astype(np.int32))
+    offsets = old_offsets + np.concatenate([[0], np.cumsum(np.bincount(slots, minlength=n_slots))])
+    return order, offsets
+
+
+# Zone maps with more row ranges than this are dropped: the rows aren't clustered
+MAX_ZONES = 4096
+
+
+# --- Zone Map ---
+class ZoneMap:
+    """
+    Row ranges of the runs of equal values of the leading clustering key columns
+    (CLUSTER_KEY, e.g. year then borough) in a dataset sorted on them.
+
+    Each run is (start, stop, one code per key column). An equality filter on any of
+    these columns selects whole runs, so it resolves to a few contiguous row ranges
+    found in the small run table, without touching the rows. Only the first n_rows
+    rows are covered; rows appended later are left to the FilterIndex permutations.
+    """
+
+    def __init__(self, keys, codes, n_rows):
+        self.keys = keys
+        self.n_rows = n_rows
+
+        change = np.zeros(max(n_rows - 1, 0), dtype=bool)
+        for key in keys:
+            change |= codes[key][1:] != codes[key][:-1]
+        self.starts = np.concatenate([[0], np.flatnonzero(change) + 1]) if n_rows else np.empty(0, dtype=np.int64)
+        self.stops = np.append(self.starts[1:], n_rows)
+        self.codes = {key: codes[key][self.starts] for key in keys}
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def build(cls, columns, filter_map, n_rows, cluster_key=CLUSTER_KEY):
+        """
+        ZoneMap over the leading cluster key columns that are filter columns, given the
+        FilterIndex columns; None when there are none or the rows aren't clustered on them.
+        """
+        by_column = {filter_map[key]: key for key in columns if key in filter_map}
+        keys = []
+        for col in cluster_key:
+            if col not in by_column:
+                break
+            keys.append(by_column[col])
+        if not keys:
+            return None
+        zones = cls(keys, {key: columns[key]['codes'] for key in keys}, n_rows)
+        return zones if len(zones) <= MAX_ZONES else None
+
+    def ranges(self, codes):
+        """Merged (start, stop) row ranges of the runs matching, for some key columns, one of their codes."""
+        match = np.ones(len(self), dtype=bool)
+        for key, key_codes in codes.items():
+            match &= np.isin(self.codes[key], key_codes)
+        starts, stops = self.starts[match], self.stops[match]
+        # Adjacent matching runs form one range
+        joined = np.flatnonzero(stops[:-1] != starts[1:])
+        return list(zip(starts[np.concatenate([[0], joined + 1])], stops[np.append(joined, len(stops) - 1)])) if len(starts) else []
+
+
+# --- Filter Index ---
+class FilterIndex:
+    """
+    Row-id index over the filter columns, built once at load time.
+
+    For every column in FILTER_MAP it keeps the dictionary codes and one permutation
+    of the row ids grouped by code, so the rows holding a value are a contiguous,
+    sorted slice of that permutation; a multi-valued filter (a year range, several
+    boroughs) is the union of its values' slices. A filter combination is resolved by
+    starting from the shortest row-id list and checking the other filters on those rows only.
+
+    The slot columns of a MULTI_FILTER_MAP filter (e.g. the five vehicle types) share
+    one dictionary, and each row's distinct codes are packed in CSR form (indptr,
+    values); the permutation then lists a row under every value it holds, so "any
+    vehicle is a taxi" is one slice too.
+    When the rows are clustered (see DataLoader.cluster_rows), filters on the leading
+    key columns are resolved from a ZoneMap as contiguous row ranges instead.
+    """
+
+    def __init__(self, df, filter_map=FILTER_MAP, multi_map=MULTI_FILTER_MAP):
+        self.n_rows = len(df)
+        self.filter_map = filter_map
+        self.multi_map = multi_map
+        self.columns = {}
+
+        for key, col in filter_map.items():
+            if col not in df.columns:
+                continue
+
+            codes, labels = encode_column(df[col])
+
+            # Stable sort keeps row ids ascending inside each code
+            order = np.argsort(codes, kind='stable').astype(np.int32)
+            counts = np.bincount(codes.astype(np.int64) + 1, minlength=len(labels) + 1)
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+
+            self.columns[key] = {'codes': codes, 'labels': labels, 'order': order, 'offsets': offsets}
+
+        for key, cols in multi_map.items():
+            if not any(col in df.columns for col in cols):
+                continue
+
+            codes, labels = encode_slots([df[col] if col in df.columns else None for col in cols])
+            indptr, values = _pack(codes)
+
+            # Row ids of the entries, grouped by code and ascending inside each code
+            rows = np.repeat(np.arange(self.n_rows, dtype=np.int32), np.diff(indptr))
+            order = rows[np.argsort(values, kind='stable')]
+            counts = np.bincount(values.astype(np.int64) + 1, minlength=len(labels) + 1)
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+
+            self.columns[key] = {'indptr': indptr, 'values': values, 'labels': labels, 'order': order, 'offsets': offsets}
+
+        self.zones = ZoneMap.build(self.columns, filter_map, self.n_rows)
+
+    def extend(self, delta):
+        """
+        A new FilterIndex over this index's rows followed by the rows of delta.
+        Existing codes are kept and only the delta is encoded; its row ids are merged
+        into each permutation at the end of their value's slice, without re-sorting.
+        """
+        index = FilterIndex.__new__(FilterIndex)
+        index.n_rows = self.n_rows + len(delta)
+        index.filter_map = self.filter_map
+        index.multi_map = self.multi_map
+        index.columns = {}
+        # The zones keep covering the rows they were built on, the delta rows are looked up
+        index.zones = self.zones
+
+        for key, column in self.columns.items():
+            if key in self.multi_map:
+                codes, labels = encode_slots([delta[col] if col in delta.columns else None for col in self.multi_map[key]], column['labels'])
+                indptr, values = _pack(codes)
+                rows = np.repeat(np.arange(len(delta)), np.diff(indptr)) + self.n_rows
+                order, offsets = _insert_postings(column, values.astype(np.int64) + 1, rows, len(labels) + 1)
+                indptr = np.concatenate([column['indptr'], indptr[1:].astype(np.int64) + column['indptr'][-1]])
+                index.columns[key] = {
+                    'indptr': indptr.astype(_code_dtype(indptr[-1] + 1)),
+                    'values': np.concatenate([column['values'], values]).astype(_code_dtype(len(labels))),
+                    'labels': labels, 'order': order, 'offsets': offsets
+                }
+                continue
+
+            col = self.filter_map[key]
+            if col in delta.columns:
+                codes, labels = extend_encoding(column['labels'], delta[col])
+            else:
+                codes, labels = np.full(len(delta), -1), column['labels']
+
+            # Slot 0 holds missing values, slot code + 1 holds code
+            order, offsets = _insert_postings(column, codes + 1, np.arange(len(delta)) + self.n_rows, len(labels) + 1)
+
+            index.columns[key] = {
+                'codes': np.concatenate([column['codes'], codes]).astype(_code_dtype(len(labels))),
+                'labels': labels, 'order': order, 'offsets': offsets
+            }
+
+        return index
+
+    def rows_for(self, key, value):
+        """Sorted row ids where the column for filter key equals value."""
+        column = self.columns[key]
+        code = column['labels'].get(label_key(value))
+        if code is None:
+            return np.empty(0, dtype=np.int32)
+        return column['order'][column['offsets'][code + 1]:column['offsets'][code + 2]]
+
+    def _codes(self, key, values):
+        """Codes of the values that occur in the column for filter key."""
+        labels = self.columns[key]['labels']
+        return [code for code in (labels.get(label_key(value)) for value in values) if code is not None]
+
+    def rows_for_values(self, key, values):
+        """Sorted row ids where the column for filter key equals one of values."""
+        parts = [self.rows_for(key, value) for value in values]
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        if key not in self.multi_map:
+            return np.sort(np.concatenate(parts))
+        # A row holding several of the values is listed under each; large unions are a row mask
+        if sum(len(part) for part in parts) * 8 < self.n_rows:
+            return np.unique(np.concatenate(parts))
+        mask = np.zeros(self.n_rows, dtype=bool)
+        for part in parts:
+            mask[part] = True
+        return np.flatnonzero(mask).astype(np.int32)
+
+    def facet_counts(self, key, inputs):
+        """Row counts per value of the filter key under the other filters in inputs."""
+        column = self.columns[key]
+        rows = self.select({k: v for k, v in inputs.items() if k != key})
+        if rows is None:
+            counts = np.diff(column['offsets'])
+        elif key in self.multi_map:
+            entries, _ = _entries(column['indptr'], rows)
+            counts = np.bincount(column['values'][entries].astype(np.int64) + 1, minlength=len(column['labels']) + 1)
+        else:
+            counts = np.bincount(column['codes'][rows].astype(np.int64) + 1, minlength=len(column['labels']) + 1)
+        # Slot 0 counts rows without a value
+        return pd.Series(counts[1:], index=list(column['labels']))
+
+    def _predicates(self, inputs):
+        predicates = []
+        for key in self.columns:
+            values = filter_values(key, inputs.get(key))
+            if values is not None:
+                predicates.append((key, values))
+        return predicates
+
+    def select(self, inputs):
+        """
+        Returns the sorted row ids matching all filters in inputs,
+        or None when no filter applies (every row is selected).
+        """
+        predicates = self._predicates(inputs)
+        if not predicates:
+            return None
+
+        # A single filter is already a contiguous slice of its permutation when the rows
+        # are clustered; the zones pay off when they answer several filters at once
+        zoned = [(key, values) for key, values in predicates if self.zones is not None and key in self.zones.keys]
+        if len(zoned) > 1 or any(len(values) > 1 for _, values in zoned):
+            rows = self._zone_rows(zoned)
+            remaining = [(key, values) for key, values in predicates if (key, values) not in zoned]
+        else:
+            # Start from the most selective filter
+            candidates = sorted(((self.rows_for_values(key, values), key, values) for key, values in predicates), key=lambda c: len(c[0]))
+            rows = candidates[0][0]
+            remaining = [(key, values) for _, key, values in candidates[1:]]
+
+        for key, values in remaining:
+            if len(rows) == 0:
+                break
+            rows = rows[self._matches(key, values, rows)]
+
+        return rows
+
+    def _matches(self, key, values, rows):
+        column = self.columns[key]
+        codes = self._codes(key, values)
+        if key not in self.multi_map and len(codes) == 1:
+            return column['codes'][rows] == codes[0]
+        # Extra trailing slot so missing values (code -1) look up False
+        table = np.zeros(len(column['labels']) + 1, dtype=bool)
+        table[codes] = True
+        if key not in self.multi_map:
+            return table[column['codes'][rows]]
+        # A row matches when any of its entries does
+        entries, owner = _entries(column['indptr'], rows)
+        matches = np.zeros(len(rows), dtype=bool)
+        matches[owner[table[column['values'][entries]]]] = True
+        return matches
+
+    def _zone_rows(self, predicates):
+        """Sorted row ids matching filters on zone map columns: the zone ranges, then matching appended rows."""
+        codes = {key: self._codes(key, values) for key, values in predicates}
+        if any(not key_codes for key_codes in codes.values()):
+            return np.empty(0, dtype=np.int32)
+        parts = [np.arange(start, stop, dtype=np.int32) for start, stop in self.zones.ranges(codes)]
+
+        if self.n_rows > self.zones.n_rows:
+            key, values = predicates[0]
+            tail = self.rows_for_values(key, values)
+            tail = tail[np.searchsorted(tail, self.zones.n_rows):]
+            for key, values in predicates[1:]:
+                tail = tail[self._matches(key, values, tail)]
+            parts.append(tail)
+
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+
+
+# --- Search Index ---
+SEARCH_COLUMNS = [
+    'BOROUGH',
+    'VEHICLE TYPE CODE 1',
+    'CONTRIBUTING FACTOR VEHICLE 1',
+    'MOST_COMMON_SEX',
+    'VEHICLE TYPE CODE 2',
+    'CONTRIBUTING FACTOR VEHICLE 2',
+    'VEHICLE TYPE CODE 3',
+    'CONTRIBUTING FACTOR VEHICLE 3',
+    'VEHICLE TYPE CODE 4',
+    'CONTRIBUTING FACTOR VEHICLE 4',
+    'VEHICLE TYPE CODE 5',
+    'CONTRIBUTING FACTOR VEHICLE 5'
+]
+
+def _tokens(text):
+    """Whole words plus their alphanumeric pieces, e.g. 'right-of-way' -> right-of-way, right, of, way."""
+    words = text.split()
+    pieces = re.findall(r"[a-z0-9]+", text)
+    return set(words) | set(pieces)
+
+def _add_postings(postings, position, code, text):
+    """Records every prefix of every token of text as found at code of column position."""
+    for token in _tokens(text):
+        for end in range(1, len(token) + 1):
+            postings.setdefault(token[:end], {}).setdefault(position, []).append(code)
+
+def _search_vocabulary(df):
+    """
+    Yields (name, codes, texts) for every searchable column: dictionary codes per row
+    and the lowercased text of each code. Datetime columns are split into a date part
+    and a time-of-day part so their dictionaries stay small.
+    """
+    columns = [col for col in SEARCH_COLUMNS if col in df.columns]
+    # Include year/date/time columns if they exist (not the internal DERIVED date parts)
+    columns += [col for col in df.columns if col not in columns and col not in DERIVED
+                and any(term in col.upper() for term in ['YEAR', 'DATE', 'TIME'])]
+
+    for col in columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series.dtype):
+            days = series.dt.normalize()
+            codes, uniques = pd.factorize(days, sort=True)
+            yield col + ' (date)', codes, [d.strftime('%Y-%m-%d') for d in uniques]
+
+            seconds = (series - days).dt.total_seconds()
+            codes, uniques = pd.factorize(seconds, sort=True)
+            yield col + ' (time)', codes, ['{:02d}:{:02d}:{:02d}'.format(int(s) // 3600, int(s) % 3600 // 60, int(s) % 60) for s in uniques]
+        else:
+            codes, uniques = pd.factorize(series, sort=True)
+            yield col, codes, [label_key(u).lower().strip() for u in uniques]
+
+class SearchIndex:
+    """
+    Token index for the free-text search, built once at load time.
+
+    Every prefix of every token found in the searchable columns' dictionaries maps to
+    the (column, code) pairs containing it. A query term is answered by looking up the
+    matching codes and testing the rows' dictionary codes against them, so the raw
+    string columns are never converted or scanned per request.
+    """
+
+    def __init__(self, df):
+        self.n_rows = len(df)
+        self.columns = []
+        postings = {}
+
+        for position, (name, codes, texts) in enumerate(_search_vocabulary(df)):
+            self.columns.append({'name': name, 'codes': codes.astype(_code_dtype(len(texts))), 'texts': texts, 'size': len(texts)})
+
+            for code, text in enumerate(texts):
+                _add_postings(postings, position, code, text)
+
+        # Codes are recorded in ascending order, so dropping repeats keeps them sorted
+        self.prefixes = {
+            prefix: {position: np.array(list(dict.fromkeys(codes))) for position, codes in matches.items()}
+            for prefix, matches in postings.items()
+        }
+
+    def extend(self, delta):
+        """
+        A new SearchIndex over this index's rows followed by the rows of delta.
+        Only the delta's values are looked up; texts not seen before get new codes
+        and their prefixes are added, sharing every unchanged posting with this index.
+        """
+        index = SearchIndex.__new__(SearchIndex)
+        index.n_rows = self.n_rows + len(delta)
+        index.columns = []
+        index.prefixes = dict(self.prefixes)
+        vocabulary = {name: (codes, texts) for name, codes, texts in _search_vocabulary(delta)}
+        postings = {}
+
+        for position, column in enumerate(self.columns):
+            codes, texts = vocabulary.get(column['name'], (np.full(len(delta), -1), []))
+            known = {text: code for code, text in enumerate(column['texts'])}
+            all_texts = list(column['texts'])
+
+            # Extra trailing slot so missing values (code -1) stay -1
+            mapping = np.full(len(texts) + 1, -1, dtype=np.int64)
+            for i, text in enumerate(texts):
+                if text not in known:
+                    known[text] = len(all_texts)
+                    all_texts.append(text)
+                    _add_postings(postings, position, known[text], text)
+                mapping[i] = known[text]
+
+            row_codes = np.concatenate([column['codes'], mapping[codes]])
+            index.columns.append({'name': column['name'], 'codes': row_codes.astype(_code_dtype(len(all_texts))),
+                                  'texts': all_texts, 'size': len(all_texts)})
+
+        for prefix, matches in postings.items():
+            merged = dict(index.prefixes.get(prefix, {}))
+            for position, codes in matches.items():
+                merged[position] = np.union1d(merged.get(position, np.empty(0, dtype=np.int64)), codes)
+            index.prefixes[prefix] = merged
+
+        return index
+
+    def _term_mask(self, term, rows):
+        mask = np.zeros(self.n_rows if rows is None else len(rows), dtype=bool)
+        for position, codes in self.prefixes.get(term, {}).items():
+            column = self.columns[position]
+            # Extra trailing slot so missing values (code -1) look up False
+            table = np.zeros(column['size'] + 1, dtype=bool)
+            table[codes] = True
+            row_codes = column['codes'] if rows is None else column['codes'][rows]
+            mask |= table[row_codes]
+        return mask
+
+    def match(self, search_text, logic="AND", rows=None):
+        """
+        Boolean mask over rows (all rows when None) of the records matching search_text.
+        Each whitespace separated term must be a prefix of a word in one of the searchable
+        columns; terms are combined with AND or OR logic.
+        """
+        size = self.n_rows if rows is None else len(rows)
+        search_terms = search_text.lower().strip().split()
+
+        if logic.upper() == "AND":
+            final_mask = np.ones(size, dtype=bool)
+            for term in search_terms:
+                final_mask &= self._term_mask(term, rows)
+        else:
+            final_mask = np.zeros(size, dtype=bool)
+            for term in search_terms:
+                final_mask |= self._term_mask(term, rows)
+
+        return final_mask
+
+    def phrase_match(self, phrase, columns, rows=None):
+        """
+        Boolean mask over rows (all rows when None) of the records where one of the
+        given columns contains phrase as a plain substring. The substring test runs
+        over each column's dictionary, then the rows' codes are looked up.
+        """
+        phrase = phrase.lower()
+        mask = np.zeros(self.n_rows if rows is None else len(rows), dtype=bool)
+        for column in self.columns:
+            if column['name'] not in columns:
+                continue
+            # Extra trailing slot so missing values (code -1) look up False
+            table = np.array([phrase in text for text in column['texts']] + [False])
+            row_codes = column['codes'] if rows is None else column['codes'][rows]
+            mask |= table[row_codes]
+        return mask
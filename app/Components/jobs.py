@@ -0,0 +1,152 @@
+import itertools
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Threads computing heavy callbacks in the background, per worker process
+JOB_WORKERS = int(os.environ.get("CRASHES_JOB_WORKERS", 2))
+
+# Seconds a request waits for its job before answering with progress instead,
+# so quick jobs still finish in one round trip
+JOB_WAIT_SECONDS = float(os.environ.get("CRASHES_JOB_WAIT", 0.25))
+
+# Milliseconds between two polls of a running job by the browser
+JOB_POLL_MS = int(os.environ.get("CRASHES_JOB_POLL_MS", 300))
+
+# Sessions whose latest job is remembered
+JOB_SESSIONS = 256
+
+log = logging.getLogger(__name__)
+
+_ids = itertools.count(1)
+_local = threading.local()
+
+
+class JobCancelled(Exception):
+    """Raised inside a job at a checkpoint once a newer job of its session replaced it."""
+
+
+# --- Job ---
+class Job:
+    """
+    One background computation: its state ('queued', 'running', 'done', 'failed' or
+    'cancelled'), progress and result.
+    """
+
+    def __init__(self, key):
+        self.id = next(_ids)
+        self.key = key
+        self.state = 'queued'
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def finished(self):
+        return self.state in ('done', 'failed', 'cancelled')
+
+    def progress(self):
+        """Fraction of the job done, 0 until it reports steps."""
+        if self.state == 'done':
+            return 1.0
+        return self.done / self.total if self.total else 0.0
+
+    def wait(self, timeout=JOB_WAIT_SECONDS):
+        """Waits up to timeout seconds for the job to finish; returns the job."""
+        if self.future is not None:
+            wait([self.future], timeout)
+        return self
+
+    def cancel(self):
+        """Asks the job to stop: a queued job never starts, a running one stops at its next checkpoint()."""
+        self._cancelled.set()
+        if self.future is not None and self.future.cancel():
+            self.state = 'cancelled'
+
+
+def checkpoint(done=None, total=None):
+    """
+    Called by long computations between steps: records progress (done of total steps)
+    and raises JobCancelled if the job running in this thread was cancelled.
+    Does nothing outside a job.
+    """
+    job = getattr(_local, 'job', None)
+    if job is None:
+        return
+    if total is not None:
+        job.done, job.total = done, total
+    if job.cancelled:
+        raise JobCancelled()
+
+
+# --- Job Queue ---
+class JobQueue:
+    """
+    Runs heavy callbacks on a local thread pool so a slow request doesn't hold a
+    web worker thread, with at most one live job per browser session.
+
+    A session's new job cancels the one it supersedes. Jobs are keyed on what they
+    compute, so re-submitting the running computation (a double click) returns the
+    same job; a poll submits with replace=False so it can never supersede a job.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, sessions=JOB_SESSIONS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.max_sessions = sessions
+        self.sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, session, key, fn, *args, replace=True):
+        """
+        The session's job computing key, started as fn(*args) unless it already exists.
+        With replace=False the session's current job is returned whatever it computes,
+        and a job is only started if the session has none.
+        """
+        with self._lock:
+            job = self.sessions.get(session)
+            if job is not None and (not replace or job.key == key and job.state not in ('failed', 'cancelled')):
+                self.sessions.move_to_end(session)
+                return job
+            if job is not None:
+                job.cancel()
+
+            job = Job(key)
+            self.sessions[session] = job
+            self.sessions.move_to_end(session)
+            while len(self.sessions) > self.max_sessions:
+                _, oldest = self.sessions.popitem(last=False)
+                oldest.cancel()
+            job.future = self.executor.submit(self._run, job, fn, args)
+            return job
+
+    def get(self, session):
+        """The session's latest job, or None."""
+        with self._lock:
+            return self.sessions.get(session)
+
+    def _run(self, job, fn, args):
+        if job.cancelled:
+            job.state = 'cancelled'
+            return
+        job.state = 'running'
+        _local.job = job
+        try:
+            job.result = fn(*args)
+            job.state = 'done'
+        except JobCancelled:
+            job.state = 'cancelled'
+        except Exception as e:
+            job.error = e
+            job.state = 'failed'
+            log.exception("Job %d failed: %s", job.id, e)
+        finally:
+            _local.job = None
@@ -0,0 +1,247 @@
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+log = logging.getLogger(__name__)
+
+METRICS_ROUTE = "/metrics"
+
+# Fraction of callbacks run under the profiler (0 disables profiling)
+PROFILE_RATE = float(os.environ.get("CRASHES_PROFILE_RATE", 0))
+
+# Where profiles are written, one file per profiled callback
+PROFILE_DIR = os.environ.get("CRASHES_PROFILE_DIR", os.path.join(os.path.dirname(__file__), ".profiles"))
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_local = threading.local()
+
+
+# --- Registry ---
+class Histogram:
+    """Cumulative latency histogram in the Prometheus sense: bucket counts, sum and count."""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+
+class Registry:
+    """
+    Per-process timings of request stages and callbacks, with the rows each stage
+    took in and produced, the memory each callback added and the counters of the
+    watched result caches. Exposed in the Prometheus text format by register_metrics().
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.callbacks = {}
+        self.counters = {}
+        self.caches = []
+        self._lock = threading.Lock()
+
+    def watch_cache(self, cache):
+        """Exports the hit, miss and eviction counts of a ResultCache (summed over watched caches)."""
+        with self._lock:
+            self.caches.append(cache)
+
+    def _add(self, name, labels, value):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe_stage(self, stage, seconds, rows_in=None, rows_out=None):
+        with self._lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+            if rows_in is not None:
+                self._add('crashes_stage_rows_in_total', (('stage', stage),), rows_in)
+            if rows_out is not None:
+                self._add('crashes_stage_rows_out_total', (('stage', stage),), rows_out)
+
+    def observe_callback(self, callback, seconds, rss_delta=None, failed=False):
+        with self._lock:
+            self.callbacks.setdefault(callback, Histogram()).observe(seconds)
+            if rss_delta is not None:
+                self._add('crashes_callback_rss_delta_bytes_total', (('callback', callback),), rss_delta)
+            if failed:
+                self._add('crashes_callback_errors_total', (('callback', callback),), 1)
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, label, histograms, text in [
+                ('crashes_stage_seconds', 'stage', self.stages, "Duration of request stages"),
+                ('crashes_callback_seconds', 'callback', self.callbacks, "Duration of Dash callbacks"),
+            ]:
+                lines += [f"# HELP {name} {text}.", f"# TYPE {name} histogram"]
+                for value, histogram in sorted(histograms.items()):
+                    for bound, count in zip(BUCKETS, histogram.buckets):
+                        lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{{label}="{value}"}} {histogram.count}')
+
+            seen = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{name}{{{label_text}}} {value}")
+            caches = list(self.caches)
+
+        if caches:
+            stats = [cache.stats() for cache in caches]
+            for counter in ('hits', 'misses', 'evictions'):
+                name = f"crashes_result_cache_{counter}_total"
+                lines += [f"# TYPE {name} counter", f"{name} {sum(s[counter] for s in stats)}"]
+
+        rss = _rss()
+        if rss is not None:
+            lines += ["# TYPE crashes_process_rss_bytes gauge", f"crashes_process_rss_bytes {rss}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _rss():
+    """Resident set size of the process in bytes, None without psutil."""
+    return psutil.Process().memory_info().rss if psutil is not None else None
+
+
+# --- Instrumentation ---
+class _Stage:
+    def __init__(self, rows_in):
+        self.rows_in = rows_in
+        self.rows_out = None
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    Times the block as one request stage. Set .rows_out on the yielded object to
+    record how many rows the stage produced:
+
+        with stage('filter', rows_in=len(df)) as s:
+            rows = ...
+            s.rows_out = len(rows)
+    """
+    record = _Stage(rows_in)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe_stage(name, seconds, record.rows_in, record.rows_out)
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.append((name, seconds, record.rows_in, record.rows_out))
+
+def timed_iter(name, chunks):
+    """Passes a streamed body through, timing it as one stage from first to last chunk."""
+    with stage(name):
+        yield from chunks
+
+def instrument(callback):
+    """
+    Decorator timing a callback as a whole, with the RSS it added and every stage run
+    on its thread logged at debug level. Sampled calls (CRASHES_PROFILE_RATE) run
+    under the profiler.
+    """
+
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        rss_before = _rss()
+        _local.trace = []
+        start = time.perf_counter()
+        failed = False
+        try:
+            with profiled(callback.__name__):
+                return callback(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            rss_after = _rss()
+            registry.observe_callback(callback.__name__, seconds,
+                                      None if rss_before is None else rss_after - rss_before, failed)
+            if log.isEnabledFor(logging.DEBUG):
+                stages = ", ".join(f"{name} {s * 1000:.1f}ms" + (f" {i}->{o} rows" if o is not None else "")
+                                   for name, s, i, o in _local.trace)
+                log.debug("%s took %.1fms%s", callback.__name__, seconds * 1000, ": " + stages if stages else "")
+            _local.trace = None
+
+    return wrapper
+
+
+# --- Profiling ---
+@contextmanager
+def profiled(name, rate=None):
+    """
+    Runs the block under a profiler for a random `rate` fraction of calls (default
+    CRASHES_PROFILE_RATE) and writes the profile to PROFILE_DIR. Uses pyinstrument
+    (a sampling profiler, HTML output) when it is installed, cProfile otherwise.
+    """
+    rate = PROFILE_RATE if rate is None else rate
+    if rate <= 0 or random.random() >= rate:
+        yield
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident()}")
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        Profiler = None
+
+    if Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path + ".html", "w") as f:
+                f.write(profiler.output_html())
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path + ".prof")
+    log.info("Wrote profile of %s to %s", name, path)
+
+
+# --- Route ---
+def register_metrics(server):
+    """Adds the Prometheus metrics endpoint to the Flask server (one registry per worker process)."""
+
+    @server.route(METRICS_ROUTE)
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    return metrics
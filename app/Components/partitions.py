@@ -0,0 +1,249 @@
+import copy
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .DataLoader import FILTER_MAP, MULTI_FILTER_MAP, facet_options, filter_options, filter_values, get_options, merge_options, options_from_values, read_partition
+from .aggregate import merge_summaries, summarize_rows
+from .cube import AggregateCube
+from .dataset import Dataset, next_version
+from .geo import GeoIndex, merge_map
+from .indexes import encode_column, label_key
+from .jobs import checkpoint
+from .metrics import stage
+from .result_cache import filter_key
+
+log = logging.getLogger(__name__)
+
+# Year partitions kept in memory at once. 0 keeps the whole dataset resident instead.
+RESIDENT_YEARS = int(os.environ.get("CRASHES_RESIDENT_YEARS", 0))
+
+
+# --- Helpers ---
+def _year_of(name):
+    """Year of a partition directory name (year=2019 -> 2019, year=none -> None)."""
+    value = name.split("=", 1)[1]
+    return None if value == "none" else int(value)
+
+def _year_order(year):
+    return (year is None, year or 0)
+
+def _split_years(df):
+    """(year, rows) pairs of df grouped by CRASH_YEAR, None for rows without a year."""
+    years = df['CRASH_YEAR'] if 'CRASH_YEAR' in df.columns else pd.Series(float('nan'), index=df.index)
+    for year, part in df.groupby(years, dropna=False, sort=False):
+        yield (None if pd.isna(year) else int(year)), part.reset_index(drop=True)
+
+def _slot_values(dataset, key):
+    """Values of the multi-valued filter key some row of dataset holds, from its packed slot codes."""
+    column = dataset.filter_index.columns.get(key)
+    if column is None:
+        return set()
+    # Slot 0 of the offsets holds rows without a value
+    counts = np.diff(column['offsets'])[1:]
+    return {label for label, count in zip(column['labels'], counts) if count}
+
+def _borough_map_parts(geo, df):
+    """
+    Map aggregates of the rows of df per borough (its label_key, None for rows without
+    one), from df's GeoIndex, so a map filtered on the year and the borough needs no rows.
+    """
+    col = FILTER_MAP['borough']
+    if col not in df.columns:
+        return {None: [geo.parts(None)]}
+    codes, labels = encode_column(df[col])
+    # Stable sort keeps the row ids of each borough ascending
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(-1, len(labels) + 1))
+    names = [None] + sorted(labels, key=labels.get)
+    return {name: [geo.parts(order[start:end])]
+            for name, start, end in zip(names, bounds[:-1], bounds[1:]) if end > start}
+
+def _merge_map_parts(parts, more):
+    """Per-borough map aggregates of parts with those of more appended."""
+    return {name: parts.get(name, []) + more.get(name, []) for name in {**parts, **more}}
+
+
+# --- Partitioned Dataset ---
+class PartitionedDataset:
+    """
+    The crash dataset split by year, with only the recently used years in memory.
+
+    Every partition is read once at startup to build the cube, the row counts, the
+    values of the multi-valued filters and the map aggregates per year and borough, so
+    views filtered on the year and the borough alone, without a search, never need rows.
+    Requests that do need rows load the partitions of the years they filter on into a
+    bounded LRU of resident Datasets, one partition at a time.
+    Offers the same summary()/parts()/options()/extend() interface as Dataset.
+    """
+
+    def __init__(self, directory, resident=RESIDENT_YEARS):
+        self.version = next_version()
+        self.resident = max(1, resident)
+        self.paths = {}
+        if directory and os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.startswith("year="):
+                    self.paths[_year_of(name)] = os.path.join(directory, name)
+
+        self.deltas = ()
+        self.pending = {}
+        self.rows = {}
+        self.columns = []
+        self.cube = AggregateCube(pd.DataFrame())
+        self._map_parts = {}
+        self._slot_values = {key: set() for key in MULTI_FILTER_MAP}
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+
+        for year in self.years():
+            partition = self._load(year)
+            self.cube = self.cube.extend(partition.df)
+            self.rows[year] = len(partition.df)
+            self.columns = self.columns or partition.columns
+            self._map_parts[year] = _borough_map_parts(partition.geo, partition.df)
+            for key in MULTI_FILTER_MAP:
+                self._slot_values[key] |= _slot_values(partition, key)
+            # The most recent years stay resident, they're the likeliest to be asked for
+            self._keep(year, partition)
+
+        log.info("%d rows in %d year partitions, %d resident", len(self), len(self.rows), len(self._resident))
+
+    def __len__(self):
+        return sum(self.rows.values())
+
+    def years(self):
+        return sorted(set(self.paths) | set(self.pending), key=_year_order)
+
+    def _load(self, year):
+        """Dataset of one year: its partition files plus the deltas appended since."""
+        with stage('partition.load') as s:
+            frames = ([read_partition(self.paths[year])] if year in self.paths else []) + list(self.pending.get(year, ()))
+            dataset = Dataset(frames[0], geo=GeoIndex(frames[0], salt=year or 0))
+            for delta in frames[1:]:
+                dataset = dataset.extend(delta)
+            s.rows_out = len(dataset)
+        return dataset
+
+    def _keep(self, year, partition):
+        self._resident[year] = partition
+        self._resident.move_to_end(year)
+        while len(self._resident) > self.resident:
+            self._resident.popitem(last=False)
+
+    def partition(self, year):
+        """The Dataset of one year, loaded if it isn't resident."""
+        with self._lock:
+            if year in self._resident:
+                self._resident.move_to_end(year)
+                return self._resident[year]
+            partition = self._load(year)
+            self._keep(year, partition)
+            return partition
+
+    def years_for(self, inputs):
+        """The years whose partitions can hold rows matching the filters (a year, a range or a list)."""
+        years = filter_values('year', inputs.get('year'))
+        if years is None:
+            return self.years()
+        return [year for year in self.years() if year in years]
+
+    # --- Dataset interface ---
+    def parts(self, inputs, search_text=None):
+        """(Dataset, row ids) pairs of the matching rows, loading one partition at a time."""
+        for year in self.years_for(inputs):
+            yield from self.partition(year).parts(inputs, search_text)
+
+    def summary(self, inputs, search_text=None):
+        """
+        The dashboard summary of the rows matching the filters and the search. Without
+        a search the cube answers the stats and charts; when the year and the borough are
+        the only filters the map comes from the startup aggregates of those years and
+        boroughs too. Otherwise partial summaries of the partitions involved are merged.
+        """
+        summary = None
+        if not (search_text and search_text.strip()):
+            with stage('cube'):
+                summary = self.cube.query(inputs)
+        if summary is not None and {key for key, _ in filter_key(inputs, None)[0]} <= {'year', 'borough'}:
+            boroughs = filter_values('borough', inputs.get('borough'))
+            boroughs = None if boroughs is None else {label_key(b) for b in boroughs}
+            with stage('map'):
+                summary.update(merge_map([part for year in self.years_for(inputs)
+                                          for name, parts in self._map_parts.get(year, {}).items()
+                                          if boroughs is None or name in boroughs for part in parts]))
+            return summary
+
+        partials, maps = [], []
+        years = self.years_for(inputs)
+        for i, year in enumerate(years):
+            checkpoint(i, len(years))
+            # A partition with appended deltas holds several segments
+            for part, rows in self.partition(year).parts(inputs, search_text):
+                n_rows = len(part) if rows is None else len(rows)
+                if summary is None:
+                    with stage('stats', rows_in=n_rows):
+                        partials.append(summarize_rows(part.df, rows, progress=False))
+                with stage('map', rows_in=n_rows):
+                    maps.append(part.geo.parts(rows))
+
+        if summary is None:
+            summary = merge_summaries(partials)
+        summary.update(merge_map(maps))
+        return summary
+
+    def options(self, col):
+        """get_options() of a column; read from the cube's labels for its dimensions."""
+        values = self.cube.values(col)
+        if values is not None:
+            return options_from_values(values)
+
+        options = []
+        for year in self.years():
+            options = merge_options(options, self.partition(year).options(col))
+        return options
+
+    def facet_options(self, key, inputs):
+        """Options of the filter key with their row counts under the other filters in inputs."""
+        counts = self.cube.facet_counts(key, inputs)
+        if counts is not None:
+            return facet_options(counts, inputs.get(key))
+        if key in self._slot_values:
+            # Without the rows there are no counts; the values were collected at startup
+            return options_from_values(self._slot_values[key])
+        return filter_options(self.options, key)
+
+    def extend(self, delta, name=None):
+        """
+        A new version with the rows of delta appended. The delta is split by year and
+        kept next to the partition files; resident partitions are extended in place of
+        being reloaded.
+        """
+        dataset = copy.copy(self)
+        dataset.version = next_version()
+        dataset.deltas = self.deltas + ((name,) if name else ())
+        dataset.cube = self.cube.extend(delta)
+        dataset.pending = dict(self.pending)
+        dataset.rows = dict(self.rows)
+        dataset._map_parts = dict(self._map_parts)
+        dataset._slot_values = {key: values | {o['value'] for col in MULTI_FILTER_MAP[key] for o in get_options(delta, col)}
+                                for key, values in self._slot_values.items()}
+        dataset._resident = OrderedDict(self._resident)
+        dataset._lock = threading.Lock()
+        if self.columns:
+            delta = delta.reindex(columns=self.columns)
+
+        for year, part in _split_years(delta):
+            dataset.pending[year] = dataset.pending.get(year, ()) + (part,)
+            dataset.rows[year] = dataset.rows.get(year, 0) + len(part)
+            salt = (year or 0) + dataset.rows[year]
+            more = _borough_map_parts(GeoIndex(part, salt=salt), part)
+            dataset._map_parts[year] = _merge_map_parts(dataset._map_parts.get(year, {}), more)
+            if year in dataset._resident:
+                dataset._resident[year] = dataset._resident[year].extend(part)
+
+        return dataset
@@ -0,0 +1,70 @@
+import logging
+import os
+import threading
+import time
+
+from .DataLoader import load_delta
+from .dataset import get_dataset, set_dataset
+
+log = logging.getLogger(__name__)
+
+# Directory of delta files (new crash records) to append to the loaded dataset.
+# Files are applied once each, in file name order, so name them to sort
+# chronologically (e.g. crashes-2024-06-01.csv).
+DELTA_DIR = os.environ.get("CRASHES_DELTA_DIR")
+
+# Minimum seconds between two checks of the delta directory
+DELTA_POLL_SECONDS = float(os.environ.get("CRASHES_DELTA_POLL", 60))
+
+DELTA_SUFFIXES = (".csv", ".parquet")
+
+_refresh_lock = threading.Lock()
+_last_poll = 0.0
+
+
+# --- Refresh ---
+def pending_deltas(dataset, directory):
+    """Names of the delta files in directory not yet appended to dataset, in apply order."""
+    if not directory or not os.path.isdir(directory):
+        return []
+    names = sorted(f for f in os.listdir(directory) if f.endswith(DELTA_SUFFIXES))
+    return [f for f in names if f not in dataset.deltas]
+
+def refresh(directory=DELTA_DIR):
+    """
+    Appends the pending delta files of directory to the current dataset and swaps the
+    result in as one new version. Returns the number of files applied.
+    """
+    with _refresh_lock:
+        current = get_dataset()
+        dataset = current
+        for name in pending_deltas(current, directory):
+            try:
+                dataset = dataset.extend(load_delta(os.path.join(directory, name)), name)
+            except Exception as e:
+                # Later deltas wait until this one can be applied
+                log.exception("Could not apply delta %s: %s", name, e)
+                break
+
+        if dataset is not current:
+            set_dataset(dataset)
+            log.info("Dataset version %d: %d rows after %d deltas", dataset.version, len(dataset), len(dataset.deltas))
+        return len(dataset.deltas) - len(current.deltas)
+
+def register_refresh(server, directory=DELTA_DIR, interval=DELTA_POLL_SECONDS):
+    """
+    Checks directory for new delta files at most every interval seconds, before a request.
+    Each worker process polls on its own, so all of them pick up the same deltas
+    without a restart. Does nothing when no directory is configured.
+    """
+    if not directory:
+        return
+
+    @server.before_request
+    def poll_deltas():
+        global _last_poll
+        now = time.monotonic()
+        if now - _last_poll < interval or _refresh_lock.locked():
+            return
+        _last_poll = now
+        refresh(directory)
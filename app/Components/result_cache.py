@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from plotly.utils import PlotlyJSONEncoder
+
+from .DataLoader import filter_values
+from .indexes import label_key
+
+# Byte budget for cached callback results
+RESULT_CACHE_MB = float(os.environ.get("CRASHES_RESULT_CACHE_MB", 64))
+
+
+# --- Cache key ---
+def filter_key(inputs, search_text, logic="AND"):
+    """
+    Normalized, hashable form of a filter state: inactive filters are dropped, values
+    go through the same normalization as the indexes (a year range becomes its years)
+    and the search text is reduced to its lowercase terms, so equivalent requests share
+    one cache entry.
+    """
+    active = tuple(sorted(
+        (key, tuple(sorted({label_key(value) for value in values})))
+        for key, values in ((key, filter_values(key, value)) for key, value in inputs.items())
+        if values is not None
+    ))
+    terms = tuple(search_text.lower().split()) if isinstance(search_text, str) else ()
+    return active, terms, logic.upper() if terms else None
+
+
+# --- Result Cache ---
+class ResultCache:
+    """
+    Bounded LRU cache of serialized callback results.
+
+    Values are stored as JSON strings (figures included), and the cache evicts the
+    least recently used entries once their total size goes over max_bytes.
+    """
+
+    def __init__(self, max_bytes=int(RESULT_CACHE_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The cached value for key, or None."""
+        with self._lock:
+            payload = self.entries.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return json.loads(payload)
+
+    def put(self, key, value):
+        """Stores value (anything the Plotly JSON encoder handles) under key."""
+        payload = json.dumps(value, cls=PlotlyJSONEncoder)
+        # Entries that would flush most of the cache aren't worth keeping
+        if len(payload) > self.max_bytes // 2:
+            return
+
+        with self._lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = payload
+            self.size += len(payload)
+
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
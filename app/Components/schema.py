@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+# Bumped whenever SCHEMA or the dtype rules change, so cached snapshots are rebuilt
+SCHEMA_VERSION = 2
+
+# Columns the dashboard uses and how each is stored: 'Column Name' -> kind.
+# Columns not listed are dropped at load time.
+#   category  dictionary-encoded text
+#   count     non-negative integer, narrowest unsigned type that fits (uint8/uint16/...)
+#   float32   single-precision float (coordinates)
+#   year      uint16
+#   datetime  datetime64
+SCHEMA = {
+    'CRASH_DATETIME': 'datetime',
+    'CRASH DATE': 'datetime',
+    'CRASH TIME': 'category',
+    'CRASH_YEAR': 'year',
+    'BOROUGH': 'category',
+    'LATITUDE': 'float32',
+    'LONGITUDE': 'float32',
+    'NUMBER OF PERSONS INJURED': 'count',
+    'NUMBER OF PEDESTRIANS KILLED': 'count',
+    'NUMBER OF CYCLIST KILLED': 'count',
+    'NUMBER OF MOTORIST KILLED': 'count',
+    'PERSONS_INVOLVED_COUNT': 'count',
+    'MOST_COMMON_SEX': 'category',
+    **{f'CONTRIBUTING FACTOR VEHICLE {i}': 'category' for i in range(1, 6)},
+    **{f'VEHICLE TYPE CODE {i}': 'category' for i in range(1, 6)},
+}
+
+# Formats tried in turn for datetime columns: CRASH_DATETIME as written by the cleaning
+# (pandas to_csv), then the city's raw CRASH DATE/CRASH TIME formats. Other values are inferred.
+DATETIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%m/%d/%Y %H:%M", "%m/%d/%Y")
+
+# Date parts derived from CRASH_DATETIME as compact integers: 'Column Name' -> part
+#   day          days since 1970-01-01
+#   year_month   months since year 0 (year * 12 + month - 1)
+#   weekday      0 = Monday ... 6 = Sunday
+#   other parts  the datetime attribute of that name
+DERIVED = {
+    'CRASH_MONTH': 'month',
+    'CRASH_HOUR': 'hour',
+    'CRASH_WEEKDAY': 'weekday',
+    'CRASH_DAY': 'day',
+    'CRASH_YEAR_MONTH': 'year_month',
+}
+
+
+# --- Dtype helpers ---
+def narrow_unsigned(values):
+    """
+    Integer column in the narrowest unsigned dtype that holds its values.
+    Columns with missing values become float32 (NaN needs a float), and columns with
+    negative values keep a signed type.
+    """
+    values = pd.to_numeric(values, errors='coerce')
+    if values.isna().any():
+        return values.astype(np.float32)
+    if len(values) == 0:
+        return values.astype(np.uint8)
+
+    low, high = values.min(), values.max()
+    if low < 0:
+        dtypes = (np.int8, np.int16, np.int32, np.int64)
+    else:
+        dtypes = (np.uint8, np.uint16, np.uint32, np.uint64)
+    for dtype in dtypes:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values
+
+def _cast(series, kind):
+    if kind == 'category':
+        return series if isinstance(series.dtype, pd.CategoricalDtype) else series.astype('category')
+    if kind == 'count':
+        return narrow_unsigned(series)
+    if kind == 'float32':
+        return pd.to_numeric(series, errors='coerce').astype(np.float32)
+    if kind == 'year':
+        years = pd.to_numeric(series, errors='coerce')
+        return years.astype(np.float32) if years.isna().any() else years.astype(np.uint16)
+    if kind == 'datetime':
+        return series if pd.api.types.is_datetime64_any_dtype(series.dtype) else parse_datetimes(series)
+    raise ValueError(f"Unknown column kind: {kind}")
+
+
+def parse_datetimes(values, formats=DATETIME_FORMATS):
+    """
+    Text Series as datetime64 (NaT where it isn't a date). Each format is applied to the
+    values the previous ones left unparsed, which keeps parsing vectorized when the
+    data has a known format; only values matching none of them are inferred one by one.
+    """
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    left = values.notna()
+    for date_format in formats:
+        if not left.any():
+            return parsed
+        parsed[left] = pd.to_datetime(values[left], format=date_format, errors='coerce')
+        left &= parsed.isna()
+    if left.any():
+        parsed[left] = pd.to_datetime(values[left], format='mixed', errors='coerce')
+    return parsed
+
+def date_part(dates, part):
+    """One DERIVED part of a datetime Series, as float (NaN where the date is missing)."""
+    if part == 'day':
+        days = dates.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+        return pd.Series(np.where(np.isnat(days), np.nan, days.astype(np.int64)), index=dates.index)
+    if part == 'year_month':
+        return dates.dt.year * 12 + dates.dt.month - 1
+    return getattr(dates.dt, part)
+
+
+# --- Schema ---
+def used_columns(columns):
+    """The columns of a source that the schema keeps, in source order."""
+    return [col for col in columns if col in SCHEMA]
+
+def apply_schema(df):
+    """
+    Drops the columns the dashboard never uses, casts the others to their schema
+    dtype and derives the DERIVED date parts in the narrowest unsigned type
+    (float32 if dates are missing).
+    """
+    df = df[used_columns(df.columns)]
+    df = df.assign(**{col: _cast(df[col], SCHEMA[col]) for col in df.columns})
+
+    if 'CRASH_DATETIME' in df.columns:
+        dates = df['CRASH_DATETIME']
+        df = df.assign(**{col: narrow_unsigned(date_part(dates, part)) for col, part in DERIVED.items()})
+
+    return df
+
+def memory_footprint(df):
+    """Bytes used by df, string and category payloads included."""
+    return int(df.memory_usage(index=False, deep=True).sum())
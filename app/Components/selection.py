@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+
+# --- Row Selection ---
+class RowSelection:
+    """
+    A read-only view of some rows of an immutable DataFrame: the frame plus the sorted
+    row ids (or a slice) of the rows, and None for every row.
+
+    It answers the parts of the DataFrame interface the aggregations use (columns,
+    len(), empty, selection[col]), so summarize() runs on it unchanged. A column is
+    only gathered when it is first read and then kept, so a request holds copies of
+    the columns it touches instead of the whole selected frame. Column names can't be
+    reassigned and gathered columns have a fresh RangeIndex.
+    """
+
+    def __init__(self, df, rows=None):
+        self.df = df
+        # Sorted row ids without gaps (e.g. a year of a clustered dataset) are read as a slice
+        if isinstance(rows, np.ndarray) and len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            rows = slice(int(rows[0]), int(rows[-1]) + 1)
+        self.rows = rows
+        self._columns = {}
+
+    @property
+    def columns(self):
+        return self.df.columns
+
+    @property
+    def empty(self):
+        return len(self) == 0 or len(self.df.columns) == 0
+
+    def __len__(self):
+        if self.rows is None:
+            return len(self.df)
+        if isinstance(self.rows, slice):
+            return len(range(*self.rows.indices(len(self.df))))
+        return len(self.rows)
+
+    def __contains__(self, col):
+        return col in self.df.columns
+
+    def __getitem__(self, col):
+        """The selected rows of one column, gathered on first use."""
+        if col not in self._columns:
+            series = self.df[col]
+            if isinstance(self.rows, slice):
+                # A slice of a column's array is a view, nothing is copied
+                series = pd.Series(series.array[self.rows], name=col, copy=False)
+            elif self.rows is not None:
+                series = pd.Series(series.array.take(self.rows), name=col, copy=False)
+            self._columns[col] = series
+        return self._columns[col]
+
+    def split(self, parts):
+        """The selection cut into `parts` consecutive, nearly equal selections of the same frame."""
+        bounds = np.linspace(0, len(self), parts + 1).astype(int)
+        if self.rows is None:
+            return [RowSelection(self.df, slice(start, stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+        if isinstance(self.rows, slice):
+            offset = self.rows.indices(len(self.df))[0]
+            return [RowSelection(self.df, slice(offset + start, offset + stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+        return [RowSelection(self.df, self.rows[start:stop]) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def frame(self, columns=None):
+        """A DataFrame of the selected rows, with only the given columns (all by default)."""
+        columns = list(self.df.columns) if columns is None else [col for col in columns if col in self.df.columns]
+        return pd.DataFrame({col: self[col] for col in columns}, columns=columns)
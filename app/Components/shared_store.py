@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Column store of read-only .npy files that every gunicorn worker memory-maps.
+# The pages live in the OS page cache and are shared by all processes, so
+# N workers cost one copy of the data instead of N.
+
+MANIFEST = "manifest.json"
+
+
+# --- Export Functions ---
+def _column_payload(series):
+    """Returns (kind, values array, extra manifest fields) for one column."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = [str(c) for c in series.cat.categories]
+        return "category", series.cat.codes.to_numpy(), {"categories": categories}
+
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        values = series.to_numpy(dtype="datetime64[ns]").view("int64")
+        return "datetime", values, {}
+
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return "numeric", series.to_numpy(dtype=bool), {}
+
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        # Nullable integer columns are stored as float so missing values survive
+        if series.hasnans and not pd.api.types.is_float_dtype(series.dtype):
+            return "numeric", series.to_numpy(dtype="float64", na_value=np.nan), {}
+        return "numeric", series.to_numpy(), {}
+
+    # Free-text columns are dictionary encoded so they can be memory-mapped too
+    codes, uniques = pd.factorize(series, sort=True)
+    return "category", codes.astype(_code_dtype(len(uniques))), {"categories": [str(u) for u in uniques]}
+
+def _code_dtype(n_categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def export_columns(df, directory):
+    """Writes every column of df as a .npy file plus a manifest. The write is atomic."""
+    tmp_dir = directory + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        kind, values, extra = _column_payload(df[col])
+        file_name = f"col{i:03d}.npy"
+        np.save(os.path.join(tmp_dir, file_name), np.ascontiguousarray(values))
+        columns.append({"name": col, "kind": kind, "file": file_name, **extra})
+
+    with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+        json.dump({"rows": len(df), "columns": columns}, f)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+
+
+# --- Attach Functions ---
+def has_columns(directory):
+    return os.path.exists(os.path.join(directory, MANIFEST))
+
+def attach_columns(directory):
+    """
+    Returns a DataFrame whose columns are read-only memory maps of the files
+    written by export_columns. No column data is copied into the process.
+    """
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+
+    data = {}
+    for column in manifest["columns"]:
+        values = np.load(os.path.join(directory, column["file"]), mmap_mode="r")
+
+        if column["kind"] == "category":
+            dtype = pd.CategoricalDtype(column["categories"])
+            values = pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+        elif column["kind"] == "datetime":
+            values = values.view("datetime64[ns]")
+
+        data[column["name"]] = pd.Series(values, copy=False)
+
+    return pd.DataFrame(data, copy=False)
@@ -0,0 +1,154 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Synthetic crash dataset with the schema of the cleaned NYC file the dashboard loads.
+# Value sets and rough frequencies follow the real data, so the dictionaries, index
+# sizes and selectivities the benchmarks see are realistic.
+
+BOROUGHS = {
+    'BROOKLYN': 0.22, 'QUEENS': 0.19, 'MANHATTAN': 0.15, 'BRONX': 0.11,
+    'STATEN ISLAND': 0.03, None: 0.30
+}
+
+# Approximate centre (lat, lon) and spread of each borough
+BOROUGH_CENTERS = {
+    'BROOKLYN': (40.65, -73.95, 0.04), 'QUEENS': (40.72, -73.82, 0.06),
+    'MANHATTAN': (40.78, -73.97, 0.03), 'BRONX': (40.84, -73.88, 0.03),
+    'STATEN ISLAND': (40.58, -74.15, 0.04), None: (40.70, -73.92, 0.10)
+}
+
+FACTORS = {
+    'unspecified': 0.34, 'driver inattention/distraction': 0.20, 'failure to yield right-of-way': 0.06,
+    'following too closely': 0.05, 'backing unsafely': 0.04, 'other vehicular': 0.03,
+    'passing or lane usage improper': 0.03, 'passing too closely': 0.03, 'unsafe lane changing': 0.02,
+    'turning improperly': 0.02, 'traffic control disregarded': 0.02, 'unsafe speed': 0.02,
+    'driver inexperience': 0.02, 'alcohol involvement': 0.01, 'view obstructed/limited': 0.01,
+    'reaction to uninvolved vehicle': 0.01, 'pavement slippery': 0.01, 'fatigued/drowsy': 0.01,
+    'pedestrian/bicyclist/other pedestrian error/confusion': 0.01, 'aggressive driving/road rage': 0.01,
+    'oversized vehicle': 0.01, 'brakes defective': 0.01, 'cell phone (hand-held)': 0.01
+}
+
+VEHICLES = {
+    'sedan': 0.33, 'station wagon/sport utility vehicle': 0.27, 'passenger vehicle': 0.10,
+    'sport utility / station wagon': 0.07, 'taxi': 0.04, 'pick-up truck': 0.03, 'box truck': 0.02,
+    'bus': 0.02, 'bike': 0.02, 'van': 0.02, 'motorcycle': 0.01, 'tractor truck diesel': 0.01,
+    'e-bike': 0.01, 'ambulance': 0.01, 'e-scooter': 0.01, 'dump': 0.01, 'garbage or refuse': 0.01
+}
+
+STREETS = ['broadway', 'atlantic avenue', 'northern boulevard', 'grand central pkwy', 'fdr drive',
+           'belt parkway', 'queens boulevard', 'flatbush avenue', '3 avenue', 'linden boulevard',
+           'major deegan expressway', 'bruckner boulevard', 'eastern parkway', 'hylan boulevard']
+
+SEXES = {'M': 0.62, 'F': 0.30, 'UNKNOWN': 0.08}
+
+# Share of crashes with at least 2..5 vehicles
+EXTRA_VEHICLE_SHARE = [0.80, 0.08, 0.02, 0.005]
+
+FIRST_DAY = np.datetime64('2012-07-01')
+LAST_DAY = np.datetime64('2023-12-31')
+
+# Rows generated (and written) at a time, which bounds the generator's memory
+CHUNK_ROWS = 1_000_000
+
+
+# --- Helpers ---
+def _choice(rng, weights, n):
+    values = list(weights)
+    p = np.array(list(weights.values()), dtype=float)
+    return np.array(values, dtype=object)[rng.choice(len(values), size=n, p=p / p.sum())]
+
+def _counts(rng, mean, n):
+    return rng.poisson(mean, n)
+
+
+# --- Generator ---
+def generate_chunk(n, rng, first_id=0):
+    """n synthetic crash rows as a DataFrame in the cleaned-file schema."""
+    days = (LAST_DAY - FIRST_DAY).astype(int) + 1
+    # More crashes in the afternoon rush than at night
+    hour_weights = np.array([2, 1, 1, 1, 1, 2, 3, 4, 6, 5, 5, 5, 6, 6, 7, 8, 9, 8, 7, 6, 5, 4, 3, 3], dtype=float)
+    minutes = rng.choice(24, size=n, p=hour_weights / hour_weights.sum()) * 60 + rng.integers(0, 60, n)
+    crash_datetime = (FIRST_DAY + rng.integers(0, days, n).astype('timedelta64[D]')).astype('datetime64[m]') \
+        + minutes.astype('timedelta64[m]')
+
+    borough = _choice(rng, BOROUGHS, n)
+    lat = np.empty(n)
+    lon = np.empty(n)
+    for name, (center_lat, center_lon, spread) in BOROUGH_CENTERS.items():
+        rows = borough == name
+        lat[rows] = rng.normal(center_lat, spread, rows.sum())
+        lon[rows] = rng.normal(center_lon, spread, rows.sum())
+    # Missing and 0,0 placeholder locations, as in the real file
+    missing = rng.random(n) < 0.07
+    lat[missing] = np.nan
+    lon[missing] = np.nan
+    zero = rng.random(n) < 0.01
+    lat[zero] = 0.0
+    lon[zero] = 0.0
+
+    pedestrians_injured = _counts(rng, 0.05, n)
+    cyclists_injured = _counts(rng, 0.03, n)
+    motorists_injured = _counts(rng, 0.22, n)
+    pedestrians_killed = (rng.random(n) < 0.0006).astype(int)
+    cyclists_killed = (rng.random(n) < 0.0001).astype(int)
+    motorists_killed = (rng.random(n) < 0.0005).astype(int)
+
+    df = pd.DataFrame({
+        'CRASH_DATETIME': pd.Series(crash_datetime).dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'BOROUGH': borough,
+        'ZIP CODE': np.where(borough == None, np.nan, rng.integers(10001, 11698, n)),
+        'LATITUDE': lat.round(6),
+        'LONGITUDE': lon.round(6),
+        'ON STREET NAME': np.array(STREETS, dtype=object)[rng.integers(0, len(STREETS), n)],
+        'CROSS STREET NAME': np.array(STREETS, dtype=object)[rng.integers(0, len(STREETS), n)],
+        'NUMBER OF PERSONS INJURED': pedestrians_injured + cyclists_injured + motorists_injured,
+        'NUMBER OF PERSONS KILLED': pedestrians_killed + cyclists_killed + motorists_killed,
+        'NUMBER OF PEDESTRIANS INJURED': pedestrians_injured,
+        'NUMBER OF PEDESTRIANS KILLED': pedestrians_killed,
+        'NUMBER OF CYCLIST INJURED': cyclists_injured,
+        'NUMBER OF CYCLIST KILLED': cyclists_killed,
+        'NUMBER OF MOTORIST INJURED': motorists_injured,
+        'NUMBER OF MOTORIST KILLED': motorists_killed,
+    })
+
+    # Shares are decreasing, so one draw decides how many vehicles a crash has
+    draw = rng.random(n)
+    vehicles = 1 + sum((draw < share).astype(int) for share in EXTRA_VEHICLE_SHARE)
+    for i in range(1, 6):
+        present = vehicles >= i
+        df[f'CONTRIBUTING FACTOR VEHICLE {i}'] = np.where(present, _choice(rng, FACTORS, n), None)
+        df[f'VEHICLE TYPE CODE {i}'] = np.where(present, _choice(rng, VEHICLES, n), None)
+
+    df['COLLISION_ID'] = np.arange(first_id, first_id + n) + 3000000
+    df['CRASH_YEAR'] = crash_datetime.astype('datetime64[Y]').astype(int) + 1970
+    df['PERSONS_INVOLVED_COUNT'] = vehicles + _counts(rng, 0.8, n)
+    df['KILLED_COUNT_PERSON'] = df['NUMBER OF PERSONS KILLED']
+    df['INJURED_COUNT_PERSON'] = df['NUMBER OF PERSONS INJURED']
+    df['MOST_COMMON_SEX'] = _choice(rng, SEXES, n)
+    return df
+
+def generate(rows, path, seed=0, chunk_rows=CHUNK_ROWS):
+    """Writes a synthetic crash CSV with the given number of rows to path, chunk by chunk."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        for start in range(0, rows, chunk_rows):
+            chunk = generate_chunk(min(chunk_rows, rows - start), rng, first_id=start)
+            chunk.to_csv(f, index=False, header=(start == 0))
+    os.replace(tmp_path, path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic NYC crash CSV")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="crashes_synthetic.csv")
+    args = parser.parse_args()
+
+    generate(args.rows, args.output, seed=args.seed)
+    print(f"Wrote {args.rows:,} rows to {args.output}")
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+
+from app.Components.DataLoader import load_data, read_csv, filter_dataframe, apply_search_filter
+from app.Components.aggregate import summarize, summarize_rows, SHARD_WORKERS
+from app.Components.charts import create_bar, create_pie, create_heatmap, create_map, create_line, get_stats
+from app.Components.dataset import Dataset
+from app.Components.export import iter_csv, iter_gzip, iter_parquet
+from app.Components.schema import memory_footprint
+
+from .generate import generate
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Filter combinations timed for every stage that takes filters
+FILTERS = {
+    'all': {},
+    'borough': {'borough': 'BROOKLYN'},
+    'borough_year': {'borough': 'BROOKLYN', 'year': 2023},
+    'factor_sex': {'factor1': 'unspecified', 'demographic': 'M'},
+    'year': {'year': 2019},
+    'year_range': {'year': [2009, 2023]},
+    'boroughs_years': {'borough': ['BROOKLYN', 'QUEENS'], 'year': [2018, 2023]},
+    'any_vehicle_year': {'vehicle': 'taxi', 'year': 2019},
+    'any_factor': {'factor': ['unsafe speed', 'driver inattention/distraction']},
+}
+
+# (search text, logic) pairs
+SEARCHES = {
+    'word': ('sedan', 'AND'),
+    'prefix': ('brook', 'AND'),
+    'two_terms': ('unsafe speed', 'AND'),
+    'or_terms': ('taxi bus', 'OR'),
+}
+
+CHARTS = {
+    'stats': get_stats,
+    'bar': create_bar,
+    'pie': create_pie,
+    'line': create_line,
+    'heatmap': create_heatmap,
+    'heatmap_weekday': lambda summary: create_heatmap(summary, 'weekday'),
+    'map': create_map,
+}
+
+
+# --- Measurement ---
+def _rss_mb():
+    """Current resident set size of the process in MB, None if it can't be read."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    return None
+
+def _peak_rss_mb():
+    """Highest resident set size the process has reached so far, in MB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def _percentiles(samples):
+    ms = np.array(samples) * 1000
+    return {
+        'runs': len(ms),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p90_ms': float(np.percentile(ms, 90)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+    }
+
+def measure(fn, repeat=5, trace=True):
+    """
+    Runs fn repeat times and returns latency percentiles, RSS before/after and the
+    process' peak RSS. With trace, one more run under tracemalloc reports the peak
+    Python allocations of a single call.
+    """
+    rss_before = _rss_mb()
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+
+    stats = _percentiles(samples)
+    rss_after = _rss_mb()
+    stats['rss_mb'] = rss_after
+    stats['rss_delta_mb'] = None if rss_before is None else rss_after - rss_before
+    stats['peak_rss_mb'] = _peak_rss_mb()
+
+    if trace:
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats['alloc_peak_mb'] = peak / 2**20
+
+    return stats, result
+
+def _consume(chunks):
+    """Drains a streaming writer and returns the number of bytes it produced."""
+    return sum(len(chunk) for chunk in chunks)
+
+
+# --- Benchmarks ---
+def run(data_path, repeat=5, load_repeat=1):
+    results = {}
+
+    def record(stage, fn, times=repeat, trace=True):
+        stats, value = measure(fn, times, trace)
+        results[stage] = stats
+        print(f"{stage:<32} p50 {stats['p50_ms']:>10.1f} ms   p99 {stats['p99_ms']:>10.1f} ms   "
+              f"peak RSS {stats['peak_rss_mb'] or 0:>8.0f} MB")
+        return value
+
+    # Loading: a cold parse of the CSV, then warm starts from the columnar cache
+    with tempfile.TemporaryDirectory() as cache_dir:
+        record('load.csv', lambda: load_data(data_path, use_cache=False), load_repeat, trace=False)
+        # The CSV parse alone: the multithreaded typed Arrow reader vs pandas with the same dtypes
+        for engine in ('arrow', 'pandas'):
+            parsed = record('parse.csv.' + engine, lambda: read_csv(data_path, engine=engine), load_repeat, trace=False)
+            results['parse.csv.' + engine]['rows_per_second'] = len(parsed) / (results['parse.csv.' + engine]['p50_ms'] / 1000)
+        load_data(data_path, cache_dir=cache_dir)
+        df = record('load.cache', lambda: load_data(data_path, cache_dir=cache_dir), load_repeat, trace=False)
+
+        ds = record('build.dataset', lambda: Dataset(df), load_repeat, trace=False)
+        results['dataset'] = {'rows': len(df), 'columns': len(df.columns), 'memory_mb': memory_footprint(df) / 2**20}
+
+        for name, inputs in FILTERS.items():
+            record('filter.' + name, lambda: filter_dataframe(ds.df, inputs, index=ds.filter_index))
+            record('filter.' + name + '.scan', lambda: filter_dataframe(ds.df, inputs), max(1, repeat // 2))
+
+        for name, (text, logic) in SEARCHES.items():
+            record('search.' + name, lambda: apply_search_filter(ds.df, text, logic, index=ds.search_index))
+
+        for name, inputs in FILTERS.items():
+            record('cube.' + name, lambda: ds.cube.query(inputs))
+            record('select.' + name, lambda: ds.filter_index.select(inputs))
+
+        dff = filter_dataframe(ds.df, FILTERS['borough'], index=ds.filter_index)
+        summary = record('summarize.borough', lambda: summarize(dff))
+        # The same rows read through a RowSelection: only the columns used are gathered
+        borough_rows = ds.filter_index.select(FILTERS['borough'])
+        record('summarize.borough.view', lambda: summarize_rows(ds.df, borough_rows))
+        # The unfiltered search path: one thread vs the shard pool
+        record('summarize.all.serial', lambda: summarize_rows(ds.df, workers=1))
+        record('summarize.all.shards', lambda: summarize_rows(ds.df))
+        results['dataset']['shard_workers'] = SHARD_WORKERS
+        # Dropdown counts of the vehicle types of any slot, from the packed slot codes
+        record('facet.vehicle', lambda: ds.facet_options('vehicle', FILTERS['borough']))
+        record('geo.borough', lambda: ds.geo.summary(ds.filter_index.select(FILTERS['borough'])))
+        for name, chart in CHARTS.items():
+            figure = record('chart.' + name, lambda: chart(summary))
+            # Bytes and time of the JSON encoding Dash sends the figure with
+            payload = record('serialize.' + name, lambda: to_json_plotly(figure))
+            results['serialize.' + name]['payload_bytes'] = len(payload)
+
+        rows = ds.filter_index.select(FILTERS['borough'])
+        results['dataset']['export_rows'] = len(rows)
+        parts = [(ds.df, rows)]
+        record('export.csv', lambda: _consume(iter_csv(parts)), max(1, repeat // 2))
+        record('export.csv_gz', lambda: _consume(iter_gzip(iter_csv(parts))), max(1, repeat // 2))
+        record('export.parquet', lambda: _consume(iter_parquet(parts)), max(1, repeat // 2))
+
+    return results
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the dashboard's hot paths on a synthetic dataset")
+    parser.add_argument("--rows", type=int, default=100_000, help="rows to generate (ignored with --data)")
+    parser.add_argument("--data", help="existing crash CSV to benchmark instead of generating one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per request-path stage")
+    parser.add_argument("--load-repeat", type=int, default=1, help="timed runs per load/build stage")
+    parser.add_argument("--output", default="benchmark_results.json", help="path of the JSON report")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_path = args.data
+        if data_path is None:
+            data_path = generate(args.rows, os.path.join(work_dir, "crashes.csv"), seed=args.seed)
+
+        report = {
+            'environment': environment(),
+            'config': {'rows': args.rows, 'data': args.data, 'seed': args.seed,
+                       'repeat': args.repeat, 'load_repeat': args.load_repeat},
+            'results': run(data_path, args.repeat, args.load_repeat),
+        }
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote benchmark report to {args.output}")